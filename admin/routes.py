@@ -4,8 +4,15 @@ import os
 import json
 import csv
 import io
+import threading
 from functools import wraps
 from datetime import datetime
+from model_registry import registry
+import audit_log
+import history_store
+import drift_monitor
+import counterfeit_index
+import admission
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -16,46 +23,46 @@ ADMIN_CREDENTIALS = {
     'password_hash': 'scrypt:32768:8:1$r9FyRksSCXmRR9SG$fa789d55866a1e9889a7c386a8469db76670e32fca59725874f45e411ac2a620b850fef19b4147c4e302aa465a17e8e18e44162bef655570078f3eba989e1af7'
 }
 
-HISTORY_FILE = 'scan_history.json'
-AUDIT_FILE = 'audit_logs.json'
+MODELS_DIR = 'models'
+TREND_POINTS = {'minute': 60, 'hour': 48, 'day': 30}  # Default window per granularity
 
 # --- Helpers ---
 
 def load_history_data():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except:
-                return []
-    return []
-
-def save_history_data(data):
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    return history_store.load_all()
 
 def log_audit(action, details, user='admin'):
-    logs = []
-    if os.path.exists(AUDIT_FILE):
-        with open(AUDIT_FILE, 'r') as f:
+    # Queued for the background writer (append-only, batched, rotated)
+    audit_log.log(action, details, user)
+
+def update_counterfeit_index(status, scans):
+    """
+    Confirmed FAKEs join the series index of every loaded model version;
+    anything else leaves it. Embedding costs a forward pass, so it runs in
+    the background.
+    """
+    if not scans:
+        return
+    def _run():
+        for version in registry.versions():
             try:
-                logs = json.load(f)
-            except:
-                logs = []
-    
-    entry = {
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'user': user,
-        'action': action,
-        'details': details
-    }
-    
-    logs.insert(0, entry) # Prepend
-    # Keep last 1000 logs
-    logs = logs[:1000]
-    
-    with open(AUDIT_FILE, 'w') as f:
-        json.dump(logs, f, indent=2)
+                if status == 'FAKE':
+                    counterfeit_index.add_confirmed(scans, version)
+                else:
+                    counterfeit_index.remove_confirmed([s['id'] for s in scans], version)
+            except Exception as e:
+                print(f"Counterfeit index update failed for {version}: {e}")
+    threading.Thread(target=_run, daemon=True).start()
+
+@admin_bp.context_processor
+def inject_risk_count():
+    # Sidebar badge; counter row maintained by triggers, so O(1) per page
+    if 'admin_logged_in' not in session:
+        return {}
+    try:
+        return {'risk_count': history_store.risk_count()}
+    except Exception:
+        return {}
 
 def login_required(f):
     @wraps(f)
@@ -116,11 +123,12 @@ def dashboard():
     # Recent scans (last 5)
     recent_scans = history[:5]
     
-    # Notifications Logic
+    # Notifications Logic (live scans only; a bulk archive re-scan is not a spike)
     notifications = []
+    live = [h for h in history if h.get('source') != 'bulk']
     
     # 1. Fake Spike: Check if > 3 fakes in last 10 scans
-    last_10 = history[:10]
+    last_10 = live[:10]
     fake_in_last_10 = sum(1 for h in last_10 if h.get('result') == 'FAKE')
     if fake_in_last_10 >= 3:
         notifications.append({
@@ -129,14 +137,17 @@ def dashboard():
         })
         
     # 2. Low Confidence: Check if average confidence of last 5 is < 85%
-    if recent_scans:
-        recent_confs = [h.get('confidence', 0) for h in recent_scans]
+    if live:
+        recent_confs = [h.get('confidence', 0) for h in live[:5]]
         avg_recent = sum(recent_confs) / len(recent_confs)
         if avg_recent < 85:
             notifications.append({
                 'type': 'warning',
                 'message': f'Recent scans showing low confidence ({avg_recent:.1f}% avg).'
             })
+    
+    # 3. Score drift vs the evaluation baseline
+    notifications.extend(drift_monitor.alerts())
 
     # Model Info
     model_path = 'final_model.h5'
@@ -151,6 +162,12 @@ def dashboard():
             'date': mtime
         }
     
+    # Trend chart from the pre-aggregated rollups
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in TREND_POINTS:
+        granularity = 'hour'
+    trends = history_store.trend_series(granularity, TREND_POINTS[granularity])
+    
     return render_template('admin/dashboard.html', 
                            total_scans=total_scans,
                            real_count=real_count,
@@ -160,7 +177,8 @@ def dashboard():
                            avg_confidence=round(avg_confidence, 1),
                            recent_scans=recent_scans,
                            model_info=model_info,
-                           notifications=notifications)
+                           notifications=notifications,
+                           trends=trends)
 
 @admin_bp.route('/history')
 @login_required
@@ -237,23 +255,82 @@ def export_history(format_type):
 @admin_bp.route('/delete_scan', methods=['POST'])
 @login_required
 def delete_scan():
+    scan_id = request.form.get('scan_id')
     timestamp = request.form.get('timestamp')
-    history_data = load_history_data()
     
-    # Filter out the item with the matching timestamp
-    # Note: Using timestamp as ID is risky if duplicates exist, but sufficient for this scope
-    new_history = [h for h in history_data if h.get('timestamp') != timestamp]
+    # Stable scan ID when available; timestamp kept for old links
+    if scan_id or timestamp:
+        target = {'scan_ids': [scan_id]} if scan_id else {'filters': {'since': timestamp, 'until': timestamp}}
+        update_counterfeit_index('DELETED', history_store.get_scans(**target))
+        deleted = history_store.bulk_delete(**target)
+    else:
+        deleted = 0
     
-    save_history_data(new_history)
-    log_audit('DELETE', f'Deleted scan from {timestamp}')
-    flash('Scan record deleted.', 'success')
+    if deleted:
+        log_audit('DELETE', f'Deleted scan {scan_id or timestamp}')
+        flash('Scan record deleted.', 'success')
+    else:
+        flash('Scan not found.', 'danger')
     return redirect(url_for('admin.history'))
 
+@admin_bp.route('/scans/bulk', methods=['POST'])
+@login_required
+def bulk_scans():
+    """
+    Bulk verify/delete by scan IDs or by filter, in one transaction with one
+    audit entry. Accepts a form post (admin pages) or JSON:
+    {"action": "verify"|"delete", "status": "REAL"|"FAKE", "scan_ids": [...], "filter": {...}}
+    """
+    if request.is_json:
+        payload = request.get_json()
+        action = payload.get('action')
+        status = payload.get('status')
+        scan_ids = payload.get('scan_ids') or []
+        filters = payload.get('filter') or {}
+    else:
+        action = request.form.get('action')
+        status = request.form.get('status')
+        scan_ids = request.form.getlist('scan_id')
+        filters = {k: request.form.get(k) for k in ['result', 'min_confidence', 'max_confidence', 'since', 'until', 'verified']
+                   if request.form.get(k)}
+    
+    try:
+        if not scan_ids and not filters:
+            raise ValueError('No scans selected.')
+        target = f'{len(scan_ids)} selected scans' if scan_ids else f'scans matching {filters}'
+        
+        if action == 'verify':
+            if status not in ('REAL', 'FAKE'):
+                raise ValueError('Status must be REAL or FAKE.')
+            targeted = history_store.get_scans(scan_ids=scan_ids, filters=filters)
+            before = history_store.bulk_verify(status, scan_ids=scan_ids, filters=filters)
+            update_counterfeit_index(status, targeted)
+            count = sum(before.values())
+            was = ', '.join(f'{n} {k}' for k, n in before.items())
+            log_audit('BULK_VERIFY', f'{count} of {target} verified as {status} (was {was or "none"})')
+            message = f'{count} scan(s) verified as {status}.'
+        elif action == 'delete':
+            update_counterfeit_index('DELETED', history_store.get_scans(scan_ids=scan_ids, filters=filters))
+            count = history_store.bulk_delete(scan_ids=scan_ids, filters=filters)
+            log_audit('BULK_DELETE', f'Deleted {count} of {target}')
+            message = f'{count} scan record(s) deleted.'
+        else:
+            raise ValueError('Unknown bulk action.')
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(request.referrer or url_for('admin.history'))
+    
+    if request.is_json:
+        return jsonify({'status': 'success', 'action': action, 'count': count})
+    flash(message, 'success')
+    return redirect(request.referrer or url_for('admin.history'))
+
 @admin_bp.route('/clear_history', methods=['POST'])
 @login_required
 def clear_all_history():
-    if os.path.exists(HISTORY_FILE):
-        os.remove(HISTORY_FILE)
+    history_store.clear()
     log_audit('CLEAR_HISTORY', 'Cleared all scan history')
     flash('All history cleared.', 'warning')
     return redirect(url_for('admin.dashboard'))
@@ -263,14 +340,30 @@ def clear_all_history():
 @admin_bp.route('/audit')
 @login_required
 def audit_logs():
-    logs = []
-    if os.path.exists(AUDIT_FILE):
-        with open(AUDIT_FILE, 'r') as f:
-            try:
-                logs = json.load(f)
-            except:
-                logs = []
-    return render_template('admin/audit.html', logs=logs)
+    # Filtering
+    action_filter = request.args.get('action', '')
+    user_filter = request.args.get('user', '')
+    since = request.args.get('since', '').replace('T', ' ')
+    until = request.args.get('until', '').replace('T', ' ')
+    
+    # Pagination
+    page = int(request.args.get('page', 1))
+    per_page = 50
+    logs, total = audit_log.query(action=action_filter or None, user=user_filter or None,
+                                  since=since or None, until=until or None,
+                                  page=page, per_page=per_page)
+    total_pages = max(1, (total + per_page - 1) // per_page)
+    
+    return render_template('admin/audit.html',
+                           logs=logs,
+                           total=total,
+                           page=page,
+                           total_pages=total_pages,
+                           actions=audit_log.known_actions(),
+                           action_filter=action_filter,
+                           user_filter=user_filter,
+                           since=since,
+                           until=until)
 
 @admin_bp.route('/performance')
 @login_required
@@ -305,14 +398,29 @@ def performance():
     
     overall_avg = sum(all_confs) / len(all_confs) if all_confs else 0
     
-    if overall_avg < 65:
-        health_status = "Degraded"
-        health_color = "danger"
-        health_icon = "fa-exclamation-triangle"
-    elif overall_avg < 80:
-        health_status = "Monitor"
-        health_color = "warning"
-        health_icon = "fa-stethoscope"
+    # Prefer score drift over recent windows; the lifetime average reacts too slowly
+    drift = drift_monitor.check()
+    recent_drift = drift['recent']
+    if recent_drift and recent_drift['status'] != 'insufficient':
+        health_basis = f"Score drift, last {drift_monitor.RECENT_WINDOWS}h (PSI {recent_drift['psi']})"
+        if recent_drift['status'] == 'drift':
+            health_status = "Degraded"
+            health_color = "danger"
+            health_icon = "fa-exclamation-triangle"
+        elif recent_drift['status'] == 'shifting':
+            health_status = "Monitor"
+            health_color = "warning"
+            health_icon = "fa-stethoscope"
+    else:
+        health_basis = "Based on confidence stability"
+        if overall_avg < 65:
+            health_status = "Degraded"
+            health_color = "danger"
+            health_icon = "fa-exclamation-triangle"
+        elif overall_avg < 80:
+            health_status = "Monitor"
+            health_color = "warning"
+            health_icon = "fa-stethoscope"
         
     # Live Stats Calculation
     total_scans = len(history)
@@ -332,41 +440,113 @@ def performance():
         'max_conf': round(max_conf, 1),
         'health_status': health_status,
         'health_color': health_color,
-        'health_icon': health_icon
+        'health_icon': health_icon,
+        'health_basis': health_basis
     }
     
+    # Per-version score distributions (serving, shadow and standby models)
+    model_versions = registry.summary()
+    candidate_files = []
+    if os.path.isdir(MODELS_DIR):
+        candidate_files = sorted(f for f in os.listdir(MODELS_DIR) if f.endswith('.h5'))
+    
     return render_template('admin/performance.html', 
                            data=model_data, 
-                           stats=dynamic_stats)
+                           stats=dynamic_stats,
+                           model_versions=model_versions,
+                           candidate_files=candidate_files,
+                           drift=drift,
+                           psi_alert=drift_monitor.PSI_ALERT)
+
+@admin_bp.route('/models/load', methods=['POST'])
+@login_required
+def load_model_version():
+    filename = request.form.get('filename', '')
+    # Only files inside models/ can be loaded
+    model_path = os.path.join(MODELS_DIR, os.path.basename(filename))
+    if not filename or not os.path.exists(model_path):
+        flash('Model file not found.', 'danger')
+        return redirect(url_for('admin.performance'))
+    
+    registry.load_async(model_path)
+    log_audit('MODEL_LOAD', f'Background load started for {model_path}')
+    flash(f'Loading {filename} in the background. Refresh to see it listed.', 'info')
+    return redirect(url_for('admin.performance'))
+
+@admin_bp.route('/models/activate', methods=['POST'])
+@login_required
+def activate_model_version():
+    version = request.form.get('version')
+    try:
+        previous = registry.active_version
+        registry.activate(version)
+        log_audit('MODEL_ACTIVATE', f'Serving model switched from {previous} to {version}')
+        flash(f'Now serving {version}.', 'success')
+    except KeyError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('admin.performance'))
+
+@admin_bp.route('/models/shadow', methods=['POST'])
+@login_required
+def shadow_model_version():
+    version = request.form.get('version') or None
+    try:
+        rate = float(request.form.get('rate', 0.1))
+        registry.set_shadow(version, rate)
+        if version:
+            log_audit('MODEL_SHADOW', f'Shadow scoring {version} on {rate * 100:.0f}% of traffic')
+            flash(f'Shadow scoring {version} on {rate * 100:.0f}% of traffic.', 'success')
+        else:
+            log_audit('MODEL_SHADOW', 'Shadow scoring stopped')
+            flash('Shadow scoring stopped.', 'info')
+    except (KeyError, ValueError) as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('admin.performance'))
+
+@admin_bp.route('/metrics')
+@login_required
+def metrics():
+    return jsonify({
+        'history_writer': history_store.writer.stats(),
+        'admission': admission.stats()
+    })
+
+@admin_bp.route('/api/trends')
+@login_required
+def trends_api():
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in TREND_POINTS:
+        return jsonify({'error': f'granularity must be one of {sorted(TREND_POINTS)}'}), 400
+    points = request.args.get('points', TREND_POINTS[granularity], type=int)
+    points = max(1, min(points, 1000))
+    return jsonify(history_store.trend_series(granularity, points))
+
+@admin_bp.route('/api/drift')
+@login_required
+def drift_api():
+    return jsonify(drift_monitor.check())
 
 @admin_bp.route('/verify_scan', methods=['POST'])
 @login_required
 def verify_scan():
+    scan_id = request.form.get('scan_id')
     timestamp = request.form.get('timestamp')
     new_status = request.form.get('status') # 'REAL' or 'FAKE'
     
-    if not timestamp or not new_status:
+    if not (scan_id or timestamp) or new_status not in ('REAL', 'FAKE'):
         flash('Missing data for verification.', 'danger')
         return redirect(url_for('admin.risk_heatmap'))
-        
-    history = load_history_data()
     
-    # Find and update
-    updated = False
-    for item in history:
-        if item.get('timestamp') == timestamp:
-            old_status = item.get('result')
-            item['result'] = new_status
-            item['verified_by_admin'] = True
-            item['admin_verified_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            # Set confidence to 100% since it's human verified
-            item['confidence'] = 100.0 
-            updated = True
-            log_audit('VERIFY', f'Scan {timestamp} verified as {new_status} (was {old_status})')
-            break
-            
+    # Stable scan ID when available; timestamp kept for old links
+    target = {'scan_ids': [scan_id]} if scan_id else {'filters': {'since': timestamp, 'until': timestamp}}
+    targeted = history_store.get_scans(**target)
+    before = history_store.bulk_verify(new_status, **target)
+    update_counterfeit_index(new_status, targeted)
+    
+    updated = sum(before.values()) > 0
     if updated:
-        save_history_data(history)
+        old_status = ', '.join(before)
+        log_audit('VERIFY', f'Scan {scan_id or timestamp} verified as {new_status} (was {old_status})')
         flash(f'Scan successfully verified as {new_status}.', 'success')
     else:
         flash('Scan not found.', 'danger')
@@ -377,12 +557,15 @@ def verify_scan():
 @admin_bp.route('/risk')
 @login_required
 def risk_heatmap():
-    history = load_history_data()
-    # Filter for High Risk: Low confidence (<85%) or FAKE
-    # Exclude if verified by admin and result is REAL (Admin cleared the risk)
-    risk_scans = [
-        h for h in history 
-        if (h.get('confidence', 0) < 85 or h.get('result') == 'FAKE') 
-        and not (h.get('verified_by_admin') and h.get('result') == 'REAL')
-    ]
-    return render_template('admin/risk.html', scans=risk_scans)
+    # High Risk: Low confidence (<85%) or FAKE, excluding admin-cleared REAL.
+    # The risk flag is maintained as scans are written/verified, so this is an index read.
+    page = int(request.args.get('page', 1))
+    per_page = 24
+    total = history_store.risk_count()
+    total_pages = max(1, (total + per_page - 1) // per_page)
+    risk_scans = history_store.risk_queue(page=page, per_page=per_page)
+    return render_template('admin/risk.html', 
+                           scans=risk_scans, 
+                           page=page, 
+                           total=total, 
+                           total_pages=total_pages)
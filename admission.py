@@ -0,0 +1,176 @@
+import time
+import threading
+from collections import deque
+from functools import wraps
+from flask import request, jsonify
+
+# Configuration
+# Priority classes, highest first. Counter scans must not wait behind bulk
+# re-scans or an admin clicking through visual analyses.
+PRIORITIES = ['interactive', 'bulk', 'visual']
+INFERENCE_SLOTS = 2          # Requests running inference at once, per worker process
+RATE_LIMITS = {              # Per client: (tokens per second, burst)
+    'interactive': (5.0, 10),
+    'bulk': (20.0, 40),
+    'visual': (2.0, 6)
+}
+QUEUE_LIMITS = {'interactive': 32, 'bulk': 16, 'visual': 8}    # Waiting requests before 503
+MAX_WAIT = {'interactive': 10.0, 'bulk': 30.0, 'visual': 5.0}  # Seconds in the queue before 503
+PRIORITY_HEADER = 'X-Scan-Priority'   # 'bulk' lets scripted re-scans step aside for counter scans
+CLIENT_HEADER = None                  # e.g. 'X-Client-Id' behind a trusted proxy; default is the remote address
+BUCKET_IDLE_SECONDS = 600             # Idle client buckets are dropped after this
+WAIT_SAMPLES = 1000                   # Recent queue waits kept per class for percentiles
+
+
+class Rejected(Exception):
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Returns 0 if a token was taken, otherwise seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Rate limits per client and class, then hands out INFERENCE_SLOTS by
+    strict priority (FIFO within a class). Queues are bounded, so overload
+    is refused quickly with 429 (client over its rate) or 503 (server busy)
+    instead of piling up behind the workers.
+    """
+
+    def __init__(self, slots=INFERENCE_SLOTS):
+        self._lock = threading.Lock()
+        self._slots = slots
+        self._in_flight = 0
+        self._queues = {p: deque() for p in PRIORITIES}
+        self._buckets = {}
+        self._last_prune = time.monotonic()
+        self._stats = {p: {'admitted': 0, 'rate_limited': 0, 'queue_full': 0, 'timed_out': 0,
+                           'waits': deque(maxlen=WAIT_SAMPLES)} for p in PRIORITIES}
+
+    def acquire(self, priority, client):
+        """Blocks until a slot is granted; raises Rejected otherwise. Returns the queue wait in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats[priority]
+            self._prune_buckets(now)
+            bucket = self._buckets.get((client, priority))
+            if bucket is None:
+                bucket = self._buckets[(client, priority)] = TokenBucket(*RATE_LIMITS[priority])
+            retry_after = bucket.take(now)
+            if retry_after:
+                stats['rate_limited'] += 1
+                raise Rejected(429, f'Too many {priority} requests; slow down.', retry_after)
+
+            if self._in_flight < self._slots and not any(self._queues.values()):
+                self._in_flight += 1
+                stats['admitted'] += 1
+                stats['waits'].append(0.0)
+                return 0.0
+            if len(self._queues[priority]) >= QUEUE_LIMITS[priority]:
+                stats['queue_full'] += 1
+                raise Rejected(503, 'Server busy; try again shortly.', 1.0)
+            waiter = {'event': threading.Event(), 'granted': False}
+            self._queues[priority].append(waiter)
+
+        waiter['event'].wait(MAX_WAIT[priority])
+        with self._lock:
+            wait = time.monotonic() - now
+            if not waiter['granted']:
+                self._queues[priority].remove(waiter)
+                stats['timed_out'] += 1
+                raise Rejected(503, 'Server busy; try again shortly.', 1.0)
+            stats['admitted'] += 1
+            stats['waits'].append(wait)
+            return wait
+
+    def release(self):
+        with self._lock:
+            for priority in PRIORITIES:
+                if self._queues[priority]:
+                    # Hand the slot straight to the next waiter; in_flight is unchanged
+                    waiter = self._queues[priority].popleft()
+                    waiter['granted'] = True
+                    waiter['event'].set()
+                    return
+            self._in_flight -= 1
+
+    def _prune_buckets(self, now):
+        # Caller holds the lock
+        if now - self._last_prune < BUCKET_IDLE_SECONDS:
+            return
+        self._last_prune = now
+        self._buckets = {k: b for k, b in self._buckets.items() if now - b.updated < BUCKET_IDLE_SECONDS}
+
+    def stats(self):
+        with self._lock:
+            result = {'slots': self._slots, 'in_flight': self._in_flight, 'clients': len(self._buckets), 'classes': {}}
+            for priority in PRIORITIES:
+                s = self._stats[priority]
+                waits = sorted(s['waits'])
+                result['classes'][priority] = {
+                    'queued': len(self._queues[priority]),
+                    'admitted': s['admitted'],
+                    'rate_limited': s['rate_limited'],
+                    'queue_full': s['queue_full'],
+                    'timed_out': s['timed_out'],
+                    'wait_ms_p50': round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    'wait_ms_p95': round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else None,
+                    'wait_ms_max': round(waits[-1] * 1000, 1) if waits else None
+                }
+            return result
+
+
+controller = AdmissionController()
+
+
+def stats():
+    return controller.stats()
+
+
+def _client():
+    if CLIENT_HEADER and request.headers.get(CLIENT_HEADER):
+        return request.headers[CLIENT_HEADER]
+    return request.remote_addr or 'unknown'
+
+
+def admitted(priority):
+    """
+    Route decorator: runs the view only once admitted in `priority`. A
+    request to an 'interactive' route may lower itself to 'bulk' with the
+    PRIORITY_HEADER (it can never raise itself).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            requested = request.headers.get(PRIORITY_HEADER, '').lower()
+            effective = priority
+            if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(priority):
+                effective = requested
+            try:
+                controller.acquire(effective, _client())
+            except Rejected as e:
+                response = jsonify({'error': str(e), 'priority': effective})
+                return response, e.status, {'Retry-After': str(max(1, int(e.retry_after + 0.999)))}
+            try:
+                return f(*args, **kwargs)
+            finally:
+                controller.release()
+        return decorated_function
+    return decorator
@@ -1,14 +1,26 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, url_for
 from flask_cors import CORS
 import os
+import io
 import json
 import numpy as np
 import datetime
-from model_loader import load_currency_model
-from preprocess import preprocess_image
+from model_loader import MODEL_PATH
+from model_registry import registry
+from preprocess import preprocess_image, pixels_to_array, parse_size
 from explainability import analyze_image_quality
+from denomination import route_denomination, get_pipeline, preload_pipelines, UNKNOWN_DENOMINATION
+import tiled_inference
+import verification
+import saliency
+import feature_check
+import admission
+import warmup
+import upload_store
+import history_store
 from werkzeug.utils import secure_filename
 import cv2
+from PIL import Image
 
 app = Flask(__name__)
 app.secret_key = 'dev_secret_key_123' # Required for sessions
@@ -16,91 +28,163 @@ CORS(app)
 
 # Configuration
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-HISTORY_FILE = os.path.join(BASE_DIR, 'scan_history.json')
+UPLOAD_FOLDER = upload_store.UPLOAD_ROOT
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+upload_store.start_eviction(cache_dirs=[saliency.SALIENCY_DIR])
 
-# Load Model
-model = load_currency_model()
+# Load Model (hot-reloaded when train_model.py writes a new one)
+try:
+    registry.activate(registry.load(MODEL_PATH))
+except Exception as e:
+    print(f"Error loading model: {e}")
+registry.watch(MODEL_PATH)
+# Per-denomination models, template indexes and template images are loaded once, not per request
+preload_pipelines()
+# Pre-trace and initialise the request path in the background; /ready reports when done
+warmup.start()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except:
-                return []
-    return []
+    return history_store.load_all()
 
 def save_history(entry):
-    history = load_history()
-    history.insert(0, entry)  # Add new entry to top
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
+    # Buffered; the background writer group-commits it off the request path
+    history_store.writer.submit(entry)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/predict', methods=['POST'])
+@admission.admitted('interactive')
 def predict():
-    if 'file' not in request.files:
+    file = request.files.get('file')
+    pixels = request.files.get('pixels')
+    if file is None and pixels is None:
         return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
+    if file is not None and file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    if file is not None and not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    # Client sent the model input itself (raw RGB at the model's size): scoring and routing need no decode
+    target_size = registry.input_size()
+    img_array = tiles = None
+    if pixels is not None and not tiled_inference.TILED_ENABLED:
+        img_array = pixels_to_array(pixels.read(), request.form.get('pixels_size'), target_size)
+    if img_array is None and file is None:
+        return jsonify({'error': 'Pixel payload does not match the model input; send the file'}), 400
     
-    if file and allowed_file(file.filename):
+    # The file is optional with a valid pixel payload; without it there is no stored image,
+    # so no TTA, image-quality reasons or saliency overlay for this scan
+    data = content_hash = stored_name = filepath = None
+    filename = secure_filename(request.form.get('filename') or 'pixels.rgb')
+    if file is not None:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Preprocess
-        img_array = preprocess_image(filepath)
-        if img_array is None:
-            return jsonify({'error': 'Error processing image'}), 500
-        
-        # Predict
-        if model:
-            prediction = model.predict(img_array)
-            score = float(prediction[0][0]) # Probability of being class 1
-            
-            if score > 0.5:
-                result = "REAL"
-                confidence = score * 100
-                is_fake = False
-            else:
-                result = "FAKE"
-                confidence = (1 - score) * 100
-                is_fake = True
-            
-            reasons = []
-            if is_fake:
-                reasons = analyze_image_quality(filepath)
-            
-            response_data = {
-                'result': result,
-                'confidence': confidence, # Send as float number
-                'raw_score': float(score), # Send as float number
-                'reasons': reasons,
-                'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'filename': filename
-            }
-            
-            save_history(response_data)
-            return jsonify(response_data)
+        # Content-addressed storage: identical uploads dedupe, different ones never collide.
+        # The extension comes from the original name (checked by allowed_file): secure_filename
+        # drops non-ASCII stems, so 'фото.jpg' becomes 'jpg' with no dot left
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        data = file.read()
+        content_hash, stored_name, filepath = upload_store.save_upload(data, ext)
+    
+    if img_array is None:
+        # Preprocess the original bytes (the stored copy may be downscaled, see STORAGE_MAX_SIDE) at the
+        # serving model's input size; tiled mode decodes large scans once at reduced resolution
+        if tiled_inference.TILED_ENABLED:
+            img_array, tiles = tiled_inference.preprocess_tiled(io.BytesIO(data), target_size)
         else:
-            return jsonify({'error': 'Model not loaded'}), 500
-            
-    return jsonify({'error': 'Invalid file type'}), 400
+            img_array = preprocess_image(io.BytesIO(data), target_size)
+    if img_array is None:
+        return jsonify({'error': 'Error processing image'}), 500
+    
+    # Route to the denomination-specific pipeline from the model input; the registry
+    # resizes it if that denomination's model uses a different input size
+    original_size = parse_size(request.form.get('original_size'))
+    if original_size is None and data is not None:
+        with Image.open(io.BytesIO(data)) as img:
+            original_size = img.size  # Header only
+    denomination, _ = route_denomination(img_array, original_size or target_size)
+    if denomination == UNKNOWN_DENOMINATION:
+        # Not close to any supported note (another denomination, or not a note): no verdict to
+        # give, and nothing recorded since the history and its statistics only hold model verdicts
+        return jsonify({
+            'result': 'UNKNOWN',
+            'confidence': None,
+            'denomination': denomination,
+            'reasons': ["Not recognised as a supported note (₹500 / ₹2000)"],
+            'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'filename': filename,
+            'content_hash': content_hash,
+            'stored_name': stored_name
+        })
+    pipeline = get_pipeline(denomination)
+    
+    # Predict
+    if not registry.get_model(pipeline.model_version):
+        return jsonify({'error': 'Model not loaded'}), 500
+    cam = None
+    if saliency.SALIENCY_ENABLED:
+        # Prediction and Grad-CAM (for the class at this pipeline's threshold) from one forward/backward pass
+        scores, cams, embeddings, model_version = registry.predict_with_cam(
+            img_array, version=pipeline.model_version, threshold=pipeline.threshold)
+        cam = cams[0]
+    else:
+        scores, embeddings, model_version = registry.predict_with_embedding(img_array, version=pipeline.model_version)
+    outcome = verification.finish(float(scores[0]), embeddings[0], pipeline, model_version,
+                                  io.BytesIO(data) if data is not None else None, tiles)
+    if cam is not None:
+        if verification.verdict(float(scores[0]), pipeline.threshold)[0] != outcome['result']:
+            cam = None  # Tiles/TTA flipped the verdict; the map explains the other class
+        elif content_hash:
+            # /saliency only serves this map, drawn over the stored image; it never re-runs the model
+            saliency.save_cam(content_hash, model_version, cam)
+    
+    # Security features of the routed denomination, located with its preloaded template index
+    features = None
+    if feature_check.FEATURE_CHECK_ENABLED and data is not None:
+        try:
+            features = feature_check.check_features(data, pipeline)
+        except Exception as e:
+            print(f"Feature check failed: {e}")
+    
+    reasons = []
+    if outcome['result'] == 'FAKE':
+        if filepath:
+            reasons = analyze_image_quality(filepath, saliency_reasons=saliency.describe(cam))
+        else:
+            reasons = saliency.describe(cam)
+        reasons.extend(feature_check.describe(features))
+    if outcome['counterfeit_match']:
+        reasons.insert(0, verification.series_reason(outcome['counterfeit_match']))
+    
+    response_data = {
+        **outcome,
+        'features': features,
+        'reasons': reasons,
+        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'filename': filename,
+        'content_hash': content_hash,
+        'stored_name': stored_name,
+        # The map cached above from this scan's own forward pass
+        'saliency_url': url_for('saliency_overlay', stored_name=stored_name, version=model_version)
+                        if stored_name and cam is not None else None
+    }
+    
+    save_history(response_data)
+    return jsonify(response_data)
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the serving model is loaded and warmed up, 503 until then."""
+    state = warmup.status()
+    return jsonify(state), (200 if state['ready'] else 503)
 
 @app.route('/history', methods=['GET'])
 def get_history():
@@ -108,14 +192,17 @@ def get_history():
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history_route():
-    if os.path.exists(HISTORY_FILE):
-        os.remove(HISTORY_FILE)
+    history_store.clear()
     return jsonify({'status': 'success'})
 
 import base64
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
+    stored_path = upload_store.resolve(filename)
+    if stored_path:
+        return send_from_directory(os.path.dirname(stored_path), os.path.basename(stored_path))
+    # Legacy flat uploads from before content addressing
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/model_info')
@@ -128,15 +215,16 @@ def get_model_info():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/analyze_visuals', methods=['POST'])
+@admission.admitted('visual')
 def analyze_visuals():
     data = request.json
-    filename = data.get('filename')
+    filename = data.get('stored_name') or data.get('filename')
     print(f"DEBUG: Analyzing visuals for {filename}") # Debug Log
     
     if not filename:
         return jsonify({'error': 'No filename provided'}), 400
         
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = upload_store.resolve(filename) or os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
     print(f"DEBUG: Filepath: {filepath}") # Debug Log
     
     if not os.path.exists(filepath):
@@ -186,6 +274,27 @@ def analyze_visuals():
         print(f"DEBUG: Error in analyze_visuals: {str(e)}") # Debug Log
         return jsonify({'error': str(e)}), 500
 
+@app.route('/saliency/<stored_name>')
+@admission.admitted('visual')
+def saliency_overlay(stored_name):
+    """
+    Grad-CAM heatmap over the stored upload, from the map /predict cached
+    for (content, model version). Read-only: no model pass here.
+    """
+    filepath = upload_store.resolve(stored_name)
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    digest = stored_name.split('.', 1)[0]
+    version = request.args.get('version') or registry.active_version
+    cam = saliency.load_cam(digest, version)
+    if cam is None:
+        return jsonify({'error': f'No saliency map for this image and model version {version}'}), 404
+    
+    try:
+        return Response(saliency.overlay(filepath, cam), mimetype='image/jpeg')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Register Admin Blueprint
 from admin.routes import admin_bp
 app.register_blueprint(admin_bp)
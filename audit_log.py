@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+
+try:
+    import fcntl  # Serialises writes/rotation between gunicorn workers (POSIX only)
+except ImportError:
+    fcntl = None
+
+# Configuration
+AUDIT_LOG_PATH = 'audit_logs.jsonl'
+LEGACY_AUDIT_FILE = 'audit_logs.json'
+LOCK_PATH = AUDIT_LOG_PATH + '.lock'
+ROTATE_BYTES = 5 * 1024 * 1024       # Rotate the active file beyond this size
+ROTATE_KEEP = 5                      # audit_logs.jsonl.1 ... .5
+BATCH_MAX = 200                      # Entries per write
+FLUSH_INTERVAL = 0.5                 # Seconds the writer waits to fill a batch
+FSYNC_INTERVAL = 5.0                 # Seconds between fsyncs (always on shutdown)
+
+_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_last_fsync = 0.0
+
+
+# --- Writing ---
+
+def log(action, details, user='admin'):
+    """Queues an audit entry. Never blocks on disk."""
+    _start_writer()
+    _queue.put({
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'user': user,
+        'action': action,
+        'details': details
+    })
+
+
+def _start_writer():
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _migrate_legacy()
+            _writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+            _writer_thread.start()
+            atexit.register(flush)
+
+
+def _writer_loop():
+    while True:
+        batch = [_queue.get()]
+        deadline = time.time() + FLUSH_INTERVAL
+        while len(batch) < BATCH_MAX:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch, force_fsync=False)
+        except Exception as e:
+            print(f"Error writing audit log: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def flush():
+    """Blocks until every queued entry is on disk (fsynced)."""
+    if _writer_thread is None:
+        return
+    _queue.join()
+    _write_batch([], force_fsync=True)
+
+
+def _write_batch(batch, force_fsync):
+    global _last_fsync
+    payload = ''.join(json.dumps(entry) + '\n' for entry in batch).encode('utf-8')
+
+    with open(LOCK_PATH, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if payload and os.path.exists(AUDIT_LOG_PATH) and os.path.getsize(AUDIT_LOG_PATH) >= ROTATE_BYTES:
+            _rotate()
+
+        fd = os.open(AUDIT_LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if payload:
+                os.write(fd, payload)
+            now = time.time()
+            if force_fsync or now - _last_fsync >= FSYNC_INTERVAL:
+                os.fsync(fd)
+                _last_fsync = now
+        finally:
+            os.close(fd)
+
+
+def _rotate():
+    # Shift .1 -> .2 ... and drop the oldest; rotated files are never rewritten
+    for i in range(ROTATE_KEEP - 1, 0, -1):
+        src = f"{AUDIT_LOG_PATH}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{AUDIT_LOG_PATH}.{i + 1}")
+    os.replace(AUDIT_LOG_PATH, f"{AUDIT_LOG_PATH}.1")
+
+
+def _migrate_legacy():
+    """One-time import of the old newest-first JSON array."""
+    if not os.path.exists(LEGACY_AUDIT_FILE) or os.path.exists(AUDIT_LOG_PATH):
+        return
+    try:
+        with open(LEGACY_AUDIT_FILE, 'r') as f:
+            entries = json.load(f)
+        _write_batch(list(reversed(entries)), force_fsync=True)
+        os.replace(LEGACY_AUDIT_FILE, LEGACY_AUDIT_FILE + '.migrated')
+    except Exception as e:
+        print(f"Error migrating legacy audit log: {e}")
+
+
+# --- Reading ---
+
+class _FileIndex:
+    """Byte offset + filterable fields of every line in one log file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.indexed_bytes = 0
+        self.entries = []   # (offset, timestamp, action, user), oldest first
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.inode, self.indexed_bytes, self.entries = None, 0, []
+            return
+        if stat.st_ino != self.inode or stat.st_size < self.indexed_bytes:
+            # Rotated or replaced: index from scratch
+            self.inode, self.indexed_bytes, self.entries = stat.st_ino, 0, []
+        if stat.st_size == self.indexed_bytes:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed_bytes)
+            offset = self.indexed_bytes
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Partially written line; pick it up next time
+                try:
+                    entry = json.loads(line)
+                    self.entries.append((offset, entry.get('timestamp', ''),
+                                         entry.get('action', ''), entry.get('user', '')))
+                except ValueError:
+                    pass
+                offset += len(line)
+            self.indexed_bytes = offset
+
+    def read(self, offset):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def _log_files():
+    """Active file first, then rotated files from newest to oldest."""
+    return [AUDIT_LOG_PATH] + [f"{AUDIT_LOG_PATH}.{i}" for i in range(1, ROTATE_KEEP + 1)]
+
+
+def query(action=None, user=None, since=None, until=None, page=1, per_page=50):
+    """
+    Newest-first page of audit entries filtered by action/user/time range
+    ('YYYY-MM-DD HH:MM:SS' prefixes). Only the lines on the requested page
+    are read from disk. Returns (entries, total_matches).
+    """
+    with _index_lock:
+        matches = []
+        for path in _log_files():
+            index = _indexes.setdefault(path, _FileIndex(path))
+            index.refresh()
+            for offset, ts, act, usr in reversed(index.entries):
+                if action and act != action:
+                    continue
+                if user and usr != user:
+                    continue
+                if since and ts < since:
+                    continue
+                if until and ts[:len(until)] > until:
+                    continue
+                matches.append((index, offset))
+
+    start = (page - 1) * per_page
+    entries = []
+    for index, offset in matches[start:start + per_page]:
+        try:
+            entries.append(index.read(offset))
+        except (OSError, ValueError):
+            continue  # Rotated away between indexing and reading
+    return entries, len(matches)
+
+
+def known_actions():
+    with _index_lock:
+        return sorted({act for index in _indexes.values() for _, _, act, _ in index.entries})
@@ -0,0 +1,250 @@
+import os
+import io
+import time
+import signal
+import queue
+import argparse
+import datetime
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+import history_store
+from upload_store import content_hash
+
+# Configuration
+BATCH_SIZE = 64
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+QUEUE_SIZE = 4               # Batches in flight per stage; bounds memory on huge trees
+COMMIT_EVERY = 500           # Scans per history transaction (and checkpoint)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def find_images(root):
+    """Deterministic walk so every run sees the same order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.abspath(os.path.join(dirpath, fname))
+
+
+# --- Decode workers (separate processes) ---
+
+def _init_worker():
+    # Ctrl+C is handled by the parent, which drains and commits before exiting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _decode(path, target_size):
+    """
+    Reads and resizes one image with PIL/numpy only, so workers never import
+    TensorFlow. Returns (path, pixels, tiles, digest, original_size): uint8
+    RGB at target_size (the same resize as preprocess_image), normalised
+    later in the main thread; in tiled mode the float whole-note view.
+    """
+    import tiled_inference
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        tiles = None
+        if tiled_inference.TILED_ENABLED:
+            with Image.open(io.BytesIO(data)) as img:
+                original_size = img.size  # Header only
+            pixels, tiles = tiled_inference.preprocess_tiled(io.BytesIO(data), target_size)
+            pixels = pixels[0] if pixels is not None else None
+        else:
+            with Image.open(io.BytesIO(data)) as img:
+                original_size = img.size
+                pixels = np.asarray(img.convert('RGB').resize(target_size, Image.NEAREST), dtype=np.uint8)
+    except Exception as e:
+        if not isinstance(e, OSError):
+            print(f"Error decoding {path}: {e}")
+        return path, None, None, None, None
+    return path, pixels, tiles, content_hash(data), original_size
+
+
+def _model_input(item, target_size):
+    """Main thread: normalises a worker's uint8 pixels as /predict does a client pixel payload."""
+    from preprocess import pixels_to_array
+    path, pixels, tiles, digest, original_size = item
+    if pixels is not None and pixels.dtype == np.uint8:
+        pixels = pixels_to_array(pixels.tobytes(), f'{target_size[0]}x{target_size[1]}', target_size)[0]
+    return path, pixels, tiles, digest, original_size
+
+
+def _reasons(path, saliency_reasons=None):
+    from explainability import analyze_image_quality
+    return analyze_image_quality(path, saliency_reasons=saliency_reasons)
+
+
+def _file_time(path):
+    try:
+        return datetime.datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+    except OSError:
+        return None
+
+
+# --- Pipeline stages ---
+
+def _feed(executor, paths, target_size, decoded_q, stop):
+    """Stage 1: submits decode jobs one batch at a time; blocks when the queue is full."""
+    for i in range(0, len(paths), BATCH_SIZE):
+        if stop.is_set():
+            break
+        decoded_q.put([executor.submit(_decode, p, target_size) for p in paths[i:i + BATCH_SIZE]])
+    decoded_q.put(None)
+
+
+def _write(run, result_q, progress):
+    """Stage 3: commits scans and their checkpoints in bulk."""
+    buffer = []
+    while True:
+        rows = result_q.get()
+        if rows is not None:
+            for path, record, reasons_future in rows:
+                if record is not None and reasons_future is not None:
+                    try:
+                        record['reasons'].extend(reasons_future.result())
+                    except Exception as e:
+                        print(f"Error analysing {path}: {e}")
+                buffer.append((path, record))
+        if buffer and (rows is None or len(buffer) >= COMMIT_EVERY):
+            history_store.insert_bulk(run, buffer)
+            progress['done'] += len(buffer)
+            progress['failed'] += sum(1 for _, record in buffer if record is None)
+            buffer = []
+            elapsed = time.time() - progress['start']
+            print(f"  {progress['done']}/{progress['total']} committed "
+                  f"({progress['done'] / max(elapsed, 1e-6):.1f} img/s, {progress['failed']} skipped)")
+        if rows is None:
+            return
+
+
+def run_scan(root, model_path, run=None, restart=False, workers=DECODE_WORKERS, explain=False):
+    run = run or os.path.abspath(root)
+    if restart:
+        history_store.reset_bulk_progress(run)
+
+    done = history_store.bulk_completed(run)
+    paths = [p for p in find_images(root) if p not in done]
+    print(f"Run '{run}': {len(done)} already committed, {len(paths)} to scan")
+    if not paths:
+        return
+
+    # Spawned (not forked) workers: forking after TensorFlow initialises is unsafe
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                   initializer=_init_worker)
+
+    # Same routing, per-denomination models, thresholds, TTA and series matching as /predict
+    from model_registry import registry
+    from denomination import route_denomination, get_pipeline
+    import saliency
+    import verification
+    try:
+        registry.activate(registry.load(model_path))
+    except Exception:
+        executor.shutdown()
+        raise
+    target_size = registry.input_size()
+
+    decoded_q = queue.Queue(maxsize=QUEUE_SIZE)
+    result_q = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    progress = {'done': 0, 'failed': 0, 'unknown': 0, 'total': len(paths), 'start': time.time()}
+
+    feeder = threading.Thread(target=_feed, args=(executor, paths, target_size, decoded_q, stop), daemon=True)
+    writer = threading.Thread(target=_write, args=(run, result_q, progress), daemon=True)
+    feeder.start()
+    writer.start()
+
+    # Stage 2 (main thread): batched inference
+    try:
+        while True:
+            futures = decoded_q.get()
+            if futures is None:
+                break
+            decoded = [_model_input(f.result(), target_size) for f in futures]
+            rows = [(path, None, None) for path, arr, *_ in decoded if arr is None]
+
+            # Route each image, then score every denomination's images in one batch on its model
+            groups = {}
+            for item in decoded:
+                path, arr, tiles, digest, original_size = item
+                if arr is not None:
+                    denomination, _ = route_denomination(arr[np.newaxis], original_size)
+                    if denomination == UNKNOWN_DENOMINATION:
+                        # Not a supported note: checkpointed like an unreadable file, no verdict recorded
+                        rows.append((path, None, None))
+                        progress['unknown'] += 1
+                        continue
+                    pipeline = get_pipeline(denomination)
+                    groups.setdefault(pipeline.denomination, (pipeline, []))[1].append(item)
+
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for pipeline, items in groups.values():
+                batch = np.stack([arr for _, arr, *_ in items])
+                # record=False: archive scores stay out of the live per-version statistics
+                if explain:
+                    # Scores and Grad-CAM maps for the whole batch in one pass
+                    scores, cams, embeddings, model_version = registry.predict_with_cam(
+                        batch, version=pipeline.model_version, record=False, threshold=pipeline.threshold)
+                else:
+                    scores, embeddings, model_version = registry.predict_with_embedding(
+                        batch, version=pipeline.model_version, record=False)
+                    cams = [None] * len(items)
+
+                for (path, _, tiles, digest, _), score, embedding, cam in zip(items, scores, embeddings, cams):
+                    outcome = verification.finish(float(score), embedding, pipeline, model_version, path, tiles)
+                    if cam is not None:
+                        if verification.verdict(float(score), pipeline.threshold)[0] == outcome['result']:
+                            saliency.save_cam(digest, model_version, cam)
+                        else:
+                            cam = None  # Tiles/TTA flipped the verdict; the map explains the other class
+                    record = {
+                        **outcome,
+                        'reasons': [],
+                        'timestamp': timestamp,
+                        'file_time': _file_time(path),
+                        'filename': os.path.basename(path),
+                        'source_path': path,
+                        'content_hash': digest,
+                        'source': 'bulk',   # Kept out of the live rollups, trends and drift
+                        'bulk_run': run
+                    }
+                    if outcome['counterfeit_match']:
+                        record['reasons'].append(verification.series_reason(outcome['counterfeit_match']))
+                    # Explanations only for fakes, computed on the decode pool
+                    reasons = executor.submit(_reasons, path, saliency.describe(cam)) if outcome['result'] == 'FAKE' else None
+                    rows.append((path, record, reasons))
+            result_q.put(rows)
+    except KeyboardInterrupt:
+        print("Interrupted; committing scored images. Re-run the same command to resume.")
+        stop.set()
+        while decoded_q.get() is not None:
+            pass  # Unblock the feeder
+    finally:
+        result_q.put(None)
+        writer.join()
+        executor.shutdown(cancel_futures=True)
+
+    elapsed = time.time() - progress['start']
+    print(f"Done: {progress['done']} images in {elapsed:.1f}s ({progress['failed'] - progress['unknown']} unreadable, "
+          f"{progress['unknown']} not a supported note)")
+
+
+if __name__ == '__main__':
+    from model_loader import MODEL_PATH
+    parser = argparse.ArgumentParser(description='Scan a directory tree of note images into the scan history.')
+    parser.add_argument('root', help='Directory to scan (recursively)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--run', help='Checkpoint key (default: absolute path of root)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and rescan everything')
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS, help='Decode processes')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--saliency', action='store_true', help='Also cache Grad-CAM maps (same pass as scoring)')
+    args = parser.parse_args()
+
+    BATCH_SIZE = args.batch_size
+    run_scan(args.root, args.model, args.run, args.restart, args.workers, args.saliency)
@@ -0,0 +1,354 @@
+import os
+import json
+import argparse
+import threading
+import numpy as np
+
+try:
+    import fcntl  # Serialises appends between gunicorn workers (POSIX only)
+except ImportError:
+    fcntl = None
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+INDEX_ROOT = os.path.join(BASE_DIR, 'counterfeit_index')
+PROJECTION_DIM = 256         # Random projection of the pooled embedding (cosine is preserved)
+MATCH_SIMILARITY = 0.92      # Cosine similarity at which a scan matches a known counterfeit
+TRAIN_MIN = 2048             # Exact search below this; IVF (coarse k-means lists) above
+RETRAIN_GROWTH = 4           # Re-cluster when the index has grown this much since training
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+NPROBE = 8                   # Lists searched per query
+REBUILD_BATCH = 32
+ASSIGN_CHUNK = 16384         # Rows per centroid-assignment product (bounds the rows x lists matrix)
+
+
+def _safe(version):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in (version or 'default'))
+
+
+def _projection(input_dim):
+    # Fixed seed: every worker (and every restart) projects identically
+    rng = np.random.default_rng(1234)
+    return (rng.standard_normal((input_dim, PROJECTION_DIM)) / np.sqrt(PROJECTION_DIM)).astype(np.float32)
+
+
+def _normalise(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _contiguous(rows):
+    return len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1
+
+
+def _kmeans(x, k):
+    rng = np.random.default_rng(0)
+    sample = x[rng.choice(len(x), size=min(len(x), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(k):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalise(centroids)
+    return centroids
+
+
+class CounterfeitIndex:
+    """
+    Approximate nearest-neighbour index (IVF) over projected, L2-normalised
+    backbone embeddings of admin-confirmed counterfeits, for one model
+    version. Append-only on disk: vectors.f32 holds rows, entries.jsonl
+    holds add/remove operations (the commit point), centroids.npz the
+    coarse quantiser. Other workers' inserts are picked up by refresh().
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.directory = os.path.join(INDEX_ROOT, _safe(version))
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.entries_path = os.path.join(self.directory, 'entries.jsonl')
+        self.centroids_path = os.path.join(self.directory, 'centroids.npz')
+        self.lock_path = os.path.join(self.directory, '.lock')
+        self.built_path = os.path.join(self.directory, 'built')
+        self._lock = threading.Lock()
+
+        self.projection = None
+        self.vectors = np.zeros((0, PROJECTION_DIM), dtype=np.float32)
+        self.meta = []                 # row -> {'scan_id', 'stored_name', 'timestamp'}
+        self.rows_by_scan = {}
+        self.removed = set()           # rows
+        self.centroids = None
+        self.trained_count = 0
+        self.lists = []                # centroid -> [rows]
+        self._list_arrays = {}         # centroid (or -1 for all rows) -> np.array of live rows (cache)
+        self._entries_offset = 0
+        self._centroids_mtime = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.meta) - len(self.removed)
+
+    # --- Sync with disk ---
+
+    def refresh(self):
+        """Reads operations appended since the last call (by any worker)."""
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        if os.path.exists(self.centroids_path):
+            mtime = os.path.getmtime(self.centroids_path)
+            if mtime != self._centroids_mtime:
+                with np.load(self.centroids_path) as data:
+                    self.centroids = data['centroids']
+                    self.trained_count = int(data['count'])
+                self._centroids_mtime = mtime
+                self._assign_all()
+
+        if not os.path.exists(self.entries_path) or os.path.getsize(self.entries_path) == self._entries_offset:
+            return
+        with open(self.entries_path, 'rb') as f:
+            f.seek(self._entries_offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # A partially written last line is picked up next time
+        if not end:
+            return
+        # One parse for all complete lines (JSON lines hold no raw newlines)
+        ops = json.loads(b'[' + data[:end - 1].replace(b'\n', b',') + b']')
+        self._entries_offset += end
+
+        new_rows = [op['row'] for op in ops if op['op'] == 'add']
+        if new_rows and max(new_rows) >= len(self.vectors):
+            # Memory-mapped: new rows cost nothing to "load", the page cache does the rest
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(max(new_rows) + 1, PROJECTION_DIM))
+        added = []
+        for op in ops:
+            if op['op'] == 'add':
+                row = op['row']
+                while len(self.meta) <= row:
+                    self.meta.append(None)
+                self.meta[row] = {k: op.get(k) for k in ('scan_id', 'stored_name', 'timestamp')}
+                self.rows_by_scan[op['scan_id']] = row
+                self.removed.discard(row)
+                added.append(row)
+                self._list_arrays.pop(-1, None)
+            elif op['op'] == 'remove':
+                row = self.rows_by_scan.pop(op['scan_id'], None)
+                if row is not None:
+                    self.removed.add(row)
+                    self._list_arrays.clear()
+        self._add_to_lists(np.array(added, dtype=np.int64))
+
+    def _assign_all(self):
+        self.lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = {}
+        self._add_to_lists(np.arange(len(self.vectors)))
+
+    def _add_to_lists(self, rows):
+        """
+        Assigns rows to their nearest centroid: one matrix product and argmax
+        (max cosine = min distance) per chunk, then one extend per list, so a
+        fresh worker reading 100k entries does not assign them one by one.
+        """
+        if self.centroids is None:
+            return
+        rows = rows[rows < len(self.vectors)]
+        for start in range(0, len(rows), ASSIGN_CHUNK):
+            chunk = rows[start:start + ASSIGN_CHUNK]
+            vectors = self.vectors[chunk[0]:chunk[-1] + 1] if _contiguous(chunk) else self.vectors[chunk]
+            assign = np.argmax(vectors @ self.centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            centroid_ids, starts = np.unique(assign[order], return_index=True)
+            for c, group in zip(centroid_ids, np.split(chunk[order], starts[1:])):
+                self.lists[c].extend(group.tolist())
+                self._list_arrays.pop(int(c), None)
+
+    # --- Writes ---
+
+    def _project(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if self.projection is None or self.projection.shape[0] != embeddings.shape[1]:
+            self.projection = _projection(embeddings.shape[1])
+        return _normalise(embeddings @ self.projection)
+
+    def add(self, scans, embeddings):
+        """scans: [{'id', 'stored_name', 'timestamp'}] confirmed FAKE, with their pooled embeddings."""
+        if not len(scans):
+            return
+        vectors = self._project(embeddings)
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh_locked()
+            scans_vectors = [(s, v) for s, v in zip(scans, vectors) if s['id'] not in self.rows_by_scan]
+            if not scans_vectors:
+                return
+            start = os.path.getsize(self.vectors_path) // (4 * PROJECTION_DIM) if os.path.exists(self.vectors_path) else 0
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.stack([v for _, v in scans_vectors]).astype(np.float32).tobytes())
+            with open(self.entries_path, 'a') as f:
+                for i, (scan, _) in enumerate(scans_vectors):
+                    f.write(json.dumps({'op': 'add', 'row': start + i, 'scan_id': scan['id'],
+                                        'stored_name': scan.get('stored_name'),
+                                        'timestamp': scan.get('timestamp')}) + '\n')
+            self._refresh_locked()
+            self._maybe_train()
+
+    def remove(self, scan_ids):
+        """Drops scans that were re-verified as REAL."""
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh_locked()
+            present = [sid for sid in scan_ids if sid in self.rows_by_scan]
+            if not present:
+                return
+            with open(self.entries_path, 'a') as f:
+                for sid in present:
+                    f.write(json.dumps({'op': 'remove', 'scan_id': sid}) + '\n')
+            self._refresh_locked()
+
+    def _maybe_train(self):
+        # Caller holds both locks
+        count = len(self.vectors)
+        if count < TRAIN_MIN or (self.centroids is not None and count < self.trained_count * RETRAIN_GROWTH):
+            return
+        nlist = min(1024, max(16, int(4 * np.sqrt(count))))
+        centroids = _kmeans(np.asarray(self.vectors), nlist)
+        tmp_path = self.centroids_path + '.tmp.npz'
+        np.savez(tmp_path, centroids=centroids, count=count)
+        os.replace(tmp_path, self.centroids_path)
+        self._refresh_locked()
+        print(f"Counterfeit index {self.version}: clustered {count} vectors into {nlist} lists")
+
+    # --- Queries ---
+
+    def _live(self, key, rows):
+        arr = self._list_arrays.get(key)
+        if arr is None:
+            arr = np.array([r for r in rows if r not in self.removed], dtype=np.int64)
+            self._list_arrays[key] = arr
+        return arr
+
+    def _candidates(self, q):
+        if self.centroids is None:
+            return self._live(-1, range(len(self.vectors)))  # Exact search while small
+        probe = np.argpartition(-(self.centroids @ q), min(NPROBE, len(self.centroids) - 1))[:NPROBE]
+        return np.concatenate([self._live(int(c), self.lists[c]) for c in probe])
+
+    def search(self, embedding, k=1):
+        """[(similarity, meta)] of the k nearest confirmed counterfeits."""
+        self.refresh()
+        if not len(self):
+            return []
+        q = self._project(np.asarray(embedding).reshape(1, -1))[0]
+        with self._lock:
+            rows = self._candidates(q)
+            if not len(rows):
+                return []
+            sims = self.vectors[rows] @ q
+            top = np.argsort(-sims)[:k]
+            return [(float(sims[i]), self.meta[rows[i]]) for i in top]
+
+
+# --- Per-version registry of indexes ---
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(version):
+    with _indexes_lock:
+        index = _indexes.get(version)
+        needs_rebuild = index is None
+        if index is None:
+            index = CounterfeitIndex(version)
+            _indexes[version] = index
+    if needs_rebuild and not os.path.exists(index.built_path):
+        # New model version: its embedding space differs, so re-embed confirmed fakes in the background
+        threading.Thread(target=rebuild, args=(version,), daemon=True).start()
+    return index
+
+
+def match(embedding, version):
+    """Closest known counterfeit if it is similar enough to call this scan part of the same series."""
+    try:
+        results = get_index(version).search(embedding, k=1)
+    except Exception as e:
+        print(f"Counterfeit index query failed: {e}")
+        return None
+    if not results or results[0][0] < MATCH_SIMILARITY:
+        return None
+    similarity, meta = results[0]
+    return {'scan_id': meta['scan_id'], 'stored_name': meta['stored_name'],
+            'timestamp': meta['timestamp'], 'similarity': round(similarity, 4)}
+
+
+def _embed_scans(scans, version):
+    """Pooled embeddings for stored scans, batched. Returns (scans_embedded, embeddings)."""
+    from model_registry import registry
+    from preprocess import preprocess_image
+    import upload_store
+
+    target_size = registry.input_size(version)
+    kept, arrays = [], []
+    for scan in scans:
+        path = upload_store.resolve(scan.get('stored_name') or '') if scan.get('stored_name') else None
+        if not path or not os.path.exists(path):
+            continue  # Image evicted or pre-dates content-addressed storage
+        img_array = preprocess_image(path, target_size)
+        if img_array is not None:
+            kept.append(scan)
+            arrays.append(img_array[0])
+    embeddings = []
+    for i in range(0, len(arrays), REBUILD_BATCH):
+        batch, _ = registry.embed(np.stack(arrays[i:i + REBUILD_BATCH]), version=version)
+        embeddings.append(batch)
+    return kept, (np.concatenate(embeddings) if embeddings else np.zeros((0, 1), dtype=np.float32))
+
+
+def add_confirmed(scans, version):
+    """Indexes scans that an admin just confirmed as FAKE."""
+    kept, embeddings = _embed_scans(scans, version)
+    get_index(version).add(kept, embeddings)
+    return len(kept)
+
+
+def remove_confirmed(scan_ids, version):
+    get_index(version).remove(scan_ids)
+
+
+def rebuild(version):
+    """Indexes every admin-confirmed FAKE in history for `version` (new model or first run)."""
+    import history_store
+    index = get_index(version)
+    with open(os.path.join(index.directory, '.rebuild.lock'), 'a') as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # Another worker is already rebuilding
+        try:
+            scans = history_store.confirmed_fakes()
+            count = 0
+            for i in range(0, len(scans), REBUILD_BATCH * 8):
+                count += add_confirmed(scans[i:i + REBUILD_BATCH * 8], version)
+            open(index.built_path, 'w').close()
+            print(f"Counterfeit index {version}: {count} confirmed counterfeits indexed")
+        except Exception as e:
+            print(f"Counterfeit index rebuild failed for {version}: {e}")
+
+
+if __name__ == '__main__':
+    from model_loader import MODEL_PATH
+    from model_registry import registry
+    parser = argparse.ArgumentParser(description='Build the nearest-neighbour index of confirmed counterfeits.')
+    parser.add_argument('--model', default=MODEL_PATH)
+    args = parser.parse_args()
+    version = registry.load(args.model)
+    registry.activate(version)
+    rebuild(version)
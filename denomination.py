@@ -0,0 +1,216 @@
+import os
+import json
+import threading
+import numpy as np
+from PIL import Image
+from model_registry import registry
+from template_index import FEATURES_ROOT, load_index
+import feature_check
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+CENTROIDS_PATH = os.path.join(BASE_DIR, 'denomination_centroids.json')
+ROUTER_SIZE = (96, 40)       # Tiny thumbnail is enough to tell notes apart by colour
+HUE_BINS, SAT_BINS = 12, 4
+ROUTER_MIN_MARGIN = 0.1      # Below this the router falls back to the default pipeline
+ROUTER_MAX_DISTANCE = 1.8    # Farther than this from every centroid: not a supported note
+DEFAULT_DENOMINATION = 'default'
+UNKNOWN_DENOMINATION = 'unknown'
+
+# Per-denomination verification settings: model, decision threshold and the
+# security-feature layout from the reference notebooks (500_Testing.ipynb /
+# 2000_Testing.ipynb). Search areas are [x0, x1, y0, y1] in the working size
+# the note is resized to; a located feature must cover an area within its limits.
+# A denomination without its own model file shares the default model.
+DENOMINATION_CONFIG = {
+    '500': {
+        'model_path': os.path.join(BASE_DIR, 'models', 'denomination_500.h5'),
+        'threshold': 0.5,
+        'features': {
+            'working_size': (1167, 519),
+            'search_areas': [[200, 300, 200, 370], [1050, 1500, 300, 450], [100, 450, 20, 120],
+                             [690, 1050, 20, 120], [820, 1050, 350, 430], [700, 810, 330, 430],
+                             [400, 650, 0, 100]],
+            'area_limits': [[12000, 17000], [10000, 18000], [20000, 30000], [24000, 36000],
+                            [15000, 25000], [7000, 13000], [11000, 18000]],
+            'min_ssim': [0.4, 0.4, 0.5, 0.4, 0.5, 0.45, 0.5]
+        }
+    },
+    '2000': {
+        'model_path': os.path.join(BASE_DIR, 'models', 'denomination_2000.h5'),
+        'threshold': 0.5,
+        'features': {
+            'working_size': (1165, 455),
+            'search_areas': [[200, 270, 160, 330], [1050, 1500, 250, 400], [50, 400, 0, 100],
+                             [750, 1050, 0, 100], [850, 1050, 280, 380], [700, 820, 290, 370],
+                             [400, 650, 0, 100]],
+            'area_limits': [[10000, 14000], [9000, 15000], [17000, 21500], [19000, 28000],
+                            [17500, 23000], [6500, 9000], [10000, 16000]],
+            'min_ssim': [0.45, 0.4, 0.45, 0.45, 0.5, 0.4, 0.5]
+        }
+    },
+    DEFAULT_DENOMINATION: {
+        'model_path': None,
+        'threshold': 0.5,
+        'features': None
+    }
+}
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+_centroids = None
+
+
+# --- First stage: denomination router ---
+
+def extract_router_features(image_source):
+    """Hue/saturation histogram + aspect ratio of a small thumbnail (offline centroid build)."""
+    img = Image.open(image_source)
+    original_size = img.size
+    img.draft('RGB', (ROUTER_SIZE[0] * 2, ROUTER_SIZE[1] * 2))  # Cheap JPEG downscale on decode
+    return _router_features(img.convert('RGB'), original_size)
+
+
+def features_from_array(img_array, original_size):
+    """Router features from the already decoded model input, so routing adds no decode."""
+    img = Image.fromarray(np.uint8(np.clip(img_array[0], 0, 1) * 255))
+    return _router_features(img, original_size)
+
+
+def _router_features(img, original_size):
+    width, height = original_size
+    img = img.resize(ROUTER_SIZE, Image.BILINEAR)
+    hsv = np.asarray(img.convert('HSV'), dtype=np.float32)
+    hist, _, _ = np.histogram2d(
+        hsv[..., 0].ravel(), hsv[..., 1].ravel(),
+        bins=(HUE_BINS, SAT_BINS), range=((0, 256), (0, 256)))
+    hist = hist.ravel() / hist.sum()
+
+    # Notes are scanned in either orientation
+    aspect = max(width, height) / float(min(width, height))
+    return np.concatenate([hist, [aspect]])
+
+
+def _feature_distance(a, b):
+    # L1 over the colour histogram, aspect ratio difference weighted in as one extra term
+    return float(np.abs(a[:-1] - b[:-1]).sum() + abs(a[-1] - b[-1]))
+
+
+def build_centroids():
+    """Averages router features over Dataset/<denomination>_dataset reference notes."""
+    centroids = {}
+    for denom in DENOMINATION_CONFIG:
+        folder = os.path.join(FEATURES_ROOT, f'{denom}_dataset')
+        if not os.path.isdir(folder):
+            continue
+        feats = [extract_router_features(os.path.join(folder, f))
+                 for f in sorted(os.listdir(folder))
+                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+        if feats:
+            centroids[denom] = np.mean(feats, axis=0).tolist()
+            print(f"[{denom}] centroid from {len(feats)} reference notes")
+
+    with open(CENTROIDS_PATH, 'w') as f:
+        json.dump(centroids, f)
+    return centroids
+
+
+def load_centroids():
+    """Centroids built offline by `python denomination.py`; without them every scan uses the default pipeline."""
+    global _centroids
+    if _centroids is None:
+        raw = {}
+        if os.path.exists(CENTROIDS_PATH):
+            with open(CENTROIDS_PATH, 'r') as f:
+                raw = json.load(f)
+        else:
+            print(f"No {os.path.basename(CENTROIDS_PATH)}; run `python denomination.py` to enable routing")
+        _centroids = {k: np.array(v, dtype=np.float32) for k, v in raw.items()}
+    return _centroids
+
+
+def route_denomination(img_array, original_size):
+    """
+    Routes on the decoded model input (plus the upload's original size for
+    the aspect ratio). Returns (denomination, margin). Returns
+    UNKNOWN_DENOMINATION when no centroid is within ROUTER_MAX_DISTANCE
+    (another denomination, or not a note), and falls back to
+    DEFAULT_DENOMINATION when the two closest centroids are too close to call.
+    """
+    try:
+        centroids = load_centroids()
+        if not centroids:
+            return DEFAULT_DENOMINATION, 0.0
+        feats = features_from_array(img_array, original_size)
+    except Exception as e:
+        print(f"Error routing denomination: {e}")
+        return DEFAULT_DENOMINATION, 0.0
+
+    ranked = sorted((_feature_distance(feats, c), denom) for denom, c in centroids.items())
+    if ranked[0][0] > ROUTER_MAX_DISTANCE:
+        return UNKNOWN_DENOMINATION, 0.0
+    if len(ranked) == 1:
+        return ranked[0][1], 1.0
+    margin = ranked[1][0] - ranked[0][0]
+    if margin < ROUTER_MIN_MARGIN:
+        return DEFAULT_DENOMINATION, margin
+    return ranked[0][1], margin
+
+
+# --- Second stage: per-denomination pipelines ---
+
+class VerificationPipeline:
+    """Model, decision threshold and security-feature templates for one denomination."""
+
+    def __init__(self, denomination, model_version, config):
+        self.denomination = denomination
+        self.model_version = model_version  # None -> whatever the registry is serving
+        self.threshold = config['threshold']
+        self.features = config.get('features')
+        # Template images for the SSIM step, read once; descriptors come from the index
+        self.template_pixels = None
+        if self.features and self.templates is not None:
+            self.template_pixels = feature_check.load_template_pixels(denomination)
+            print(f"[{denomination}] {len(self.template_pixels)} feature templates loaded")
+
+    @property
+    def templates(self):
+        """Memory-mapped template index (reopened by load_index if it was rebuilt), or None."""
+        if not self.features:
+            return None
+        return load_index(self.denomination)
+
+
+def get_pipeline(denomination):
+    """Lazily builds and caches the pipeline for a denomination."""
+    if denomination not in DENOMINATION_CONFIG:
+        denomination = DEFAULT_DENOMINATION
+
+    pipeline = _pipelines.get(denomination)
+    if pipeline is not None:
+        return pipeline
+
+    with _pipelines_lock:
+        pipeline = _pipelines.get(denomination)
+        if pipeline is None:
+            config = DENOMINATION_CONFIG[denomination]
+            model_version = None
+            if config['model_path'] and os.path.exists(config['model_path']):
+                print(f"Loading {denomination} model from {config['model_path']}")
+                try:
+                    model_version = registry.load(config['model_path'])
+                except Exception as e:
+                    print(f"Falling back to the default model for {denomination}: {e}")
+            pipeline = VerificationPipeline(denomination, model_version, config)
+            _pipelines[denomination] = pipeline
+    return pipeline
+
+
+def preload_pipelines():
+    """Builds every pipeline (models, template index, template images) at startup, not on the first scan."""
+    for denomination in DENOMINATION_CONFIG:
+        get_pipeline(denomination)
+
+
+if __name__ == '__main__':
+    build_centroids()
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
+from train_model import build_model, FINAL_MODEL_PATH, BATCH_SIZE
+from embedding_cache import list_split
+
+# Configuration
+STUDENTS = [(0.35, 128), (0.35, 160), (0.5, 128), (0.5, 160)]   # (MobileNetV2 alpha, input size)
+STUDENTS_DIR = 'models'
+TEACHER_SIZE = (224, 224)
+EPOCHS = 20
+LEARNING_RATE = 1e-4          # Students start from ImageNet weights, so a higher LR than fine-tuning
+TEMPERATURE = 2.0             # Softens teacher scores so near-threshold cases carry more signal
+HARD_WEIGHT = 0.3             # Share of the loss on ground-truth labels; the rest follows the teacher
+LATENCY_RUNS = 50             # Single-image CPU forward passes per model (after warm-up)
+REPORT_PATH = 'distillation_report.json'
+
+
+def student_path(alpha, size):
+    return os.path.join(STUDENTS_DIR, f'student_a{alpha}_{size}.h5')
+
+
+# --- Data ---
+
+def make_dataset(split, training):
+    """Images at teacher resolution, same decode/rescale as training; students resize on the fly."""
+    paths, labels = list_split(split)
+    augment = tf.keras.Sequential([
+        tf.keras.layers.RandomFlip('horizontal'),
+        tf.keras.layers.RandomRotation(20 / 360.0),
+        tf.keras.layers.RandomTranslation(0.1, 0.1),
+        tf.keras.layers.RandomZoom(0.1)
+    ])
+
+    def decode(path, label):
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.image.resize(img, TEACHER_SIZE, method='nearest') / 255.0
+        return img, [tf.cast(label, tf.float32)]
+
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        ds = ds.shuffle(len(paths), seed=42, reshuffle_each_iteration=True)
+    ds = ds.map(decode, num_parallel_calls=tf.data.AUTOTUNE).batch(BATCH_SIZE)
+    if training:
+        ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE), len(paths)
+
+
+# --- Distillation ---
+
+def _logit(p):
+    p = tf.clip_by_value(p, 1e-6, 1 - 1e-6)
+    return tf.math.log(p / (1 - p))
+
+
+class Distiller(Model):
+    """
+    Trains `student` on a mix of ground truth and the teacher's
+    temperature-softened scores. Both see the same augmented batch; the
+    student gets it resized to its own input size.
+    """
+
+    def __init__(self, student, teacher):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.student_size = tuple(student.input_shape[1:3])
+        self.bce = tf.keras.losses.BinaryCrossentropy()
+        self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+        self.accuracy = tf.keras.metrics.BinaryAccuracy(name='accuracy')
+        self.agreement = tf.keras.metrics.BinaryAccuracy(name='teacher_agreement')
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.accuracy, self.agreement]
+
+    def _resize(self, x):
+        return tf.image.resize(x, self.student_size, method='nearest')
+
+    def train_step(self, data):
+        x, y = data
+        teacher_scores = self.teacher(x, training=False)
+        soft_targets = tf.sigmoid(_logit(teacher_scores) / TEMPERATURE)
+
+        with tf.GradientTape() as tape:
+            scores = self.student(self._resize(x), training=True)
+            soft_scores = tf.sigmoid(_logit(scores) / TEMPERATURE)
+            # T^2 keeps the soft-target gradients on the same scale as the hard ones
+            loss = (HARD_WEIGHT * self.bce(y, scores)
+                    + (1 - HARD_WEIGHT) * TEMPERATURE ** 2 * self.bce(soft_targets, soft_scores))
+
+        grads = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(grads, self.student.trainable_variables))
+
+        self.loss_tracker.update_state(loss)
+        self.accuracy.update_state(y, scores)
+        self.agreement.update_state(tf.cast(teacher_scores > 0.5, tf.float32), scores)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        x, y = data
+        teacher_scores = self.teacher(x, training=False)
+        scores = self.student(self._resize(x), training=False)
+        self.loss_tracker.update_state(self.bce(y, scores))
+        self.accuracy.update_state(y, scores)
+        self.agreement.update_state(tf.cast(teacher_scores > 0.5, tf.float32), scores)
+        return {m.name: m.result() for m in self.metrics}
+
+
+def distill(teacher, alpha, size, epochs=EPOCHS):
+    train_ds, _ = make_dataset('train', training=True)
+    val_ds, _ = make_dataset('val', training=False)
+
+    student = build_model(alpha=alpha, img_size=(size, size))
+    distiller = Distiller(student, teacher)
+    distiller.compile(optimizer=Adam(learning_rate=LEARNING_RATE))
+
+    class BestStudent(tf.keras.callbacks.Callback):
+        """Keeps the student weights with the best validation accuracy."""
+        def __init__(self):
+            super().__init__()
+            self.best, self.weights = -1.0, None
+
+        def on_epoch_end(self, epoch, logs=None):
+            val_acc = (logs or {}).get('val_accuracy', 0.0)
+            if val_acc > self.best:
+                self.best, self.weights = val_acc, student.get_weights()
+
+    best = BestStudent()
+    distiller.fit(train_ds, validation_data=val_ds, epochs=epochs, callbacks=[best], verbose=2)
+    if best.weights is not None:
+        student.set_weights(best.weights)
+
+    os.makedirs(STUDENTS_DIR, exist_ok=True)
+    path = student_path(alpha, size)
+    student.save(path)
+    print(f"Saved student to {path}")
+    return student, path
+
+
+# --- Pareto report ---
+
+def evaluate(model, test_ds):
+    """Test accuracy with the model's own input size."""
+    size = tuple(model.input_shape[1:3])
+    correct = total = 0
+    for x, y in test_ds:
+        scores = model(tf.image.resize(x, size, method='nearest'), training=False).numpy().reshape(-1)
+        correct += int(np.sum((scores > 0.5) == (y.numpy().reshape(-1) > 0.5)))
+        total += len(scores)
+    return correct / max(1, total)
+
+
+def cpu_latency_ms(model, runs=LATENCY_RUNS):
+    """Median single-image forward pass on CPU, as on a counter terminal."""
+    x = np.random.rand(1, *model.input_shape[1:]).astype(np.float32)
+    with tf.device('/CPU:0'):
+        for _ in range(5):
+            model(x, training=False)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(x, training=False)
+            times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def pareto_front(rows):
+    """Marks models that no other model beats on both latency and accuracy."""
+    for row in rows:
+        row['pareto'] = not any(
+            o is not row and o['latency_ms'] <= row['latency_ms'] and o['test_accuracy'] >= row['test_accuracy']
+            and (o['latency_ms'] < row['latency_ms'] or o['test_accuracy'] > row['test_accuracy'])
+            for o in rows)
+    return rows
+
+
+def report(models):
+    """models: [(name, path, model)]. Writes REPORT_PATH and prints the table."""
+    test_ds, _ = make_dataset('test', training=False)
+    rows = []
+    for name, path, model in models:
+        rows.append({
+            'name': name,
+            'path': path,
+            'input_size': int(model.input_shape[1]),
+            'params': int(model.count_params()),
+            'size_mb': round(os.path.getsize(path) / 1024 ** 2, 2) if os.path.exists(path) else None,
+            'latency_ms': round(cpu_latency_ms(model), 2),
+            'test_accuracy': round(evaluate(model, test_ds) * 100, 2)
+        })
+    rows = sorted(pareto_front(rows), key=lambda r: r['latency_ms'])
+
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    print(f"\n{'model':<22}{'input':>7}{'params':>11}{'latency ms':>12}{'test acc':>10}  pareto")
+    for r in rows:
+        print(f"{r['name']:<22}{r['input_size']:>7}{r['params']:>11,}{r['latency_ms']:>12.2f}"
+              f"{r['test_accuracy']:>10.2f}  {'*' if r['pareto'] else ''}")
+    print(f"\nReport saved to {REPORT_PATH}. Serve a student by loading it from "
+          f"Admin -> Performance (models/) and promoting it.")
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distil final_model.h5 into compact MobileNetV2 students.')
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--report-only', action='store_true', help='Skip training; benchmark existing students')
+    args = parser.parse_args()
+
+    teacher = tf.keras.models.load_model(FINAL_MODEL_PATH)
+    teacher.trainable = False
+    models = [('teacher a1.0/224', FINAL_MODEL_PATH, teacher)]
+    for alpha, size in STUDENTS:
+        path = student_path(alpha, size)
+        if args.report_only:
+            if not os.path.exists(path):
+                continue
+            student = tf.keras.models.load_model(path)
+        else:
+            print(f"\n=== Student: alpha {alpha}, input {size}x{size} ===")
+            student, path = distill(teacher, alpha, size, args.epochs)
+        models.append((f'student a{alpha}/{size}', path, student))
+    report(models)
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+# Configuration
+DATASET_DIR = 'dataset'
+PER_WORKER_BATCH_SIZE = 32   # Global batch = PER_WORKER_BATCH_SIZE * workers
+BENCHMARK_EPOCHS = 2
+BENCHMARK_WORKERS = [1, 2, 4]
+SCALING_RESULTS_PATH = 'scaling_results.json'
+RUNS_DIR = os.path.join(tempfile.gettempdir(), 'currency_train_runs')  # One directory per run; removed on success
+CLASSES = ['fake', 'real']  # fake -> 0, real -> 1 (same as training)
+
+
+# --- Launcher (parent process) ---
+
+def find_free_ports(count):
+    sockets, ports = [], []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(('localhost', 0))
+        sockets.append(s)
+        ports.append(s.getsockname()[1])
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def config_key(num_workers, epochs, benchmark):
+    """Identifies a training configuration; a backup is only ever restored into the same one."""
+    config = {'workers': num_workers, 'epochs': epochs, 'per_worker_batch_size': PER_WORKER_BATCH_SIZE,
+              'dataset': os.path.abspath(DATASET_DIR), 'benchmark': benchmark}
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:10]
+    return f"{digest}-w{num_workers}"
+
+
+def launch(num_workers, epochs, result_file=None, resume=None):
+    """
+    Starts `num_workers` localhost worker processes with a shared TF_CONFIG and waits for them.
+    Each run gets its own backup/checkpoint directory, kept on failure so the
+    run can be resumed with --resume <run id>, and removed on success.
+    """
+    key = config_key(num_workers, epochs, benchmark=result_file is not None)
+    if resume and not resume.startswith(key + '-'):
+        raise ValueError(f"Run {resume} was started with a different configuration ({key})")
+    run = resume or f"{key}-{time.strftime('%Y%m%d-%H%M%S')}"
+    run_dir = os.path.join(RUNS_DIR, run)
+    os.makedirs(run_dir, exist_ok=True)
+    print(f"Run {run} ({run_dir})")
+
+    ports = find_free_ports(num_workers)
+    cluster = {'worker': [f'localhost:{p}' for p in ports]}
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+    procs = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}})
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-worker',
+               '--epochs', str(epochs), '--threads', str(threads_per_worker), '--run-dir', run_dir]
+        if result_file:
+            cmd += ['--result-file', result_file]
+        procs.append(subprocess.Popen(cmd, env=env))
+
+    codes = [p.wait() for p in procs]
+    if any(codes):
+        raise RuntimeError(f"Worker exit codes: {codes}. Resume with --resume {run}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def benchmark():
+    """Trains for a few epochs with 1/2/4 workers and records throughput scaling."""
+    results = []
+    for num_workers in BENCHMARK_WORKERS:
+        result_file = os.path.join(tempfile.gettempdir(), f'scaling_{num_workers}.json')
+        print(f"\n=== Benchmark: {num_workers} worker(s) ===")
+        launch(num_workers, BENCHMARK_EPOCHS, result_file)
+        with open(result_file, 'r') as f:
+            results.append(json.load(f))
+        os.remove(result_file)
+
+    base = results[0]['images_per_sec']
+    for r in results:
+        r['speedup'] = round(r['images_per_sec'] / base, 2)
+        r['efficiency'] = round(r['speedup'] / r['workers'], 2)
+
+    with open(SCALING_RESULTS_PATH, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'workers':>8}{'epoch (s)':>12}{'img/s':>10}{'speedup':>10}{'efficiency':>12}")
+    for r in results:
+        print(f"{r['workers']:>8}{r['avg_epoch_seconds']:>12.1f}{r['images_per_sec']:>10.1f}"
+              f"{r['speedup']:>10.2f}{r['efficiency']:>12.2f}")
+
+
+# --- Worker process ---
+
+def run_worker(epochs, threads, run_dir, result_file=None):
+    import tensorflow as tf
+    from tensorflow.keras.optimizers import Adam
+    from train_model import build_model, EpochTimer, IMG_SIZE, LEARNING_RATE, FINAL_MODEL_PATH
+    from model_loader import publish_model
+
+    # Split the cores between the workers sharing this machine
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task = json.loads(os.environ['TF_CONFIG'])['task']
+    num_workers = strategy.num_replicas_in_sync
+    is_chief = task['index'] == 0
+    global_batch = PER_WORKER_BATCH_SIZE * num_workers
+    checkpoint_path = os.path.join(run_dir, 'best_model.h5')
+
+    def list_files(split):
+        paths, labels = [], []
+        for label, class_name in enumerate(CLASSES):
+            class_dir = os.path.join(DATASET_DIR, split, class_name)
+            for fname in sorted(os.listdir(class_dir)):
+                if fname.lower().endswith(('.png', '.jpg', '.jpeg')):
+                    paths.append(os.path.join(class_dir, fname))
+                    labels.append(float(label))
+        return paths, labels
+
+    augment = tf.keras.Sequential([
+        tf.keras.layers.RandomFlip('horizontal'),
+        tf.keras.layers.RandomRotation(20 / 360.0),
+        tf.keras.layers.RandomTranslation(0.1, 0.1),
+        tf.keras.layers.RandomZoom(0.1)
+    ])
+
+    def make_dataset_fn(split, training):
+        paths, labels = list_files(split)
+
+        def decode(path, label):
+            img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+            img = tf.image.resize(img, IMG_SIZE, method='nearest') / 255.0
+            return img, [label]
+
+        def dataset_fn(input_context):
+            # Each worker reads and decodes only its own shard of the file list
+            ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+            ds = ds.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+            if training:
+                ds = ds.shuffle(len(paths), seed=42, reshuffle_each_iteration=True)
+            ds = ds.map(decode, num_parallel_calls=tf.data.AUTOTUNE)
+            ds = ds.repeat()
+            ds = ds.batch(input_context.get_per_replica_batch_size(global_batch), drop_remainder=True)
+            if training:
+                ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=tf.data.AUTOTUNE)
+            return ds.prefetch(tf.data.AUTOTUNE)
+
+        return tf.keras.utils.experimental.DatasetCreator(dataset_fn), len(paths)
+
+    train_data, train_count = make_dataset_fn('train', training=True)
+    val_data, val_count = make_dataset_fn('val', training=False)
+    steps_per_epoch = max(1, train_count // global_batch)
+    validation_steps = max(1, val_count // global_batch)
+
+    with strategy.scope():
+        model = build_model()
+        model.compile(
+            # Linear LR scaling with the global batch
+            optimizer=Adam(learning_rate=LEARNING_RATE * num_workers),
+            loss='binary_crossentropy',
+            metrics=['accuracy', tf.keras.metrics.Precision(name='precision'), tf.keras.metrics.Recall(name='recall')]
+        )
+
+    best_path = os.path.join(run_dir, 'best.json')
+
+    class SyncCheckpoint(tf.keras.callbacks.Callback):
+        """
+        Chief saves on val_accuracy improvement. The best score so far is kept
+        in the run directory, so a resumed run only replaces the checkpoint
+        with a better epoch. An h5 save only reads the (mirrored) weights, so
+        unlike a SavedModel save it is not a collective op and the other
+        workers need not take part.
+        """
+        def __init__(self):
+            super().__init__()
+            self.best = -1.0
+            if os.path.exists(best_path):
+                with open(best_path, 'r') as f:
+                    self.best = json.load(f)['val_accuracy']
+                print(f"Resuming with best val_accuracy {self.best:.4f}")
+
+        def on_epoch_end(self, epoch, logs=None):
+            val_acc = (logs or {}).get('val_accuracy', 0.0)
+            if val_acc <= self.best:
+                return
+            self.best = val_acc
+            if is_chief:
+                self.model.save(checkpoint_path)
+                tmp_path = best_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'val_accuracy': float(val_acc), 'epoch': epoch + 1}, f)
+                os.replace(tmp_path, best_path)  # After the checkpoint: never ahead of it
+                print(f"\n[chief] val_accuracy improved to {val_acc:.4f}, saved {checkpoint_path}")
+
+    epoch_timer = EpochTimer()
+    callbacks = [
+        # Restores all workers to the last completed epoch if one of them dies
+        tf.keras.callbacks.BackupAndRestore(backup_dir=os.path.join(run_dir, 'backup')),
+        SyncCheckpoint(),
+        epoch_timer
+    ]
+
+    model.fit(
+        train_data,
+        steps_per_epoch=steps_per_epoch,
+        validation_data=val_data,
+        validation_steps=validation_steps,
+        epochs=epochs,
+        callbacks=callbacks
+    )
+
+    if is_chief and not result_file:
+        # Benchmark runs are never published; a real run publishes its best epoch once, at the end
+        publish_model(tf.keras.models.load_model(checkpoint_path), FINAL_MODEL_PATH)
+
+    if is_chief and result_file:
+        # First epoch includes graph tracing; exclude it when possible
+        times = epoch_timer.epoch_times[1:] or epoch_timer.epoch_times
+        avg_epoch = sum(times) / len(times)
+        with open(result_file, 'w') as f:
+            json.dump({
+                'workers': num_workers,
+                'global_batch_size': global_batch,
+                'avg_epoch_seconds': avg_epoch,
+                'images_per_sec': steps_per_epoch * global_batch / avg_epoch
+            }, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Data-parallel training across localhost worker processes.')
+    parser.add_argument('--workers', type=int, default=2, help='Number of worker processes to launch')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--benchmark', action='store_true', help='Measure scaling for 1/2/4 workers')
+    parser.add_argument('--resume', help='Run id of a failed run to resume from its backup')
+    # Internal: set by the launcher for each child process
+    parser.add_argument('--run-worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--run-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_worker and not args.run_dir:
+        parser.error('--run-worker needs --run-dir (a directory for this run\'s backup and checkpoint)')
+    if args.run_worker:
+        run_worker(args.epochs, args.threads, args.run_dir, args.result_file)
+    elif args.benchmark:
+        benchmark()
+    else:
+        launch(args.workers, args.epochs, resume=args.resume)
@@ -0,0 +1,131 @@
+import os
+import json
+import math
+from datetime import datetime
+import history_store
+
+# Configuration
+REFERENCE_PATH = 'score_reference.json'   # Written by evaluate_model.py
+WINDOW_GRANULARITY = 'hour'
+WINDOWS = 24                 # Hourly windows shown on the performance page
+RECENT_WINDOWS = 6           # Windows pooled into the "recent" distribution
+MIN_WINDOW_SCANS = 50        # Fewer scored scans than this are not judged
+PSI_WARN = 0.1               # Conventional PSI bands: <0.1 stable, 0.1-0.25 shifting, >0.25 drifted
+PSI_ALERT = 0.25
+KS_WARN_C = 1.36             # Two-sample KS critical coefficients (alpha 0.05 / 0.01);
+KS_ALERT_C = 1.63            # PSI alone is noisy on small windows, so both must agree
+EPSILON = 1e-4               # Smooths empty bins so PSI stays finite
+
+_reference = None
+_reference_mtime = None
+
+
+def reference_histogram(scores, bins=history_store.SCORE_BINS):
+    counts = [0] * bins
+    for score in scores:
+        counts[min(bins - 1, max(0, int(float(score) * bins)))] += 1
+    return counts
+
+
+def save_reference(scores, source):
+    """Stores the score distribution of a labelled evaluation split as the drift baseline."""
+    with open(REFERENCE_PATH, 'w') as f:
+        json.dump({
+            'source': source,
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'count': len(scores),
+            'histogram': reference_histogram(scores)
+        }, f, indent=2)
+
+
+def load_reference():
+    """Reloads the baseline only when the file changes."""
+    global _reference, _reference_mtime
+    if not os.path.exists(REFERENCE_PATH):
+        return None
+    mtime = os.path.getmtime(REFERENCE_PATH)
+    if mtime != _reference_mtime:
+        with open(REFERENCE_PATH, 'r') as f:
+            _reference = json.load(f)
+        _reference_mtime = mtime
+    return _reference
+
+
+def _proportions(counts):
+    total = sum(counts)
+    return [max(c / total, EPSILON) for c in counts]
+
+
+def psi(expected, actual):
+    """Population stability index between two histograms with the same bins."""
+    e, a = _proportions(expected), _proportions(actual)
+    return sum((ai - ei) * math.log(ai / ei) for ei, ai in zip(e, a))
+
+
+def ks(expected, actual):
+    """Kolmogorov-Smirnov statistic on the binned CDFs (max CDF gap)."""
+    e_total, a_total = sum(expected), sum(actual)
+    e_cdf = a_cdf = gap = 0.0
+    for ei, ai in zip(expected, actual):
+        e_cdf += ei / e_total
+        a_cdf += ai / a_total
+        gap = max(gap, abs(a_cdf - e_cdf))
+    return gap
+
+
+def _status(psi_value, ks_value, n, m):
+    scale = math.sqrt((n + m) / (n * m))
+    if psi_value >= PSI_ALERT and ks_value >= KS_ALERT_C * scale:
+        return 'drift'
+    if psi_value >= PSI_WARN and ks_value >= KS_WARN_C * scale:
+        return 'shifting'
+    return 'stable'
+
+
+def _compare(expected, actual):
+    n = sum(actual)
+    if n < MIN_WINDOW_SCANS:
+        return {'scans': n, 'psi': None, 'ks': None, 'status': 'insufficient'}
+    psi_value, ks_value = psi(expected, actual), ks(expected, actual)
+    return {'scans': n, 'psi': round(psi_value, 3), 'ks': round(ks_value, 3),
+            'status': _status(psi_value, ks_value, n, sum(expected))}
+
+
+def check():
+    """
+    Compares each recent hourly window (and the last RECENT_WINDOWS pooled)
+    against the reference. Reads only the pre-aggregated rollup histograms,
+    so cost does not grow with traffic.
+    """
+    reference = load_reference()
+    if not reference:
+        return {'reference': None, 'windows': [], 'recent': None}
+
+    expected = reference['histogram']
+    series = history_store.trend_series(WINDOW_GRANULARITY, WINDOWS)
+    windows = []
+    for bucket, hist in zip(series['buckets'], series['score_histogram']):
+        window = _compare(expected, hist)
+        window['bucket'] = bucket
+        windows.append(window)
+
+    pooled = [sum(col) for col in zip(*series['score_histogram'][-RECENT_WINDOWS:])]
+    return {
+        'reference': {k: reference.get(k) for k in ('source', 'created', 'count')},
+        'windows': windows,
+        'recent': _compare(expected, pooled)
+    }
+
+
+def alerts(result=None):
+    """Dashboard notifications for the pooled recent window."""
+    result = result or check()
+    recent = result.get('recent')
+    if not recent or recent['status'] in ('stable', 'insufficient'):
+        return []
+    level = 'danger' if recent['status'] == 'drift' else 'warning'
+    return [{
+        'type': level,
+        'message': (f"Score distribution {'drift' if level == 'danger' else 'shift'} over the last "
+                    f"{RECENT_WINDOWS}h: PSI {recent['psi']}, KS {recent['ks']} ({recent['scans']} scans).")
+    }]
@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import numpy as np
+from tensorflow.keras.layers import GlobalAveragePooling2D
+from tensorflow.keras.models import Model
+from tensorflow.keras.preprocessing.image import load_img, img_to_array
+
+# Configuration
+DATASET_DIR = 'dataset'
+IMG_SIZE = (224, 224)
+BATCH_SIZE = 64
+CACHE_DIR = 'embedding_cache'
+VECTORS_PATH = os.path.join(CACHE_DIR, 'vectors.f32')
+INDEX_PATH = os.path.join(CACHE_DIR, 'index.json')
+CLASSES = ['fake', 'real']  # fake -> 0, real -> 1 (same as training)
+
+
+def get_file_hash(filepath):
+    hasher = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def backbone_fingerprint(backbone):
+    """
+    Embeddings are only valid for the backbone weights they came from.
+    Hashing the weights (not the file) keeps the cache valid across head-only saves.
+    """
+    hasher = hashlib.sha1()
+    for weights in backbone.get_weights():
+        hasher.update(np.ascontiguousarray(weights).tobytes())
+    return hasher.hexdigest()
+
+
+def build_backbone(model):
+    """Cuts the full classifier at the pooling layer: image -> pooled 1280-d embedding."""
+    pooling = next(layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D))
+    return Model(inputs=model.input, outputs=pooling.output)
+
+
+class EmbeddingStore:
+    """
+    Append-only float32 matrix on disk (memory-mapped for reads) plus a
+    JSON index from image hash -> row.
+    """
+
+    def __init__(self, fingerprint, dim):
+        self.fingerprint = fingerprint
+        self.dim = dim
+        self.rows = {}
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        if os.path.exists(INDEX_PATH):
+            with open(INDEX_PATH, 'r') as f:
+                index = json.load(f)
+            if index.get('fingerprint') == fingerprint and index.get('dim') == dim:
+                self.rows = index['rows']
+
+        if not self.rows and os.path.exists(VECTORS_PATH):
+            # Stale cache from another model: start over
+            os.remove(VECTORS_PATH)
+        elif os.path.exists(VECTORS_PATH):
+            # Vectors appended after the last save_index() (e.g. a crash) belong to no row: drop them
+            row_bytes = self.dim * 4
+            indexed = (max(self.rows.values()) + 1) * row_bytes
+            if os.path.getsize(VECTORS_PATH) > indexed:
+                with open(VECTORS_PATH, 'r+b') as f:
+                    f.truncate(indexed)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, hashes, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        # Number rows from the file itself, never from the index, so rows and vectors stay aligned
+        start = os.path.getsize(VECTORS_PATH) // (self.dim * 4) if os.path.exists(VECTORS_PATH) else 0
+        with open(VECTORS_PATH, 'ab') as f:
+            f.write(vectors.tobytes())
+        for i, h in enumerate(hashes):
+            self.rows[h] = start + i
+
+    def save_index(self):
+        tmp_path = INDEX_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'dim': self.dim, 'rows': self.rows}, f)
+        os.replace(tmp_path, INDEX_PATH)
+
+    def get(self, hashes):
+        if not hashes:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        count = os.path.getsize(VECTORS_PATH) // (self.dim * 4)
+        vectors = np.memmap(VECTORS_PATH, dtype=np.float32, mode='r', shape=(count, self.dim))
+        return np.asarray(vectors[[self.rows[h] for h in hashes]])
+
+
+def list_split(split):
+    """Returns ([paths], [labels]) for dataset/<split>/{fake,real}."""
+    paths, labels = [], []
+    for label, class_name in enumerate(CLASSES):
+        class_dir = os.path.join(DATASET_DIR, split, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for fname in sorted(os.listdir(class_dir)):
+            if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                paths.append(os.path.join(class_dir, fname))
+                labels.append(label)
+    return paths, labels
+
+
+def load_batch(paths):
+    # Same loading as the validation generator: resize + rescale, no augmentation
+    return np.stack([img_to_array(load_img(p, target_size=IMG_SIZE)) / 255.0 for p in paths])
+
+
+def cache_embeddings(model, splits=('train', 'val', 'test')):
+    """
+    Runs the frozen backbone once over every split, skipping images whose
+    hash is already cached. Returns {split: (X, y)}.
+    """
+    backbone = build_backbone(model)
+    store = EmbeddingStore(backbone_fingerprint(backbone), int(backbone.output_shape[-1]))
+
+    data = {}
+    for split in splits:
+        paths, labels = list_split(split)
+        hashes = [get_file_hash(p) for p in paths]
+
+        todo = [(p, h) for p, h in zip(paths, hashes) if h not in store.rows]
+        # Duplicate images share a hash; embed each once
+        todo = list({h: (p, h) for p, h in todo}.values())
+        print(f"[{split}] {len(paths)} images, {len(todo)} to embed")
+
+        for i in range(0, len(todo), BATCH_SIZE):
+            chunk = todo[i:i + BATCH_SIZE]
+            vectors = backbone.predict(load_batch([p for p, _ in chunk]), verbose=0)
+            store.append([h for _, h in chunk], vectors)
+        store.save_index()
+
+        data[split] = (store.get(hashes), np.array(labels, dtype=np.float32))
+    return data
@@ -7,6 +7,7 @@ from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import json
+from drift_monitor import save_reference
 
 # Configuration
 DATASET_DIR = 'dataset'
@@ -58,7 +59,10 @@ def evaluate():
         f.write("\n\nConfusion Matrix:\n")
         f.write(str(cm))
         
-    print("Evaluation complete. Results saved to evaluation_results.txt")
+    # Baseline score distribution for the live drift monitor
+    save_reference(y_pred_prob.reshape(-1).tolist(), source=f"{MODEL_PATH} on {DATASET_DIR}/test")
+        
+    print("Evaluation complete. Results saved to evaluation_results.txt and score_reference.json")
 
 if __name__ == '__main__':
     evaluate()
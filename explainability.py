@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 
-def analyze_image_quality(image_path):
+def analyze_image_quality(image_path, saliency_reasons=None):
     """
     Analyzes the image for common quality issues that might indicate a fake note 
     or explain why the model classified it as fake.
+    saliency_reasons (from the model's Grad-CAM map) replace the generic
+    fallback when no quality issue is found.
     """
     issues = []
     try:
@@ -70,7 +72,10 @@ def analyze_image_quality(image_path):
         # Check local variance (patch-wise)
         
         # 8. Dynamic Fallback based on specific findings
-        if not issues:
+        if not issues and saliency_reasons:
+            # Model-grounded: where the network found the evidence
+            issues.extend(saliency_reasons)
+        elif not issues:
             # If it passed all quality checks but model still thinks it's fake:
             issues.append("Suspicious high-frequency artifacts detected by Neural Network")
             issues.append("Subtle security feature deviations (Watermark/Thread)")
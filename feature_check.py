@@ -0,0 +1,149 @@
+import os
+import time
+import cv2
+import numpy as np
+from template_index import FEATURES_ROOT, TEMPLATE_BLUR, create_orb, list_template_images
+
+# Configuration
+FEATURE_CHECK_ENABLED = True
+PASS_MAX_SSIM = 0.79         # A feature also passes on one template this similar (reference notebooks)
+MIN_MATCHES = 4              # Matches needed for a homography
+SSIM_WINDOW = 7
+
+def _prepare(gray):
+    # Same pre-processing as the reference notebooks
+    return cv2.GaussianBlur(gray, TEMPLATE_BLUR, 0)
+
+
+def load_template_pixels(denomination):
+    """{(feature_id, template_id): blurred grayscale template} for the SSIM comparison."""
+    pixels = {}
+    for feature_id, template_id, rel_path in list_template_images(denomination):
+        gray = cv2.imread(os.path.join(FEATURES_ROOT, rel_path), cv2.IMREAD_GRAYSCALE)
+        if gray is not None:
+            pixels[(feature_id, template_id)] = _prepare(gray)
+    return pixels
+
+
+def ssim(a, b):
+    """Mean SSIM of two equally sized grayscale images (7x7 uniform window, as skimage's default)."""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    n = SSIM_WINDOW * SSIM_WINDOW
+    cov_norm = n / (n - 1)
+    window = (SSIM_WINDOW, SSIM_WINDOW)
+    ux, uy = cv2.blur(a, window), cv2.blur(b, window)
+    vx = cov_norm * (cv2.blur(a * a, window) - ux * ux)
+    vy = cov_norm * (cv2.blur(b * b, window) - uy * uy)
+    vxy = cov_norm * (cv2.blur(a * b, window) - ux * uy)
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    pad = SSIM_WINDOW // 2
+    return float(s[pad:-pad, pad:-pad].mean())
+
+
+def _compare(template, crop):
+    h = min(template.shape[0], crop.shape[0])
+    w = min(template.shape[1], crop.shape[1])
+    if h <= SSIM_WINDOW or w <= SSIM_WINDOW:
+        return None
+    return ssim(cv2.resize(template, (w, h)), cv2.resize(crop, (w, h)))
+
+
+def _locate(index, row, query_kpts, query_descs, matcher):
+    """Bounding box (x, y, w, h) of one template in the query, from the indexed descriptors."""
+    descs = np.asarray(index.descriptors_for(row))
+    if len(descs) < MIN_MATCHES or query_descs is None or len(query_descs) < MIN_MATCHES:
+        return None, None
+    matches = matcher.match(descs, query_descs)
+    if len(matches) < MIN_MATCHES:
+        return None, None
+    geometry = index.keypoints_for(row)
+    src = np.float32([geometry[m.queryIdx][:2] for m in matches]).reshape(-1, 1, 2)
+    dst = np.float32([query_kpts[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    M, _ = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+    if M is None:
+        return None, dst
+    w, h = int(row['width']), int(row['height'])
+    corners = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
+    return cv2.perspectiveTransform(corners, M), dst
+
+
+def check_features(image_source, pipeline):
+    """
+    Security-feature check from the reference notebooks (ORB match of each
+    feature template inside its search area, then SSIM of the located
+    region), with the template side read from the pipeline's precomputed
+    index: only the query note is run through ORB. image_source is a path
+    or bytes. Returns None when the pipeline has no feature layout or index.
+    """
+    index = pipeline.templates
+    pixels = pipeline.template_pixels
+    layout = pipeline.features
+    if index is None or not pixels or not layout:
+        return None
+
+    start = time.perf_counter()
+    if isinstance(image_source, (bytes, bytearray)):
+        img = cv2.imdecode(np.frombuffer(image_source, np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        img = cv2.imread(image_source, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    gray = _prepare(cv2.resize(img, tuple(layout['working_size'])))
+
+    orb = create_orb()
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    results = []
+    for i, (search_area, (min_area, max_area), min_ssim) in enumerate(
+            zip(layout['search_areas'], layout['area_limits'], layout['min_ssim'])):
+        feature_id = i + 1
+        x0, x1, y0, y1 = search_area
+        mask = np.zeros_like(gray)
+        mask[y0:y1, x0:x1] = 255
+        query_kpts, query_descs = orb.detectAndCompute(gray, mask)
+
+        scores = []
+        for row in index.templates_for(feature_id, scale=1.0):
+            template = pixels.get((feature_id, int(row['template_id'])))
+            if template is None:
+                continue
+            corners, dst = _locate(index, row, query_kpts, query_descs, matcher)
+            if corners is None:
+                continue
+            x, y, w, h = cv2.boundingRect(corners)
+            if not min_area <= w * h <= max_area:
+                # Fall back to the box around the matched points, as the notebooks do
+                x, y, w, h = cv2.boundingRect(dst)
+                if not min_area <= w * h <= max_area:
+                    continue
+            x, y = max(0, x), max(0, y)
+            score = _compare(template, gray[y:y + h, x:x + w])
+            if score is not None:
+                scores.append(score)
+
+        avg = float(np.mean(scores)) if scores else 0.0
+        best = max(scores) if scores else 0.0
+        results.append({
+            'id': feature_id,
+            'passed': avg >= min_ssim or best >= PASS_MAX_SSIM,
+            'avg_ssim': round(avg, 3),
+            'max_ssim': round(best, 3)
+        })
+
+    return {
+        'denomination': pipeline.denomination,
+        'passed': sum(r['passed'] for r in results),
+        'total': len(results),
+        'features': results,
+        'ms': round((time.perf_counter() - start) * 1000, 1)
+    }
+
+
+def describe(check):
+    """Reasons for the security features that did not match."""
+    if not check:
+        return []
+    return [f"Security feature {r['id']} does not match the {check['denomination']} templates "
+            f"(similarity {r['max_ssim']:.2f})"
+            for r in check['features'] if not r['passed']]
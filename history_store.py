@@ -0,0 +1,654 @@
+import os
+import json
+import time
+import atexit
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+HISTORY_DB = os.path.join(BASE_DIR, 'scan_history.db')
+LEGACY_HISTORY_FILE = os.path.join(BASE_DIR, 'scan_history.json')
+FLUSH_INTERVAL = 0.5       # Max seconds a completed scan waits before its group commit
+FLUSH_MAX_RECORDS = 500    # Flush early once this many records are buffered
+FLUSH_MAX_RETRIES = 5      # Flushes a record may fail before it is dropped (and logged)
+RISK_CONFIDENCE = 85       # Scans below this confidence need review
+
+# Rollups: bucket key is a prefix of the '%Y-%m-%d %H:%M:%S' timestamp
+ROLLUP_PREFIX = {'minute': 16, 'hour': 13, 'day': 10}
+ROLLUP_STEP = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+ROLLUP_FORMAT = {'minute': '%Y-%m-%d %H:%M', 'hour': '%Y-%m-%d %H', 'day': '%Y-%m-%d'}
+ROLLUP_RETENTION = {'minute': timedelta(days=2), 'hour': timedelta(days=90), 'day': None}  # Downsampling
+ROLLUP_PRUNE_INTERVAL = 3600
+CONF_BINS = 10             # Confidence histogram: 50-100% in 5-point bins
+SCORE_BINS = 20            # raw_score histogram: 0-1 in 0.05 bins (drift monitoring)
+ROLLUP_COLUMNS = (['scans', 'fakes', 'overrides', 'conf_sum'] + [f'h{i}' for i in range(CONF_BINS)]
+                  + [f's{i}' for i in range(SCORE_BINS)])
+
+
+
+def _risk_case_sql():
+    """is_risk() as SQL over a scans row, built from RISK_CONFIDENCE."""
+    return f"""CASE
+        WHEN coalesce(json_extract(data, '$.verified_by_admin'), 0) AND result = 'REAL' THEN 0
+        WHEN confidence < {RISK_CONFIDENCE!r} OR result = 'FAKE'
+             OR json_extract(data, '$.counterfeit_match') IS NOT NULL THEN 1
+        ELSE 0 END"""
+
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        result TEXT,
+        confidence REAL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans(timestamp);
+    """,
+    # Stable scan IDs for admin actions (timestamps are not unique)
+    """
+    ALTER TABLE scans ADD COLUMN scan_id TEXT;
+    UPDATE scans SET scan_id = lower(hex(randomblob(16))) WHERE scan_id IS NULL;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_scans_scan_id ON scans(scan_id);
+    """,
+    # Risk queue: flag maintained on write, partial index in review order, O(1) counter
+    """
+    ALTER TABLE scans ADD COLUMN is_risk INTEGER NOT NULL DEFAULT 0;
+    UPDATE scans SET is_risk = """ + _risk_case_sql() + """;
+    CREATE INDEX IF NOT EXISTS idx_scans_risk_queue ON scans(confidence, id DESC) WHERE is_risk = 1;
+    CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR REPLACE INTO counters (name, value) VALUES ('risk', (SELECT count(*) FROM scans WHERE is_risk = 1));
+    CREATE TRIGGER IF NOT EXISTS trg_risk_insert AFTER INSERT ON scans WHEN NEW.is_risk = 1
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'risk';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_risk_delete AFTER DELETE ON scans WHEN OLD.is_risk = 1
+    BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'risk';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_risk_update AFTER UPDATE OF is_risk ON scans WHEN OLD.is_risk != NEW.is_risk
+    BEGIN
+        UPDATE counters SET value = value + NEW.is_risk - OLD.is_risk WHERE name = 'risk';
+    END;
+    """,
+    # Time-bucketed rollups (minute/hour/day), backfilled from existing scans
+    """
+    CREATE TABLE IF NOT EXISTS rollups (
+        granularity TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        scans INTEGER NOT NULL DEFAULT 0,
+        fakes INTEGER NOT NULL DEFAULT 0,
+        overrides INTEGER NOT NULL DEFAULT 0,
+        conf_sum REAL NOT NULL DEFAULT 0,
+        h0 INTEGER NOT NULL DEFAULT 0, h1 INTEGER NOT NULL DEFAULT 0, h2 INTEGER NOT NULL DEFAULT 0, h3 INTEGER NOT NULL DEFAULT 0, h4 INTEGER NOT NULL DEFAULT 0, h5 INTEGER NOT NULL DEFAULT 0, h6 INTEGER NOT NULL DEFAULT 0, h7 INTEGER NOT NULL DEFAULT 0, h8 INTEGER NOT NULL DEFAULT 0, h9 INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (granularity, bucket)
+    );
+    """ + "".join(f"""
+    INSERT INTO rollups (granularity, bucket, scans, fakes, conf_sum, {', '.join(f'h{i}' for i in range(10))})
+    SELECT '{g}', substr(timestamp, 1, {n}), count(*), sum(result = 'FAKE'), sum(coalesce(confidence, 0)),
+           {', '.join(f'sum(min(9, max(0, CAST((coalesce(confidence, 0) - 50) / 5 AS INTEGER))) = {i})' for i in range(10))}
+    FROM scans WHERE length(timestamp) >= 19 GROUP BY substr(timestamp, 1, {n});
+    """ for g, n in [('minute', 16), ('hour', 13), ('day', 10)]),
+    # raw_score histogram per rollup bucket, backfilled for buckets still retained
+    "".join(f"""
+    ALTER TABLE rollups ADD COLUMN s{i} INTEGER NOT NULL DEFAULT 0;""" for i in range(20)) + "".join(f"""
+    INSERT INTO rollups (granularity, bucket, {', '.join(f's{i}' for i in range(20))})
+    SELECT '{g}', substr(timestamp, 1, {n}),
+           {', '.join(f"sum(min(19, max(0, CAST(json_extract(data, '$.raw_score') * 20 AS INTEGER))) = {i})" for i in range(20))}
+    FROM scans
+    WHERE json_extract(data, '$.raw_score') IS NOT NULL
+      AND substr(timestamp, 1, {n}) IN (SELECT bucket FROM rollups WHERE granularity = '{g}')
+    GROUP BY substr(timestamp, 1, {n})
+    ON CONFLICT (granularity, bucket) DO UPDATE SET {', '.join(f's{i} = excluded.s{i}' for i in range(20))};
+    """ for g, n in [('minute', 16), ('hour', 13), ('day', 10)]),
+    # Offline bulk-scan checkpoints, committed with the scans they produced
+    """
+    CREATE TABLE IF NOT EXISTS bulk_progress (
+        run TEXT NOT NULL,
+        path TEXT NOT NULL,
+        scan_id TEXT,
+        PRIMARY KEY (run, path)
+    ) WITHOUT ROWID;
+    """,
+    # Scans by stored image, for upload eviction
+    """
+    CREATE INDEX IF NOT EXISTS idx_scans_stored_name ON scans(json_extract(data, '$.stored_name'));
+    """
+]
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+# --- Storage ---
+
+def get_connection():
+    """One SQLite connection per thread; WAL lets workers read while another writes."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(HISTORY_DB, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _init_schema(conn)
+    return conn
+
+
+def _init_schema(conn):
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        # IMMEDIATE takes the write lock up front, so concurrent workers migrate one at a time
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in _statements(script):
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {i}')
+            _sync_risk_flags(conn)
+            _migrate_legacy(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = ''
+        _initialized = True
+
+
+def _statements(script):
+    """Splits a migration script into statements (trigger bodies contain ';')."""
+    statements, current = [], ''
+    for part in script.split(';'):
+        current += part + ';'
+        if sqlite3.complete_statement(current):
+            if current.strip(' \n;'):
+                statements.append(current.strip())
+            current = ''
+    return statements
+
+
+def _sync_risk_flags(conn):
+    """Recomputes is_risk when RISK_CONFIDENCE changed since the flags were written (inside the schema transaction)."""
+    stored = conn.execute("SELECT value FROM counters WHERE name = 'risk_confidence'").fetchone()
+    if stored and stored[0] == RISK_CONFIDENCE:
+        return
+    case = _risk_case_sql()
+    # The update trigger keeps the risk counter in step
+    changed = conn.execute(f'UPDATE scans SET is_risk = {case} WHERE is_risk != {case}').rowcount
+    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('risk_confidence', ?)", (RISK_CONFIDENCE,))
+    if changed:
+        print(f"Risk threshold is now {RISK_CONFIDENCE}%: re-flagged {changed} scan(s)")
+
+
+def _migrate_legacy(conn):
+    """One-time import of the old newest-first scan_history.json (inside the schema transaction)."""
+    if not os.path.exists(LEGACY_HISTORY_FILE):
+        return
+    try:
+        with open(LEGACY_HISTORY_FILE, 'r') as f:
+            records = json.load(f)
+    except Exception as e:
+        print(f"Error reading legacy history, skipping import: {e}")
+        return
+    _insert(conn, list(reversed(records)))
+    os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + '.migrated')
+    print(f"Migrated {len(records)} scans from {LEGACY_HISTORY_FILE}")
+
+
+def new_scan_id():
+    return uuid.uuid4().hex
+
+
+def is_risk(record):
+    """Low confidence, FAKE or matching a known counterfeit series, unless an admin cleared it as REAL."""
+    if record.get('verified_by_admin') and record.get('result') == 'REAL':
+        return False
+    return (record.get('confidence', 0) < RISK_CONFIDENCE or record.get('result') == 'FAKE'
+            or bool(record.get('counterfeit_match')))
+
+
+def _insert(conn, records):
+    for r in records:
+        r.setdefault('id', new_scan_id())
+    conn.executemany(
+        'INSERT INTO scans (scan_id, timestamp, result, confidence, is_risk, data) VALUES (?, ?, ?, ?, ?, ?)',
+        [(r['id'], r.get('timestamp'), r.get('result'), r.get('confidence'), int(is_risk(r)), json.dumps(r))
+         for r in records])
+    _add_to_rollups(conn, records)
+
+
+def _row_to_record(scan_id, data):
+    record = json.loads(data)
+    record['id'] = scan_id
+    return record
+
+
+def load_all():
+    """All scans, newest first (same shape as the old JSON list, plus 'id')."""
+    rows = get_connection().execute('SELECT scan_id, data FROM scans ORDER BY id DESC').fetchall()
+    history = [_row_to_record(*row) for row in rows]
+    # Read-your-writes within this worker: include scans still waiting for a group commit
+    return writer.pending() + history
+
+
+def clear():
+    writer.flush()
+    conn = get_connection()
+    with conn:
+        conn.execute('DELETE FROM scans')
+        conn.execute('DELETE FROM rollups')
+
+
+# --- Rollups ---
+
+def _conf_bin(confidence):
+    return min(CONF_BINS - 1, max(0, int((confidence - 50) // 5)))
+
+
+def _score_bin(score):
+    return min(SCORE_BINS - 1, max(0, int(score * SCORE_BINS)))
+
+
+def _upsert_rollups(conn, deltas):
+    """deltas: {(granularity, bucket): [value per ROLLUP_COLUMNS]}"""
+    columns = ROLLUP_COLUMNS
+    conn.executemany(
+        f"""INSERT INTO rollups (granularity, bucket, {', '.join(columns)})
+            VALUES (?, ?, {', '.join('?' * len(columns))})
+            ON CONFLICT (granularity, bucket) DO UPDATE SET
+            {', '.join(f'{c} = {c} + excluded.{c}' for c in columns)}""",
+        [key + tuple(values) for key, values in deltas.items()])
+
+
+def _rollup_deltas(records):
+    # Aggregate first: one statement per touched bucket, not per scan.
+    # Model verdicts count, not admin overrides (those are counted separately).
+    # Bulk re-scans of archives are not live traffic: they stay out of trends and drift.
+    deltas = {}
+    for r in records:
+        timestamp = r.get('timestamp') or ''
+        if len(timestamp) < 19 or r.get('source') == 'bulk':
+            continue
+        confidence = r.get('model_confidence', r.get('confidence')) or 0
+        score = r.get('raw_score')
+        for granularity, n in ROLLUP_PREFIX.items():
+            d = deltas.setdefault((granularity, timestamp[:n]), [0] * len(ROLLUP_COLUMNS))
+            d[0] += 1
+            d[1] += r.get('model_result', r.get('result')) == 'FAKE'
+            d[3] += confidence
+            d[4 + _conf_bin(confidence)] += 1
+            if score is not None:
+                d[4 + CONF_BINS + _score_bin(score)] += 1
+    return deltas
+
+
+def _add_to_rollups(conn, records):
+    deltas = _rollup_deltas(records)
+    if deltas:
+        _upsert_rollups(conn, deltas)
+
+
+def _subtract_from_rollups(conn, records):
+    # Only buckets still retained; pruned ones must not come back negative
+    conn.executemany(
+        f"""UPDATE rollups SET {', '.join(f'{c} = {c} - ?' for c in ROLLUP_COLUMNS)}
+            WHERE granularity = ? AND bucket = ?""",
+        [tuple(values) + key for key, values in _rollup_deltas(records).items()])
+
+
+def _add_overrides(conn, count, when):
+    timestamp = when.strftime('%Y-%m-%d %H:%M:%S')
+    deltas = {}
+    for granularity, n in ROLLUP_PREFIX.items():
+        d = [0] * len(ROLLUP_COLUMNS)
+        d[2] = count
+        deltas[(granularity, timestamp[:n])] = d
+    _upsert_rollups(conn, deltas)
+
+
+def prune_rollups(now=None):
+    """Downsampling: fine buckets expire; coarser ones (already maintained) remain."""
+    now = now or datetime.now()
+    conn = get_connection()
+    with conn:
+        for granularity, retention in ROLLUP_RETENTION.items():
+            if retention:
+                cutoff = (now - retention).strftime(ROLLUP_FORMAT[granularity])
+                conn.execute('DELETE FROM rollups WHERE granularity = ? AND bucket < ?', (granularity, cutoff))
+
+
+def trend_series(granularity='hour', points=48, now=None):
+    """Contiguous series of the last `points` buckets, zero-filled, oldest first."""
+    now = now or datetime.now()
+    step = ROLLUP_STEP[granularity]
+    fmt = ROLLUP_FORMAT[granularity]
+    buckets = [(now - step * i).strftime(fmt) for i in range(points - 1, -1, -1)]
+
+    rows = get_connection().execute(
+        f"""SELECT bucket, {', '.join(ROLLUP_COLUMNS)}
+            FROM rollups WHERE granularity = ? AND bucket >= ? ORDER BY bucket""",
+        (granularity, buckets[0])).fetchall()
+    by_bucket = {row[0]: row[1:] for row in rows}
+
+    series = {'granularity': granularity, 'buckets': buckets, 'scans': [], 'fakes': [], 'fake_rate': [],
+              'overrides': [], 'avg_confidence': [], 'confidence_histogram': [], 'score_histogram': []}
+    empty = (0,) * len(ROLLUP_COLUMNS)
+    for bucket in buckets:
+        scans, fakes, overrides, conf_sum, *hist = by_bucket.get(bucket, empty)
+        series['scans'].append(scans)
+        series['fakes'].append(fakes)
+        series['fake_rate'].append(round(fakes / scans * 100, 1) if scans else None)
+        series['overrides'].append(overrides)
+        series['avg_confidence'].append(round(conf_sum / scans, 1) if scans else None)
+        series['confidence_histogram'].append(list(hist[:CONF_BINS]))
+        series['score_histogram'].append(list(hist[CONF_BINS:]))
+    return series
+
+
+# --- Bulk admin operations ---
+
+def _filter_sql(filters):
+    """
+    Translates a filter query into a WHERE clause. Supported keys: result,
+    min_confidence, max_confidence, since, until (timestamp prefixes), verified.
+    """
+    clauses, params = [], []
+    if filters.get('result'):
+        clauses.append('result = ?')
+        params.append(filters['result'])
+    if filters.get('min_confidence') not in (None, ''):
+        clauses.append('confidence >= ?')
+        params.append(float(filters['min_confidence']))
+    if filters.get('max_confidence') not in (None, ''):
+        clauses.append('confidence < ?')
+        params.append(float(filters['max_confidence']))
+    if filters.get('since'):
+        clauses.append('timestamp >= ?')
+        params.append(filters['since'])
+    if filters.get('until'):
+        clauses.append('substr(timestamp, 1, ?) <= ?')
+        params.extend([len(filters['until']), filters['until']])
+    if filters.get('verified') in (True, False, 'true', 'false', '1', '0'):
+        verified = filters['verified'] in (True, 'true', '1')
+        clauses.append("coalesce(json_extract(data, '$.verified_by_admin'), 0) = ?")
+        params.append(1 if verified else 0)
+    if not clauses:
+        raise ValueError('Refusing a bulk operation with an empty filter')
+    return ' AND '.join(clauses), params
+
+
+def _target_sql(scan_ids, filters):
+    if scan_ids:
+        placeholders = ','.join('?' * len(scan_ids))
+        return f'scan_id IN ({placeholders})', list(scan_ids)
+    return _filter_sql(filters or {})
+
+
+def bulk_verify(status, scan_ids=None, filters=None):
+    """
+    Marks every targeted scan as admin-verified `status` in one transaction.
+    Returns {previous_result: count}.
+    """
+    writer.flush()  # Make sure just-scanned records can be targeted
+    where, params = _target_sql(scan_ids, filters)
+    verified_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    with conn:
+        before = dict(conn.execute(
+            f'SELECT result, count(*) FROM scans WHERE {where} GROUP BY result', params).fetchall())
+        overrides = conn.execute(
+            f"""SELECT count(*) FROM scans WHERE ({where}) AND result != ?
+                   AND coalesce(json_extract(data, '$.source'), '') != 'bulk'""", params + [status]).fetchone()[0]
+        if overrides:
+            _add_overrides(conn, overrides, datetime.now())
+        # Confidence goes to 100% since it's human verified
+        # Verified REAL leaves the risk queue; verified FAKE stays as a confirmed counterfeit
+        conn.execute(
+            # The model's own verdict is kept, so the rollups can be reversed if the scan is deleted
+            f"""UPDATE scans SET result = ?, confidence = 100.0, is_risk = ?,
+                   data = json_set(data,
+                                   '$.model_result', coalesce(json_extract(data, '$.model_result'), result),
+                                   '$.model_confidence', coalesce(json_extract(data, '$.model_confidence'), confidence),
+                                   '$.result', ?, '$.verified_by_admin', json('true'),
+                                   '$.admin_verified_at', ?, '$.confidence', 100.0)
+                WHERE {where}""",
+            [status, int(status == 'FAKE'), status, verified_at] + params)
+    return before
+
+
+def get_scans(scan_ids=None, filters=None):
+    """Records targeted by scan IDs or a filter (same targeting as the bulk operations)."""
+    writer.flush()
+    where, params = _target_sql(scan_ids, filters)
+    rows = get_connection().execute(f'SELECT scan_id, data FROM scans WHERE {where}', params).fetchall()
+    return [_row_to_record(*row) for row in rows]
+
+
+def confirmed_fakes():
+    """Every scan an admin confirmed as FAKE, oldest first."""
+    rows = get_connection().execute(
+        "SELECT scan_id, data FROM scans WHERE result = 'FAKE' AND json_extract(data, '$.verified_by_admin') "
+        "ORDER BY id").fetchall()
+    return [_row_to_record(*row) for row in rows]
+
+
+def bulk_delete(scan_ids=None, filters=None):
+    """
+    Deletes every targeted scan in one transaction, taking them out of the
+    rollups too. Returns the number deleted.
+    """
+    writer.flush()
+    where, params = _target_sql(scan_ids, filters)
+    conn = get_connection()
+    with conn:
+        rows = conn.execute(f'SELECT data FROM scans WHERE {where}', params).fetchall()
+        _subtract_from_rollups(conn, [json.loads(row[0]) for row in rows])
+        return conn.execute(f'DELETE FROM scans WHERE {where}', params).rowcount
+
+
+# --- Offline bulk scans ---
+
+def bulk_completed(run):
+    """Paths already committed for a bulk-scan run."""
+    rows = get_connection().execute('SELECT path FROM bulk_progress WHERE run = ?', (run,)).fetchall()
+    return {row[0] for row in rows}
+
+
+def insert_bulk(run, items):
+    """
+    items: [(path, record or None for unreadable files)]. Scans and their
+    checkpoint rows commit in one transaction, so a resumed run neither
+    skips nor duplicates a file.
+    """
+    records = [record for _, record in items if record is not None]
+    conn = get_connection()
+    with conn:
+        _insert(conn, records)
+        conn.executemany('INSERT OR REPLACE INTO bulk_progress (run, path, scan_id) VALUES (?, ?, ?)',
+                         [(run, path, record['id'] if record else None) for path, record in items])
+
+
+def reset_bulk_progress(run):
+    conn = get_connection()
+    with conn:
+        conn.execute('DELETE FROM bulk_progress WHERE run = ?', (run,))
+
+
+# --- Upload retention ---
+
+def confirmed_fake_images():
+    """Stored names of admin-confirmed counterfeits; kept as evidence and for the series index."""
+    rows = get_connection().execute(
+        "SELECT DISTINCT json_extract(data, '$.stored_name') FROM scans "
+        "WHERE result = 'FAKE' AND json_extract(data, '$.verified_by_admin')").fetchall()
+    return {row[0] for row in rows if row[0]}
+
+
+def mark_images_purged(stored_names):
+    """Flags the scans whose stored image was evicted, so nothing tries to load it."""
+    stored_names = list(stored_names)
+    conn = get_connection()
+    with conn:
+        for i in range(0, len(stored_names), 500):
+            chunk = stored_names[i:i + 500]
+            conn.execute(
+                f"""UPDATE scans SET data = json_set(data, '$.image_purged', json('true'))
+                    WHERE json_extract(data, '$.stored_name') IN ({','.join('?' * len(chunk))})""", chunk)
+
+
+# --- Risk queue ---
+
+def risk_count():
+    """Number of scans awaiting review (maintained by triggers, O(1))."""
+    row = get_connection().execute("SELECT value FROM counters WHERE name = 'risk'").fetchone()
+    return row[0] if row else 0
+
+
+def risk_queue(page=1, per_page=24):
+    """Risk scans in review order: lowest confidence first, then most recent."""
+    rows = get_connection().execute(
+        'SELECT scan_id, data FROM scans WHERE is_risk = 1 ORDER BY confidence ASC, id DESC LIMIT ? OFFSET ?',
+        (per_page, (page - 1) * per_page)).fetchall()
+    return [_row_to_record(*row) for row in rows]
+
+
+# --- Write-coalescing writer ---
+
+class HistoryWriter:
+    """
+    Buffers completed scans and writes them in group commits (one
+    transaction per FLUSH_INTERVAL / FLUSH_MAX_RECORDS), so /predict never
+    waits on disk.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._flush_lock = threading.Lock()  # One commit at a time
+        self._last_prune = 0.0
+        self.flushes = 0
+        self.records_written = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.errors = 0
+        self.dropped = 0
+        self._attempts = {}  # scan id -> failed flushes so far
+
+    def submit(self, record):
+        record.setdefault('id', new_scan_id())  # Stable ID, known before the commit
+        with self._cond:
+            self._buffer.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)  # Durability on shutdown
+            if len(self._buffer) >= FLUSH_MAX_RECORDS:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return list(reversed(self._buffer))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._buffer) >= FLUSH_MAX_RECORDS, timeout=FLUSH_INTERVAL)
+            self.flush()
+            if time.time() - self._last_prune >= ROLLUP_PRUNE_INTERVAL:
+                self._last_prune = time.time()
+                try:
+                    prune_rollups()
+                except Exception as e:
+                    print(f"Error pruning rollups: {e}")
+
+    def flush(self):
+        """Commits everything buffered so far. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._buffer
+                self._buffer = []
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            try:
+                conn = get_connection()
+                with conn:
+                    _insert(conn, batch)
+                written = len(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error writing scan history batch, retrying records one by one: {e}")
+                written = self._insert_each(batch)
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.records_written += written
+            self.last_batch_size = written
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    def _insert_each(self, batch):
+        """
+        One transaction per record, so a bad record can't block the rest.
+        Records that can never be written (duplicate ID, unserialisable)
+        are dropped at once; others go back in front of the buffer until
+        they have failed FLUSH_MAX_RETRIES flushes. Returns the number written.
+        """
+        written = 0
+        retry = []
+        for record in batch:
+            try:
+                conn = get_connection()
+                with conn:
+                    _insert(conn, [record])
+                written += 1
+                self._attempts.pop(record['id'], None)
+                continue
+            except (sqlite3.IntegrityError, TypeError, ValueError) as e:
+                error, attempts = e, FLUSH_MAX_RETRIES
+            except Exception as e:
+                error, attempts = e, self._attempts.get(record['id'], 0) + 1
+            if attempts >= FLUSH_MAX_RETRIES:
+                self._attempts.pop(record['id'], None)
+                self.dropped += 1
+                print(f"Dropping scan {record['id']} from history: {error}")
+            else:
+                self._attempts[record['id']] = attempts
+                retry.append(record)
+        if retry:
+            with self._cond:
+                self._buffer = retry + self._buffer
+        return written
+
+    def stats(self):
+        with self._cond:
+            backlog = len(self._buffer)
+        return {
+            'backlog': backlog,
+            'flushes': self.flushes,
+            'records_written': self.records_written,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'errors': self.errors,
+            'dropped': self.dropped
+        }
+
+
+writer = HistoryWriter()
@@ -1,14 +1,46 @@
 import tensorflow as tf
 import os
+import json
+import datetime
 
 MODEL_PATH = 'final_model.h5'
 
-def load_currency_model():
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError(f"Model file not found at {MODEL_PATH}. Please run train_model.py first.")
+def load_currency_model(model_path=MODEL_PATH):
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at {model_path}. Please run train_model.py first.")
     try:
-        model = tf.keras.models.load_model(MODEL_PATH)
+        model = tf.keras.models.load_model(model_path)
         return model
     except Exception as e:
         print(f"Error loading model: {e}")
         return None
+
+def manifest_path(model_path):
+    return model_path + '.manifest.json'
+
+def publish_model(model, model_path=MODEL_PATH):
+    """
+    Atomically replaces the serving model file, then writes a manifest
+    describing it. Running servers only hot-swap a file whose manifest
+    matches, so checkpoints and half-written files are never served.
+    """
+    tmp_path = f"{model_path}.{os.getpid()}.tmp.h5"
+    model.save(tmp_path)
+    os.replace(tmp_path, model_path)
+    stat = os.stat(model_path)
+    tmp_manifest = manifest_path(model_path) + '.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'published_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+    os.replace(tmp_manifest, manifest_path(model_path))
+    print(f"Published {model_path}")
+
+def is_published(model_path=MODEL_PATH):
+    """True if model_path is a complete artifact written by publish_model()."""
+    try:
+        with open(manifest_path(model_path)) as f:
+            manifest = json.load(f)
+        stat = os.stat(model_path)
+    except (OSError, ValueError):
+        return False
+    return manifest.get('size') == stat.st_size and manifest.get('mtime_ns') == stat.st_mtime_ns
@@ -0,0 +1,341 @@
+import os
+import time
+import queue
+import random
+import threading
+import datetime
+import numpy as np
+import tensorflow as tf
+from model_loader import load_currency_model, is_published, MODEL_PATH
+import saliency
+
+# Configuration
+SCORE_BINS = 20              # Histogram resolution for per-version score distributions
+SHADOW_BATCH_SIZE = 16
+SHADOW_MAX_WAIT = 2.0        # Seconds a partial shadow batch may wait before it is scored
+SHADOW_QUEUE_SIZE = 256      # Shadow samples are dropped (never block serving) beyond this
+WATCH_INTERVAL = 10          # Seconds between checks of the model file for a retrained version
+
+
+def make_version(model_path):
+    """Version label derived from the file name and its modification time."""
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    mtime = datetime.datetime.fromtimestamp(os.path.getmtime(model_path))
+    return f"{name}@{mtime.strftime('%Y%m%d-%H%M%S')}"
+
+
+class ModelRegistry:
+    """
+    Holds every loaded model version, the one currently serving, and an
+    optional shadow candidate that is scored off the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}          # version -> {'model', 'path', 'loaded_at'}
+        self._stats = {}           # version -> score distribution
+        self.active_version = None
+        self.shadow_version = None
+        self.shadow_rate = 0.0
+        self._shadow_queue = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+        self._shadow_thread = None
+        self._watch_thread = None
+        self._loading = set()
+        self.warmup = None         # Optional callable(version), run on a hot-swapped version before it serves
+
+    # --- Loading & swapping ---
+
+    def load(self, model_path, version=None):
+        """Loads a model file synchronously and registers it. Returns the version."""
+        version = version or make_version(model_path)
+        if version in self._models:
+            return version
+
+        start = time.time()
+        model = load_currency_model(model_path)
+        if model is None:
+            raise RuntimeError(f"Failed to load model from {model_path}")
+
+        # Embedding and Grad-CAM heads share the weights; built before the entry is visible,
+        # so concurrent requests (and warm-up) never build or see them half-made
+        entry = {
+            'model': model,
+            'embed_model': build_embed_model(model),
+            'grad_model': saliency.build_grad_model(model),
+            'path': model_path,
+            'loaded_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with self._lock:
+            if version in self._models:
+                return version  # Loaded concurrently
+            self._models[version] = entry
+            self._stats.setdefault(version, _empty_stats())
+        print(f"Loaded model {version} in {time.time() - start:.1f}s")
+        return version
+
+    def load_async(self, model_path, version=None, activate=False):
+        """Loads a model on a background thread; serving continues on the current version."""
+        def _run():
+            try:
+                loaded = self.load(model_path, version)
+                if self.warmup:
+                    try:
+                        self.warmup(loaded)
+                    except Exception as e:
+                        print(f"Warm-up of {loaded} failed, serving it cold: {e}")
+                if activate:
+                    previous = self.active_version
+                    self.activate(loaded)
+                    # A reload of the same file replaces the old version outright
+                    if previous and previous != loaded and self._models[previous]['path'] == model_path:
+                        self.unload(previous)
+            except Exception as e:
+                print(f"Background model load failed: {e}")
+            finally:
+                with self._lock:
+                    self._loading.discard(model_path)
+
+        with self._lock:
+            if model_path in self._loading:
+                return None
+            self._loading.add(model_path)
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        return thread
+
+    def activate(self, version):
+        """Atomically swaps serving to an already loaded version."""
+        with self._lock:
+            if version not in self._models:
+                raise KeyError(f"Model version {version} is not loaded")
+            previous = self.active_version
+            self.active_version = version
+            if self.shadow_version == version:
+                self.shadow_version = None
+        print(f"Serving model switched: {previous} -> {version}")
+
+    def unload(self, version):
+        with self._lock:
+            if version == self.active_version:
+                raise ValueError("Cannot unload the serving model")
+            if version == self.shadow_version:
+                self.shadow_version = None
+            self._models.pop(version, None)
+
+    def get_model(self, version=None):
+        entry = self._models.get(version or self.active_version)
+        return entry['model'] if entry else None
+
+    def input_size(self, version=None):
+        """(width, height) the model expects, as PIL sizes; compact students use less than 224x224."""
+        model = self.get_model(version)
+        if model is None:
+            return (224, 224)
+        return (model.input_shape[2], model.input_shape[1])
+
+    def versions(self):
+        with self._lock:
+            return list(self._models)
+
+    # --- Serving ---
+
+    def predict(self, img_array, version=None, record=True):
+        """
+        Scores a batch with the given version (default: the serving one).
+        The model reference is taken once, so a concurrent swap never
+        mixes versions within a request. Returns (scores, version).
+        record=False keeps auxiliary batches (e.g. TTA views) out of the
+        per-version statistics and shadow sampling.
+        """
+        scores, _, _, version = self._serve(img_array, version, record, mode=None)
+        return scores, version
+
+    def predict_with_embedding(self, img_array, version=None, record=True):
+        """Scores plus pooled backbone embeddings from the same forward pass. Returns (scores, embeddings, version)."""
+        scores, _, embeddings, version = self._serve(img_array, version, record, mode='embed')
+        return scores, embeddings, version
+
+    def predict_with_cam(self, img_array, version=None, record=True, threshold=0.5, verdicts=None):
+        """
+        Scores, Grad-CAM maps and embeddings from one forward/backward pass.
+        Maps explain `verdicts` if given, else the class at `threshold`
+        (see saliency.forward_with_cam). Returns (scores, cams, embeddings, version).
+        """
+        return self._serve(img_array, version, record, mode='cam', cam_target=(threshold, verdicts))
+
+    def embed(self, img_array, version=None):
+        """Pooled backbone embeddings only (not recorded). Returns (embeddings, version)."""
+        _, _, embeddings, version = self._serve(img_array, version, record=False, mode='embed')
+        return embeddings, version
+
+    def _serve(self, img_array, version, record, mode, cam_target=(0.5, None)):
+        with self._lock:
+            version = version or self.active_version
+            entry = self._models.get(version)
+            shadow_version = self.shadow_version if version == self.active_version else None
+            shadow_rate = self.shadow_rate
+        if entry is None:
+            raise RuntimeError('Model not loaded')
+
+        model = entry['model']
+        inputs = _fit_input(model, img_array)
+        cams = embeddings = None
+        if mode == 'cam':
+            scores, cams, embeddings = saliency.forward_with_cam(entry['grad_model'], inputs, *cam_target)
+        elif mode == 'embed':
+            pooled, scores = entry['embed_model'].predict(inputs, verbose=0)
+            embeddings, scores = pooled, scores.reshape(-1)
+        else:
+            scores = model.predict(inputs, verbose=0).reshape(-1)
+        if not record:
+            return scores, cams, embeddings, version
+        self._record(version, scores)
+
+        if shadow_version and random.random() < shadow_rate:
+            try:
+                self._shadow_queue.put_nowait((shadow_version, img_array, scores))
+            except queue.Full:
+                pass  # Shadow scoring is best-effort
+        return scores, cams, embeddings, version
+
+    # --- Shadow scoring ---
+
+    def set_shadow(self, version, rate):
+        """Runs `version` on a `rate` fraction of served traffic, off the request path."""
+        with self._lock:
+            if version is not None and version not in self._models:
+                raise KeyError(f"Model version {version} is not loaded")
+            self.shadow_version = version
+            self.shadow_rate = max(0.0, min(1.0, float(rate)))
+            if version and self._shadow_thread is None:
+                self._shadow_thread = threading.Thread(target=self._shadow_worker, daemon=True)
+                self._shadow_thread.start()
+
+    def _shadow_worker(self):
+        while True:
+            batch = [self._shadow_queue.get()]
+            deadline = time.time() + SHADOW_MAX_WAIT
+            while len(batch) < SHADOW_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._shadow_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Group by candidate in case the shadow version changed mid-batch
+            by_version = {}
+            for version, img_array, served_scores in batch:
+                by_version.setdefault(version, []).append((img_array, served_scores))
+
+            for version, items in by_version.items():
+                model = self.get_model(version)
+                if model is None:
+                    continue
+                try:
+                    inputs = np.concatenate([img for img, _ in items])
+                    served = np.concatenate([s for _, s in items])
+                    scores = model.predict(_fit_input(model, inputs), verbose=0).reshape(-1)
+                    self._record(version, scores, served)
+                except Exception as e:
+                    print(f"Shadow scoring failed for {version}: {e}")
+
+    # --- Score distributions ---
+
+    def _record(self, version, scores, served_scores=None):
+        hist, _ = np.histogram(scores, bins=SCORE_BINS, range=(0.0, 1.0))
+        with self._lock:
+            stats = self._stats.setdefault(version, _empty_stats())
+            stats['count'] += len(scores)
+            stats['score_sum'] += float(np.sum(scores))
+            stats['fake_count'] += int(np.sum(scores <= 0.5))
+            stats['histogram'] = [a + int(b) for a, b in zip(stats['histogram'], hist)]
+            if served_scores is not None:
+                stats['compared'] += len(scores)
+                stats['agreements'] += int(np.sum((scores > 0.5) == (served_scores > 0.5)))
+                stats['abs_diff_sum'] += float(np.sum(np.abs(scores - served_scores)))
+
+    def summary(self):
+        """Per-version stats for the admin performance page."""
+        with self._lock:
+            rows = []
+            for version, entry in self._models.items():
+                stats = self._stats.get(version, _empty_stats())
+                count = stats['count']
+                compared = stats['compared']
+                rows.append({
+                    'version': version,
+                    'path': entry['path'],
+                    'loaded_at': entry['loaded_at'],
+                    'role': 'serving' if version == self.active_version
+                            else 'shadow' if version == self.shadow_version else 'standby',
+                    'count': count,
+                    'mean_score': round(stats['score_sum'] / count, 4) if count else None,
+                    'fake_rate': round(stats['fake_count'] / count * 100, 1) if count else None,
+                    'histogram': stats['histogram'],
+                    'agreement': round(stats['agreements'] / compared * 100, 1) if compared else None,
+                    'mean_abs_diff': round(stats['abs_diff_sum'] / compared, 4) if compared else None
+                })
+            return {
+                'active_version': self.active_version,
+                'shadow_version': self.shadow_version,
+                'shadow_rate': self.shadow_rate,
+                'models': rows
+            }
+
+    # --- Hot reload ---
+
+    def watch(self, model_path=MODEL_PATH, interval=WATCH_INTERVAL):
+        """
+        Polls the model file and hot-swaps to a retrained version once
+        training has published it (see model_loader.publish_model). Every
+        worker runs its own watcher, so a new train_model.py output reaches
+        all of them without a restart.
+        """
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if not os.path.exists(model_path) or not is_published(model_path):
+                        continue  # Only complete, published artifacts (not checkpoints or partial writes)
+                    version = make_version(model_path)
+                    if version not in self._models:
+                        print(f"Detected new model file: {version}")
+                        self.load_async(model_path, version, activate=True)
+                except Exception as e:
+                    print(f"Model watcher error: {e}")
+
+        if self._watch_thread is None:
+            self._watch_thread = threading.Thread(target=_run, daemon=True)
+            self._watch_thread.start()
+
+
+def build_embed_model(model):
+    """Shares the classifier's weights: image -> (pooled embedding, score) in one forward pass."""
+    pooling = next(layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D))
+    return tf.keras.models.Model(inputs=model.inputs, outputs=[pooling.output, model.output])
+
+
+def _fit_input(model, img_array):
+    # Shadow candidates may use a different input size than the serving model
+    size = tuple(model.input_shape[1:3])
+    if tuple(img_array.shape[1:3]) == size:
+        return img_array
+    return tf.image.resize(img_array, size, method='nearest').numpy()
+
+
+def _empty_stats():
+    return {
+        'count': 0,
+        'score_sum': 0.0,
+        'fake_count': 0,
+        'histogram': [0] * SCORE_BINS,
+        'compared': 0,
+        'agreements': 0,
+        'abs_diff_sum': 0.0
+    }
+
+
+# Shared instance used by app.py and the admin blueprint
+registry = ModelRegistry()
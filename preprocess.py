@@ -30,3 +30,24 @@ def preprocess_image(file_storage, target_size=(224, 224)):
     except Exception as e:
         print(f"Error preprocessing image: {e}")
         return None
+
+def parse_size(text):
+    """'WxH' -> (W, H), or None if it is not one."""
+    try:
+        width, height = (int(v) for v in (text or '').lower().split('x'))
+    except ValueError:
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+def pixels_to_array(data, size, target_size=(224, 224)):
+    """
+    Builds the model input from raw RGB bytes the client already resized
+    (uint8, row-major, `size` as 'WxH'). Returns None if the payload does
+    not match target_size, so the caller can decode the upload instead.
+    """
+    size = parse_size(size)
+    if size != tuple(target_size) or len(data) != size[0] * size[1] * 3:
+        return None
+    width, height = size
+    img_array = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3).astype(np.float32) / 255.0
+    return np.expand_dims(img_array, axis=0)
@@ -0,0 +1,112 @@
+import os
+import threading
+import numpy as np
+import cv2
+import tensorflow as tf
+from tensorflow.keras.layers import GlobalAveragePooling2D
+from tensorflow.keras.models import Model
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+SALIENCY_ENABLED = True      # Score /predict through the Grad-CAM pass (adds a backward pass); off = no maps or map-based reasons
+SALIENCY_DIR = os.path.join(BASE_DIR, 'saliency_cache')
+OVERLAY_ALPHA = 0.45         # Heatmap opacity over the note
+OVERLAY_MAX_SIDE = 1200      # Overlays are rendered at most this large
+REGION_NAMES = [['upper-left', 'upper-centre', 'upper-right'],
+                ['left', 'centre', 'right'],
+                ['lower-left', 'lower-centre', 'lower-right']]
+
+
+def build_grad_model(model):
+    """Shares the classifier's weights: image -> (last conv feature map, score)."""
+    pooling = next(layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D))
+    return Model(inputs=model.inputs, outputs=[pooling.input, model.output])
+
+
+def forward_with_cam(grad_model, img_array, threshold=0.5, verdicts=None):
+    """
+    One forward/backward pass over a batch. Returns (scores, cams,
+    embeddings) where cams[i] is a [0, 1] Grad-CAM map (conv resolution)
+    and embeddings[i] is the pooled backbone feature vector. Each map
+    explains verdicts[i] ('REAL'/'FAKE') when given, otherwise the class
+    the score predicts at `threshold` (the pipeline's, not a fixed 0.5).
+    Samples do not interact (inference mode), so one gradient of the
+    summed targets gives every per-image gradient.
+    """
+    x = tf.convert_to_tensor(img_array, dtype=tf.float32)
+    with tf.GradientTape() as tape:
+        features, scores = grad_model(x, training=False)
+        scores = tf.reshape(scores, [-1])
+        if verdicts is None:
+            real = scores > threshold
+        else:
+            real = tf.constant([v == 'REAL' for v in verdicts])
+        # Evidence for the verdict's class
+        targets = tf.where(real, scores, 1.0 - scores)
+    grads = tape.gradient(targets, features)
+
+    weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+    cams = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+    peak = tf.reduce_max(cams, axis=(1, 2), keepdims=True)
+    cams = tf.math.divide_no_nan(cams, peak)
+    embeddings = tf.reduce_mean(features, axis=(1, 2))
+    return scores.numpy(), cams.numpy(), embeddings.numpy()
+
+
+# --- Cache (content hash + model version) ---
+
+def _cache_path(digest, version):
+    # One map per image and model: it is the map of the scan's own /predict pass
+    safe_version = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in (version or 'default'))
+    return os.path.join(SALIENCY_DIR, digest[:2], f"{digest}_{safe_version}.npy")
+
+
+def save_cam(digest, version, cam):
+    path = _cache_path(digest, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, cam.astype(np.float16))
+    os.replace(tmp_path, path)
+
+
+def load_cam(digest, version):
+    path = _cache_path(digest, version)
+    if not os.path.exists(path):
+        return None
+    return np.load(path).astype(np.float32)
+
+
+# --- Presentation ---
+
+def overlay(image_path, cam):
+    """JPEG bytes of the note with the Grad-CAM heatmap blended over it."""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError('Failed to read image')
+    scale = min(1.0, OVERLAY_MAX_SIDE / max(img.shape[:2]))
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    heat = cv2.resize(cam, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_CUBIC)
+    heat = cv2.applyColorMap(np.uint8(255 * np.clip(heat, 0, 1)), cv2.COLORMAP_JET)
+    blended = cv2.addWeighted(heat, OVERLAY_ALPHA, img, 1 - OVERLAY_ALPHA, 0)
+    _, buffer = cv2.imencode('.jpg', blended)
+    return buffer.tobytes()
+
+
+def describe(cam):
+    """Model-grounded reasons: where on the note the evidence for the verdict sits."""
+    if cam is None or not np.any(cam):
+        return []
+    h, w = cam.shape
+    ys, xs = np.array_split(np.arange(h), 3), np.array_split(np.arange(w), 3)
+    total = float(cam.sum())
+    regions = sorted(
+        ((float(cam[np.ix_(y, x)].sum()) / total, REGION_NAMES[i][j])
+         for i, y in enumerate(ys) for j, x in enumerate(xs) if len(y) and len(x)),
+        reverse=True)
+    share, name = regions[0]
+    reasons = [f"Model evidence concentrated in the {name} of the note ({share * 100:.0f}% of attention)"]
+    if regions[1][0] > 0.2:
+        reasons.append(f"Secondary evidence in the {regions[1][1]} ({regions[1][0] * 100:.0f}%)")
+    return reasons
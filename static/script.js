@@ -11,6 +11,13 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentFile = null;
     let stream = null;
 
+    // Upload encoding: the model sees 224x224, so full-resolution photos mostly cost bandwidth
+    const UPLOAD_MAX_SIDE = 1280;          // Keep >= TILED_MIN_SIDE on the server if tiled mode is on
+    const UPLOAD_TYPE = 'image/webp';      // Falls back to JPEG where the browser can't encode WebP
+    const UPLOAD_QUALITY = 0.85;
+    const SEND_MODEL_PIXELS = false;       // Send the model input as raw RGB (~147 KB) instead of the photo: no server decode
+    const MODEL_INPUT_SIZE = 224;
+
     // --- Initialization ---
     initSession();
     initAccessTools();
@@ -99,8 +106,78 @@ document.addEventListener('DOMContentLoaded', function() {
             document.getElementById('quality-advisory').classList.add('hidden');
         }
 
-        currentFile = file;
-        scanImage(file);
+        const original = file;
+        createImageBitmap(file)
+            .then(bitmap => {
+                const large = Math.max(bitmap.width, bitmap.height) > UPLOAD_MAX_SIDE;
+                if (!large && !SEND_MODEL_PIXELS) {
+                    bitmap.close();
+                    return { file: original, pixels: null };
+                }
+                return prepareUpload(bitmap, bitmap.width, bitmap.height, original.name)
+                    .then(upload => {
+                        bitmap.close();
+                        // The photo stays local (preview, report) unless the server asks for it
+                        return large ? upload : { file: original, pixels: upload.pixels, originalSize: upload.originalSize };
+                    });
+            })
+            .catch(err => {
+                console.warn('Client-side resize failed, uploading original:', err);
+                return { file: original, pixels: null };
+            })
+            .then(upload => {
+                currentFile = upload.file;
+                scanImage(upload.file, upload.pixels, upload.originalSize);
+            });
+    }
+
+    function prepareUpload(source, width, height, name) {
+        // Downscaled, compactly encoded copy (+ optional model-size pixels) of an image or video frame
+        const scale = Math.min(1, UPLOAD_MAX_SIDE / Math.max(width, height));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.round(width * scale);
+        canvas.height = Math.round(height * scale);
+        const ctx = canvas.getContext('2d');
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(source, 0, 0, canvas.width, canvas.height);
+
+        const pixels = SEND_MODEL_PIXELS ? modelPixels(source, width, height) : null;
+        return encodeCanvas(canvas).then(blob => {
+            const ext = blob.type === 'image/webp' ? 'webp' : 'jpg';
+            const base = (name || 'capture').replace(/\.[^.]+$/, '');
+            return { file: new File([blob], `${base}.${ext}`, { type: blob.type }), pixels: pixels,
+                     originalSize: `${width}x${height}` };
+        });
+    }
+
+    function encodeCanvas(canvas) {
+        return new Promise((resolve, reject) => {
+            canvas.toBlob(blob => {
+                // Browsers without a WebP encoder silently return PNG
+                if (blob && blob.type === UPLOAD_TYPE) {
+                    resolve(blob);
+                } else {
+                    canvas.toBlob(jpeg => jpeg ? resolve(jpeg) : reject(new Error('Encoding failed')), 'image/jpeg', UPLOAD_QUALITY);
+                }
+            }, UPLOAD_TYPE, UPLOAD_QUALITY);
+        });
+    }
+
+    function modelPixels(source, width, height) {
+        // Nearest-neighbour from the full-resolution source, like the server's resize
+        const canvas = document.createElement('canvas');
+        canvas.width = canvas.height = MODEL_INPUT_SIZE;
+        const ctx = canvas.getContext('2d');
+        ctx.imageSmoothingEnabled = false;
+        ctx.drawImage(source, 0, 0, width, height, 0, 0, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE);
+        const rgba = ctx.getImageData(0, 0, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE).data;
+        const rgb = new Uint8Array(MODEL_INPUT_SIZE * MODEL_INPUT_SIZE * 3);
+        for (let i = 0, j = 0; i < rgba.length; i += 4) {
+            rgb[j++] = rgba[i];
+            rgb[j++] = rgba[i + 1];
+            rgb[j++] = rgba[i + 2];
+        }
+        return new Blob([rgb], { type: 'application/octet-stream' });
     }
 
     function openCamera() {
@@ -129,16 +206,18 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function captureImage() {
-        const canvas = document.createElement('canvas');
-        canvas.width = video.videoWidth;
-        canvas.height = video.videoHeight;
-        canvas.getContext('2d').drawImage(video, 0, 0);
-        
-        canvas.toBlob(blob => {
-            const file = new File([blob], "camera_capture.jpg", { type: "image/jpeg" });
-            handleFile(file);
-            closeCamera();
-        }, 'image/jpeg');
+        // Straight from the video frame to the upload size: the full-resolution frame is never encoded
+        prepareUpload(video, video.videoWidth, video.videoHeight, 'camera_capture')
+            .then(upload => {
+                closeCamera();
+                document.getElementById('quality-advisory').classList.add('hidden');
+                currentFile = upload.file;
+                scanImage(upload.file, upload.pixels, upload.originalSize);
+            })
+            .catch(err => {
+                console.error(err);
+                showError('Could not capture image.');
+            });
     }
 
     function runDemo() {
@@ -152,7 +231,7 @@ document.addEventListener('DOMContentLoaded', function() {
             .catch(() => showError("Demo file not found."));
     }
 
-    function scanImage(file) {
+    function scanImage(file, pixels, originalSize) {
         // Reset UI
         resultContainer.classList.add('hidden');
         document.getElementById('certificate-container').classList.add('hidden');
@@ -164,7 +243,16 @@ document.addEventListener('DOMContentLoaded', function() {
         updateTimeline(1); // Uploading
         
         const formData = new FormData();
-        formData.append('file', file);
+        if (pixels) {
+            // Model input only: the server scores and routes without the photo (nothing is stored)
+            formData.append('pixels', pixels, 'pixels.rgb');
+            formData.append('pixels_size', `${MODEL_INPUT_SIZE}x${MODEL_INPUT_SIZE}`);
+            // Aspect ratio for the denomination router, so the server routes on the pixels alone
+            formData.append('original_size', originalSize);
+            formData.append('filename', file.name);
+        } else {
+            formData.append('file', file);
+        }
 
         setTimeout(() => updateTimeline(2), 800); // Analyzing
 
@@ -174,12 +262,19 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(response => response.json())
         .then(data => {
+            if (data.error && pixels) {
+                // Pixel payload refused (model size changed, tiled mode): send the photo instead
+                scanImage(file, null, originalSize);
+                return;
+            }
             setTimeout(() => {
                 updateTimeline(3); // Verifying
                 setTimeout(() => {
                     loading.style.display = 'none';
                     if (data.error) {
                         showError(data.error);
+                    } else if (data.result === 'UNKNOWN') {
+                        showError(data.reasons[0]);
                     } else {
                         displayResult(data, file);
                     }
@@ -500,11 +595,16 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         }
 
+        document.getElementById('report-img-original').src = URL.createObjectURL(file);
+        if (!data.stored_name) {
+            return; // Pixel-only scan: no stored image to build visual layers from
+        }
+
         // Fetch Visual Layers
         fetch('/analyze_visuals', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({filename: data.filename})
+            body: JSON.stringify({filename: data.filename, stored_name: data.stored_name})
         })
         .then(res => res.json())
         .then(visuals => {
@@ -513,9 +613,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             // Set images in Report Template
-            document.getElementById('report-img-original').src = URL.createObjectURL(file);
             document.getElementById('report-img-edges').src = visuals.edges;
-            document.getElementById('report-img-heatmap').src = visuals.heatmap;
+            // Grad-CAM overlay from the model when available, colour heatmap otherwise
+            document.getElementById('report-img-heatmap').src = data.saliency_url || visuals.heatmap;
             document.getElementById('report-img-noise').src = visuals.noise;
         })
         .catch(console.error);
@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import cv2
+import numpy as np
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+FEATURES_ROOT = os.path.join(BASE_DIR, 'Fake-Currency-Detection-System-main', 'Project_files', 'Dataset')
+INDEX_DIR = os.path.join(BASE_DIR, 'template_index')
+SCALES = (1.0, 0.75, 0.5)
+
+# ORB settings - MUST MATCH the reference notebooks (computeORB)
+ORB_PARAMS = {
+    'nfeatures': 700,
+    'scaleFactor': 1.2,
+    'nlevels': 8,
+    'edgeThreshold': 15  # Changed default (31)
+}
+
+TEMPLATE_BLUR = (5, 5)  # Gaussian kernel applied before ORB, as the notebooks blur templates and notes
+
+DESCRIPTOR_SIZE = 32  # ORB descriptors are 256 bits
+KEYPOINT_FIELDS = ('x', 'y', 'size', 'angle', 'response', 'octave')
+
+TEMPLATE_DTYPE = np.dtype([
+    ('feature_id', np.int16),
+    ('template_id', np.int16),
+    ('scale', np.float32),
+    ('width', np.int32),
+    ('height', np.int32),
+    ('start', np.int64),  # First row in descriptors.npy / keypoints.npy
+    ('count', np.int32)
+])
+
+_FEATURE_DIR_RE = re.compile(r'^(\d+)_Features Dataset$')
+_INDEX_CACHE = {}
+
+
+def list_denominations():
+    """Denominations that have a 'Feature N' template folder set."""
+    if not os.path.isdir(FEATURES_ROOT):
+        return []
+    found = []
+    for name in os.listdir(FEATURES_ROOT):
+        match = _FEATURE_DIR_RE.match(name)
+        if match:
+            found.append(match.group(1))
+    return sorted(found, key=int)
+
+
+def list_template_images(denomination):
+    """Returns [(feature_id, template_id, relative_path)] for one denomination."""
+    root = os.path.join(FEATURES_ROOT, f'{denomination}_Features Dataset')
+    images = []
+    for feature_dir in os.listdir(root):
+        if not feature_dir.startswith('Feature '):
+            continue
+        feature_id = int(feature_dir.split(' ', 1)[1])
+        for fname in os.listdir(os.path.join(root, feature_dir)):
+            stem, ext = os.path.splitext(fname)
+            if ext.lower() not in ('.jpg', '.jpeg', '.png') or not stem.isdigit():
+                continue
+            rel_path = os.path.relpath(os.path.join(root, feature_dir, fname), FEATURES_ROOT)
+            images.append((feature_id, int(stem), rel_path))
+    return sorted(images)
+
+
+def get_file_hash(filepath):
+    hasher = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def create_orb():
+    return cv2.ORB_create(
+        ORB_PARAMS['nfeatures'],
+        ORB_PARAMS['scaleFactor'],
+        ORB_PARAMS['nlevels'],
+        ORB_PARAMS['edgeThreshold'])
+
+
+def extract_template(orb, gray, scale):
+    """Runs ORB on one template at one scale. Returns (keypoints, descriptors, (w, h))."""
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    h, w = gray.shape[:2]
+
+    kpts, descs = orb.detectAndCompute(gray, None)
+    if descs is None:
+        return np.zeros((0, len(KEYPOINT_FIELDS)), np.float32), np.zeros((0, DESCRIPTOR_SIZE), np.uint8), (w, h)
+
+    geometry = np.array(
+        [[k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave] for k in kpts],
+        dtype=np.float32)
+    return geometry, descs.astype(np.uint8), (w, h)
+
+
+def _index_paths(denomination):
+    index_dir = os.path.join(INDEX_DIR, denomination)
+    return {
+        'dir': index_dir,
+        'descriptors': os.path.join(index_dir, 'descriptors.npy'),
+        'keypoints': os.path.join(index_dir, 'keypoints.npy'),
+        'templates': os.path.join(index_dir, 'templates.npy'),
+        'manifest': os.path.join(index_dir, 'manifest.json')
+    }
+
+
+def _load_previous(paths):
+    """Loads the existing index (if any) so unchanged templates can be reused."""
+    try:
+        with open(paths['manifest'], 'r') as f:
+            manifest = json.load(f)
+        if (manifest.get('orb_params') != ORB_PARAMS or manifest.get('scales') != list(SCALES)
+                or manifest.get('blur') != list(TEMPLATE_BLUR)):
+            return None
+        return {
+            'manifest': manifest,
+            'descriptors': np.load(paths['descriptors'], mmap_mode='r'),
+            'keypoints': np.load(paths['keypoints'], mmap_mode='r'),
+            'templates': np.load(paths['templates'])
+        }
+    except (OSError, ValueError):
+        return None
+
+
+def _save_array(path, array):
+    # Write next to the target and swap in atomically so workers that
+    # already mapped the old file keep a consistent view.
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def build_index(denomination, force=False):
+    """
+    Builds (or incrementally refreshes) the descriptor index for one denomination.
+    Only templates whose file changed since the last build are re-extracted.
+    """
+    paths = _index_paths(denomination)
+    os.makedirs(paths['dir'], exist_ok=True)
+    previous = None if force else _load_previous(paths)
+    old_sources = previous['manifest']['sources'] if previous else {}
+
+    orb = create_orb()
+    template_rows = []
+    geometry_parts = []
+    descriptor_parts = []
+    sources = {}
+    next_row = 0
+    reused = 0
+    extracted = 0
+
+    for feature_id, template_id, rel_path in list_template_images(denomination):
+        abs_path = os.path.join(FEATURES_ROOT, rel_path)
+        stat = os.stat(abs_path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        old = old_sources.get(rel_path)
+        if old and (old['size'], old['mtime_ns']) == (entry['size'], entry['mtime_ns']):
+            entry['sha1'] = old['sha1']
+        else:
+            entry['sha1'] = get_file_hash(abs_path)
+        unchanged = old is not None and old['sha1'] == entry['sha1']
+        sources[rel_path] = entry
+
+        gray = None
+        for scale in SCALES:
+            old_rows = []
+            if unchanged:
+                t = previous['templates']
+                old_rows = t[(t['feature_id'] == feature_id) & (t['template_id'] == template_id)
+                             & np.isclose(t['scale'], scale)]
+
+            if len(old_rows) == 1:
+                row = old_rows[0]
+                start, count = int(row['start']), int(row['count'])
+                geometry = np.asarray(previous['keypoints'][start:start + count])
+                descs = np.asarray(previous['descriptors'][start:start + count])
+                size = (int(row['width']), int(row['height']))
+                reused += 1
+            else:
+                if gray is None:
+                    gray = cv2.imread(abs_path, cv2.IMREAD_GRAYSCALE)
+                    if gray is None:
+                        print(f"Skipping unreadable template: {rel_path}")
+                        break
+                    gray = cv2.GaussianBlur(gray, TEMPLATE_BLUR, 0)
+                geometry, descs, size = extract_template(orb, gray, scale)
+                extracted += 1
+
+            template_rows.append((feature_id, template_id, scale, size[0], size[1], next_row, len(descs)))
+            geometry_parts.append(geometry)
+            descriptor_parts.append(descs)
+            next_row += len(descs)
+
+    templates = np.array(template_rows, dtype=TEMPLATE_DTYPE)
+    keypoints = np.concatenate(geometry_parts) if geometry_parts else np.zeros((0, len(KEYPOINT_FIELDS)), np.float32)
+    descriptors = np.concatenate(descriptor_parts) if descriptor_parts else np.zeros((0, DESCRIPTOR_SIZE), np.uint8)
+
+    # Release the old mappings before replacing the files underneath them
+    previous = None
+
+    _save_array(paths['descriptors'], np.ascontiguousarray(descriptors, dtype=np.uint8))
+    _save_array(paths['keypoints'], np.ascontiguousarray(keypoints, dtype=np.float32))
+    _save_array(paths['templates'], templates)
+
+    manifest = {
+        'denomination': denomination,
+        'orb_params': ORB_PARAMS,
+        'scales': list(SCALES),
+        'blur': list(TEMPLATE_BLUR),
+        'keypoint_fields': list(KEYPOINT_FIELDS),
+        'total_descriptors': int(len(descriptors)),
+        'sources': sources
+    }
+    tmp_manifest = paths['manifest'] + '.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, paths['manifest'])  # Manifest last: marks the index as complete
+
+    print(f"[{denomination}] {len(templates)} template views, {len(descriptors)} descriptors "
+          f"({extracted} extracted, {reused} reused)")
+    return manifest
+
+
+class TemplateIndex:
+    """Read-only, memory-mapped view over one denomination's descriptor index."""
+
+    def __init__(self, denomination):
+        paths = _index_paths(denomination)
+        with open(paths['manifest'], 'r') as f:
+            self.manifest = json.load(f)
+        self.denomination = denomination
+        self.version = os.path.getmtime(paths['manifest'])
+        # mmap: pages are shared between worker processes through the OS page cache
+        self.descriptors = np.load(paths['descriptors'], mmap_mode='r')
+        self.keypoints = np.load(paths['keypoints'], mmap_mode='r')
+        self.templates = np.load(paths['templates'])
+
+    def feature_ids(self):
+        return sorted(set(int(f) for f in self.templates['feature_id']))
+
+    def templates_for(self, feature_id, scale=None):
+        rows = self.templates[self.templates['feature_id'] == feature_id]
+        if scale is not None:
+            rows = rows[np.isclose(rows['scale'], scale)]
+        return rows
+
+    def descriptors_for(self, row):
+        start, count = int(row['start']), int(row['count'])
+        return self.descriptors[start:start + count]
+
+    def keypoints_for(self, row):
+        start, count = int(row['start']), int(row['count'])
+        return self.keypoints[start:start + count]
+
+
+def load_index(denomination):
+    """Returns the cached TemplateIndex, reopening it if the index was rebuilt."""
+    manifest_path = _index_paths(denomination)['manifest']
+    if not os.path.exists(manifest_path):
+        return None
+    cached = _INDEX_CACHE.get(denomination)
+    if cached is None or cached.version != os.path.getmtime(manifest_path):
+        cached = TemplateIndex(denomination)
+        _INDEX_CACHE[denomination] = cached
+    return cached
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the ORB template descriptor index.')
+    parser.add_argument('--denomination', help='Only build this denomination (default: all)')
+    parser.add_argument('--force', action='store_true', help='Ignore the existing index and re-extract everything')
+    args = parser.parse_args()
+
+    denominations = [args.denomination] if args.denomination else list_denominations()
+    for denom in denominations:
+        build_index(denom, force=args.force)
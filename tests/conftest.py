@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_store
+import upload_store
+
+# Importing app starts the upload store, eviction and history writer: keep them out of the repo
+_tmp = tempfile.mkdtemp(prefix='currency_tests_')
+upload_store.UPLOAD_ROOT = os.path.join(_tmp, 'uploads')
+history_store.HISTORY_DB = os.path.join(_tmp, 'scan_history.db')
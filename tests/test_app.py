@@ -0,0 +1,95 @@
+import io
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('tensorflow')
+
+import app as app_module
+import counterfeit_index
+import saliency
+import upload_store
+from model_registry import registry
+
+INPUT_SIZE = (224, 224)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """/predict with a stub model (score 0.9 -> REAL) and uploads/history kept out of the repo."""
+    monkeypatch.setattr(upload_store, 'UPLOAD_ROOT', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(saliency, 'SALIENCY_DIR', str(tmp_path / 'saliency'))
+    monkeypatch.setattr(registry, 'input_size', lambda version=None: INPUT_SIZE)
+    monkeypatch.setattr(registry, 'get_model', lambda version=None: object())
+    monkeypatch.setattr(registry, 'predict_with_embedding',
+                        lambda img_array, version=None, record=True: (np.array([0.9]), np.zeros((1, 8)), 'test'))
+    monkeypatch.setattr(registry, 'predict_with_cam',
+                        lambda img_array, version=None, record=True, threshold=0.5, verdicts=None:
+                        (np.array([0.9]), np.zeros((1, 7, 7)), np.zeros((1, 8)), 'test'))
+    monkeypatch.setattr(app_module, 'route_denomination', lambda img_array, original_size: ('default', 0.0))
+    monkeypatch.setattr(counterfeit_index, 'match', lambda embedding, version: None)
+    saved = []
+    monkeypatch.setattr(app_module, 'save_history', saved.append)
+    app_module.app.config['TESTING'] = True
+    with app_module.app.test_client() as test_client:
+        test_client.saved = saved
+        yield test_client
+
+
+def _jpeg():
+    out = io.BytesIO()
+    Image.new('RGB', (320, 140), (120, 90, 60)).save(out, format='JPEG')
+    return out.getvalue()
+
+
+def _pixels():
+    return np.full((INPUT_SIZE[1], INPUT_SIZE[0], 3), 128, np.uint8).tobytes()
+
+
+def test_predict_non_ascii_filename(client):
+    # secure_filename('фото.jpg') is 'jpg': the extension must come from the original name
+    response = client.post('/predict', data={'file': (io.BytesIO(_jpeg()), 'фото.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['result'] == 'REAL'
+    assert body['stored_name'].endswith('.jpg')
+    assert os.path.exists(upload_store.resolve(body['stored_name']))
+
+
+def test_saliency_reads_the_map_cached_by_predict(client):
+    response = client.post('/predict', data={'file': (io.BytesIO(_jpeg()), 'note.jpg')},
+                           content_type='multipart/form-data')
+    body = response.get_json()
+    assert body['saliency_url']
+    overlay = client.get(body['saliency_url'])
+    assert overlay.status_code == 200
+    assert overlay.mimetype == 'image/jpeg'
+    # No map for another model version: /saliency never runs the model itself
+    missing = client.get(f"/saliency/{body['stored_name']}?version=other")
+    assert missing.status_code == 404
+
+
+def test_predict_pixels_without_file(client):
+    response = client.post('/predict', data={
+        'pixels': (io.BytesIO(_pixels()), 'pixels.rgb'),
+        'pixels_size': f'{INPUT_SIZE[0]}x{INPUT_SIZE[1]}',
+        'original_size': '1167x519',
+        'filename': 'note.jpg'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['result'] == 'REAL'
+    assert body['stored_name'] is None
+    assert body['saliency_url'] is None
+    assert body['filename'] == 'note.jpg'
+    assert len(client.saved) == 1
+
+
+def test_predict_bad_pixels_without_file(client):
+    response = client.post('/predict', data={
+        'pixels': (io.BytesIO(b'\x00' * 10), 'pixels.rgb'),
+        'pixels_size': f'{INPUT_SIZE[0]}x{INPUT_SIZE[1]}'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+# Configuration
+TILED_ENABLED = False        # Opt-in until the benchmark shows a gain for the serving model
+TILE_SIZE = 224
+TILE_LONG_SIDE = 896         # Scale at which tiles are cut: 4000x1800 scan -> 896x403 -> 4x2 tiles
+TILED_MIN_SIDE = 1200        # Smaller uploads keep the single-resize path
+TILE_COMBINE = 'mean'        # 'mean' | 'median' | 'min' (most suspicious tile decides)
+GLOBAL_WEIGHT = 0.5          # Share of the whole-note score in the combined score
+BENCHMARK_PATH = 'tiled_benchmark.json'
+
+
+def decode_scaled(path, long_side):
+    """
+    Decodes at roughly `long_side` on the longest edge. For JPEGs, draft mode
+    lets libjpeg decode at 1/2, 1/4 or 1/8 scale, so full-resolution pixels
+    that would be thrown away are never produced.
+    """
+    img = Image.open(path)
+    w, h = img.size
+    scale = min(1.0, long_side / max(w, h))
+    size = (max(TILE_SIZE, round(w * scale)), max(TILE_SIZE, round(h * scale)))
+    img.draft('RGB', size)   # No-op for non-JPEG formats
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.size != size:
+        img = img.resize(size, Image.BOX)
+    return img, (w, h)
+
+
+def _positions(length):
+    # Evenly spaced tile origins covering [0, length) with overlap where needed
+    count = max(1, -(-length // TILE_SIZE))
+    if count == 1:
+        return [0]
+    step = (length - TILE_SIZE) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+
+def extract_tiles(img):
+    """(N, 224, 224, 3) float32 grid of tiles in [0, 1]."""
+    arr = np.asarray(img, dtype=np.float32) / 255.0
+    h, w = arr.shape[:2]
+    tiles = [arr[y:y + TILE_SIZE, x:x + TILE_SIZE] for y in _positions(h) for x in _positions(w)]
+    return np.stack(tiles)
+
+
+def preprocess_tiled(path, target_size=(224, 224)):
+    """
+    One reduced-resolution decode yields both the whole-note view (same
+    shape as preprocess_image) and, for large uploads, the tile batch.
+    Returns (img_array, tiles or None).
+    """
+    try:
+        img, original_size = decode_scaled(path, TILE_LONG_SIDE)
+        global_view = np.asarray(img.resize(target_size, Image.NEAREST), dtype=np.float32) / 255.0
+        tiles = extract_tiles(img) if max(original_size) >= TILED_MIN_SIDE else None
+        return np.expand_dims(global_view, axis=0), tiles
+    except Exception as e:
+        print(f"Error preprocessing image (tiled): {e}")
+        return None, None
+
+
+def combine(global_score, tile_scores, method=TILE_COMBINE):
+    if method == 'min':
+        tile_score = float(np.min(tile_scores))
+    elif method == 'median':
+        tile_score = float(np.median(tile_scores))
+    else:
+        tile_score = float(np.mean(tile_scores))
+    return GLOBAL_WEIGHT * global_score + (1 - GLOBAL_WEIGHT) * tile_score
+
+
+def score_tiles(global_score, tiles, model_version):
+    """Scores all tiles in one batch and combines them with the whole-note score."""
+    from model_registry import registry
+    tile_scores, _ = registry.predict(tiles, version=model_version, record=False)
+    score = combine(global_score, tile_scores)
+    return score, {
+        'tiles': len(tile_scores),
+        'global_score': float(global_score),
+        'min_tile_score': round(float(np.min(tile_scores)), 4)
+    }
+
+
+# --- Benchmark ---
+
+def benchmark(split='test', limit=None):
+    """Decode time and accuracy of the single-resize path vs the tiled path."""
+    from model_loader import load_currency_model
+    from preprocess import preprocess_image
+    from embedding_cache import list_split
+
+    model = load_currency_model()
+    paths, labels = list_split(split)
+    if limit:
+        paths, labels = paths[:limit], labels[:limit]
+
+    rows = {'single': [], 'tiled': []}
+    decode_ms = {'single': [], 'tiled': []}
+    tiled_count = 0
+    for path, label in zip(paths, labels):
+        start = time.perf_counter()
+        single = preprocess_image(path)
+        decode_ms['single'].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        global_view, tiles = preprocess_tiled(path)
+        decode_ms['tiled'].append((time.perf_counter() - start) * 1000)
+
+        single_score = float(model.predict(single, verbose=0)[0][0])
+        score = float(model.predict(global_view, verbose=0)[0][0])
+        if tiles is not None:
+            tiled_count += 1
+            score = combine(score, model.predict(tiles, verbose=0).reshape(-1))
+        rows['single'].append(int((single_score > 0.5) == label))
+        rows['tiled'].append(int((score > 0.5) == label))
+
+    results = {
+        'split': split,
+        'images': len(paths),
+        'tiled_images': tiled_count,
+        'tile_long_side': TILE_LONG_SIDE,
+        'combine': TILE_COMBINE
+    }
+    for mode in ('single', 'tiled'):
+        results[mode] = {
+            'accuracy': round(100 * sum(rows[mode]) / max(1, len(rows[mode])), 2),
+            'decode_ms_mean': round(float(np.mean(decode_ms[mode])), 2) if paths else None,
+            'decode_ms_p95': round(float(np.percentile(decode_ms[mode], 95)), 2) if paths else None
+        }
+
+    with open(BENCHMARK_PATH, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{split}: {len(paths)} images, {tiled_count} large enough to tile")
+    print(f"{'mode':>8}{'accuracy':>10}{'decode ms':>12}{'p95 ms':>10}")
+    for mode in ('single', 'tiled'):
+        r = results[mode]
+        print(f"{mode:>8}{r['accuracy']:>10.2f}{r['decode_ms_mean']:>12.2f}{r['decode_ms_p95']:>10.2f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tiled high-resolution inference benchmark.')
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.split, args.limit)
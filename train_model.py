@@ -1,5 +1,8 @@
 import os
 import json
+import math
+import time
+import argparse
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
@@ -8,9 +11,11 @@ from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Inpu
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau, Callback
+from tensorflow.keras import mixed_precision
 from tensorflow.keras.preprocessing.image import load_img, img_to_array
 # from sklearn.utils.class_weight import compute_class_weight # Removed as dataset is balanced
 from sklearn.metrics import confusion_matrix, classification_report
+from model_loader import publish_model
 
 # Configuration
 IMG_SIZE = (224, 224)
@@ -19,8 +24,47 @@ EPOCHS = 30
 LEARNING_RATE = 1e-5 # Reduced from 1e-4
 DATASET_DIR = 'dataset'
 FINAL_MODEL_PATH = 'final_model.h5'
+CHECKPOINT_PATH = os.path.join('checkpoints', 'best_model.h5')  # Best epoch so far; never served
 CLASS_INDICES_PATH = 'class_indices.json'
 HISTORY_PATH = 'training_metrics.json'
+HEAD_EPOCHS = 200  # Head-only training on cached embeddings takes seconds per run
+RUNS_REPORT_PATH = 'training_runs.json'
+
+# Fast mode (opt-in: python train_model.py --fast)
+FAST_BATCH_SIZE = 128  # LR is scaled linearly with batch size
+FAST_PRECISION_POLICY = 'mixed_bfloat16'
+
+class EpochTimer(Callback):
+    def on_train_begin(self, logs=None):
+        self.epoch_times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.time() - self._start)
+
+def cpu_supports_bf16():
+    # bfloat16 only pays off on CPUs with native support (AVX512-BF16 / AMX); emulated it is slower
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+    except OSError:
+        return False
+
+def enable_fast_mode():
+    """Turns on mixed precision where the hardware supports it. Returns the policy used."""
+    if tf.config.list_physical_devices('GPU'):
+        policy = 'mixed_float16'
+    elif cpu_supports_bf16():
+        policy = FAST_PRECISION_POLICY
+    else:
+        print("CPU has no native bfloat16 support - keeping float32 (XLA and large batch still apply)")
+        policy = 'float32'
+    mixed_precision.set_global_policy(policy)
+    print(f"Precision policy: {policy}")
+    return policy
 
 class SanityCheckCallback(Callback):
     def on_epoch_end(self, epoch, logs=None):
@@ -45,7 +89,7 @@ class SanityCheckCallback(Callback):
         except Exception as e:
             print(f"\n[Sanity Check] Failed: {e}\n")
 
-def build_generators():
+def build_generators(batch_size=BATCH_SIZE):
     print("Building Data Generators...")
     
     # 1. Define explicit class names to force mapping
@@ -71,7 +115,7 @@ def build_generators():
     train_gen = train_datagen.flow_from_directory(
         os.path.join(DATASET_DIR, 'train'),
         target_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
+        batch_size=batch_size,
         class_mode='binary',
         classes=classes,  # FORCE ORDER
         shuffle=True
@@ -80,7 +124,7 @@ def build_generators():
     val_gen = val_test_datagen.flow_from_directory(
         os.path.join(DATASET_DIR, 'val'),
         target_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
+        batch_size=batch_size,
         class_mode='binary',
         classes=classes, # FORCE ORDER
         shuffle=False
@@ -89,7 +133,7 @@ def build_generators():
     test_gen = val_test_datagen.flow_from_directory(
         os.path.join(DATASET_DIR, 'test'),
         target_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
+        batch_size=batch_size,
         class_mode='binary',
         classes=classes, # FORCE ORDER
         shuffle=False
@@ -97,10 +141,10 @@ def build_generators():
     
     return train_gen, val_gen, test_gen
 
-def build_model():
-    print("Building MobileNetV2 Model...")
+def build_model(weights='imagenet', alpha=1.0, img_size=IMG_SIZE):
+    print(f"Building MobileNetV2 Model (alpha={alpha}, input={img_size[0]}x{img_size[1]})...")
     # Transfer Learning with MobileNetV2
-    base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=IMG_SIZE + (3,))
+    base_model = MobileNetV2(weights=weights, include_top=False, input_shape=tuple(img_size) + (3,), alpha=alpha)
     
     # Unfreeze the top layers for fine-tuning
     base_model.trainable = True
@@ -111,14 +155,55 @@ def build_model():
     x = base_model.output
     x = GlobalAveragePooling2D()(x)
     x = Dropout(0.2)(x) # Reduced dropout from 0.4 to 0.2
-    predictions = Dense(1, activation='sigmoid')(x)
+    # Keep the output in float32 so the sigmoid/loss stay stable under mixed precision
+    predictions = Dense(1, activation='sigmoid', dtype='float32')(x)
     
     model = Model(inputs=base_model.input, outputs=predictions)
     return model
 
-def train():
+def export_float32(model_path):
+    """Rebuilds a mixed precision checkpoint as a plain float32 model for serving."""
+    trained = tf.keras.models.load_model(model_path)
+    mixed_precision.set_global_policy('float32')
+    serving_model = build_model(weights=None)
+    serving_model.set_weights(trained.get_weights())
+    return serving_model
+
+def save_run_report(mode, record):
+    """Stores this run's timing/metrics and prints a comparison against the other mode."""
+    runs = {}
+    if os.path.exists(RUNS_REPORT_PATH):
+        with open(RUNS_REPORT_PATH, 'r') as f:
+            try:
+                runs = json.load(f)
+            except:
+                runs = {}
+    runs[mode] = record
+    with open(RUNS_REPORT_PATH, 'w') as f:
+        json.dump(runs, f, indent=2)
+
+    baseline, fast = runs.get('baseline'), runs.get('fast')
+    if baseline and fast:
+        print("\nFast vs Baseline:")
+        print(f"{'':<22}{'baseline':>12}{'fast':>12}")
+        for key in ['avg_epoch_seconds', 'total_seconds', 'test_accuracy', 'test_precision', 'test_recall']:
+            print(f"{key:<22}{baseline[key]:>12.4f}{fast[key]:>12.4f}")
+        print(f"Epoch speed-up: {baseline['avg_epoch_seconds'] / fast['avg_epoch_seconds']:.2f}x")
+
+def train(fast=False):
+    mode = 'fast' if fast else 'baseline'
+    batch_size = BATCH_SIZE
+    learning_rate = LEARNING_RATE
+    policy = 'float32'
+    if fast:
+        policy = enable_fast_mode()
+        batch_size = FAST_BATCH_SIZE
+        learning_rate = LEARNING_RATE * FAST_BATCH_SIZE / BATCH_SIZE
+        print(f"Fast mode: batch size {batch_size}, learning rate {learning_rate:g}, XLA on")
+    run_start = time.time()
+    
     # 1. Generators
-    train_gen, val_gen, test_gen = build_generators()
+    train_gen, val_gen, test_gen = build_generators(batch_size)
     
     # 2. Save Class Indices
     print(f"Class Indices: {train_gen.class_indices}")
@@ -134,26 +219,31 @@ def train():
     
     # 5. Compile
     model.compile(
-        optimizer=Adam(learning_rate=LEARNING_RATE),
+        optimizer=Adam(learning_rate=learning_rate),
         loss='binary_crossentropy',
-        metrics=['accuracy', tf.keras.metrics.Precision(name='precision'), tf.keras.metrics.Recall(name='recall')]
+        metrics=['accuracy', tf.keras.metrics.Precision(name='precision'), tf.keras.metrics.Recall(name='recall')],
+        jit_compile=fast  # XLA-compile the train step
     )
     
     # 6. Callbacks
-    checkpoint = ModelCheckpoint(FINAL_MODEL_PATH, monitor='val_accuracy', save_best_only=True, verbose=1)
+    # Improving epochs go to a checkpoint; final_model.h5 is only published once training is done
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    checkpoint = ModelCheckpoint(CHECKPOINT_PATH, monitor='val_accuracy', save_best_only=True, verbose=1)
     early_stop = EarlyStopping(monitor='val_loss', patience=8, restore_best_weights=True, verbose=1)
     reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1)
     sanity_check = SanityCheckCallback()
+    epoch_timer = EpochTimer()
     
     # 7. Train
     print("Starting Training...")
     history = model.fit(
         train_gen,
-        steps_per_epoch=train_gen.samples // BATCH_SIZE,
+        # Ceil (at least 1): at FAST_BATCH_SIZE a small split would otherwise give 0 steps
+        steps_per_epoch=max(1, math.ceil(train_gen.samples / batch_size)),
         validation_data=val_gen,
-        validation_steps=val_gen.samples // BATCH_SIZE,
+        validation_steps=max(1, math.ceil(val_gen.samples / batch_size)),
         epochs=EPOCHS,
-        callbacks=[checkpoint, early_stop, reduce_lr, sanity_check]
+        callbacks=[checkpoint, early_stop, reduce_lr, sanity_check, epoch_timer]
         # class_weight=class_weight_dict # Removed
     )
     
@@ -166,7 +256,11 @@ def train():
     # 9. Evaluate
     print("\nEvaluating on Test Set...")
     # Reload best model
-    model = tf.keras.models.load_model(FINAL_MODEL_PATH)
+    if policy != 'float32':
+        model = export_float32(CHECKPOINT_PATH)
+    else:
+        model = tf.keras.models.load_model(CHECKPOINT_PATH)
+    publish_model(model, FINAL_MODEL_PATH)
     
     preds = model.predict(test_gen)
     y_pred = (preds > 0.5).astype(int)
@@ -186,6 +280,78 @@ def train():
         print("\nCRITICAL: Model is predicting only one class!")
     else:
         print("\nSUCCESS: Model is predicting both classes.")
+    
+    # 10. Timing / metrics report
+    save_run_report(mode, {
+        'precision_policy': policy,
+        'batch_size': batch_size,
+        'learning_rate': learning_rate,
+        'epochs_run': len(epoch_timer.epoch_times),
+        'avg_epoch_seconds': float(np.mean(epoch_timer.epoch_times)),
+        'total_seconds': time.time() - run_start,
+        'test_accuracy': float((tp + tn) / cm.sum()),
+        'test_precision': float(tp / (tp + fp)) if (tp + fp) else 0.0,
+        'test_recall': float(tp / (tp + fn)) if (tp + fn) else 0.0
+    })
+
+def train_head():
+    """
+    Retrains only the classification head (Dropout -> Dense) of final_model.h5
+    on cached backbone embeddings, then writes the new head back into the model.
+    """
+    from embedding_cache import cache_embeddings
+    
+    # 1. Embeddings (backbone runs once per new image, cached by content hash)
+    model = tf.keras.models.load_model(FINAL_MODEL_PATH)
+    data = cache_embeddings(model)
+    x_train, y_train = data['train']
+    x_val, y_val = data['val']
+    x_test, y_test = data['test']
+    
+    # 2. Head model mirroring build_model()'s top
+    dense = next(layer for layer in reversed(model.layers) if isinstance(layer, Dense))
+    inputs = Input(shape=(x_train.shape[1],))
+    x = Dropout(0.2)(inputs)
+    outputs = Dense(1, activation='sigmoid')(x)
+    head = Model(inputs, outputs)
+    head.layers[-1].set_weights(dense.get_weights())  # Start from the current head
+    
+    head.compile(
+        optimizer=Adam(learning_rate=1e-3),
+        loss='binary_crossentropy',
+        metrics=['accuracy', tf.keras.metrics.Precision(name='precision'), tf.keras.metrics.Recall(name='recall')]
+    )
+    early_stop = EarlyStopping(monitor='val_loss', patience=15, restore_best_weights=True, verbose=1)
+    
+    print("Training head on cached embeddings...")
+    start = time.time()
+    head.fit(x_train, y_train, validation_data=(x_val, y_val), epochs=HEAD_EPOCHS,
+             batch_size=BATCH_SIZE, callbacks=[early_stop], verbose=2)
+    print(f"Head training took {time.time() - start:.1f}s")
+    
+    # 3. Evaluate + threshold sweep (quick calibration check)
+    preds = head.predict(x_test, verbose=0).reshape(-1)
+    y_true = y_test.astype(int)
+    print("\nConfusion Matrix:")
+    print(confusion_matrix(y_true, (preds > 0.5).astype(int)))
+    print("\nThreshold sweep (test accuracy):")
+    for threshold in [0.3, 0.4, 0.5, 0.6, 0.7]:
+        acc = np.mean((preds > threshold).astype(int) == y_true)
+        print(f"  {threshold:.1f}: {acc * 100:.2f}%")
+    
+    # 4. Write the head back into the full model
+    dense.set_weights(head.layers[-1].get_weights())
+    publish_model(model, FINAL_MODEL_PATH)
+    print(f"Updated head saved to {FINAL_MODEL_PATH}")
 
 if __name__ == '__main__':
-    train()
+    parser = argparse.ArgumentParser(description='Train the MobileNetV2 currency classifier.')
+    parser.add_argument('--fast', action='store_true',
+                        help='Mixed precision (bfloat16 on supported CPUs), XLA and large-batch training')
+    parser.add_argument('--head-only', action='store_true',
+                        help='Retrain only the classification head on cached backbone embeddings')
+    args = parser.parse_args()
+    if args.head_only:
+        train_head()
+    else:
+        train(fast=args.fast)
@@ -0,0 +1,151 @@
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from model_registry import registry
+
+# Configuration
+TTA_ENABLED = False          # Opt-in until the evaluation shows a gain for the serving model
+TTA_BAND = 0.15              # Re-score only when |score - threshold| < TTA_BAND
+# Views that stay close to the training distribution (the generators use small
+# rotations, zoom and flips). 'rot180', 'left' and 'right' are still available
+# but produce inputs the model never saw in training.
+TTA_VIEWS = ['hflip', 'rot+5', 'rot-5', 'crop90', 'box']
+CROP_FRACTION = 0.9          # Centre crop keeps 90% of each side
+TILE_FRACTION = 0.65         # Left/right tiles overlap in the middle of the note
+EVALUATION_PATH = 'tta_evaluation.json'
+
+
+def in_band(score, threshold, band=TTA_BAND):
+    return abs(score - threshold) < band
+
+
+def _resize(img, target_size, resample=Image.NEAREST):
+    # NEAREST matches preprocess_image and the training generators
+    return img.resize(target_size, resample)
+
+
+def _view(img, name, target_size):
+    w, h = img.size
+    if name == 'hflip':
+        return _resize(img.transpose(Image.FLIP_LEFT_RIGHT), target_size)
+    if name == 'rot180':
+        return _resize(img.transpose(Image.ROTATE_180), target_size)
+    if name.startswith('rot'):
+        return _resize(img.rotate(float(name[3:]), resample=Image.BILINEAR), target_size)
+    if name == 'crop90':
+        dx, dy = int(w * (1 - CROP_FRACTION) / 2), int(h * (1 - CROP_FRACTION) / 2)
+        return _resize(img.crop((dx, dy, w - dx, h - dy)), target_size)
+    # Tiles are cropped from the full-resolution image, so each carries more detail than the whole-note view
+    if name == 'left':
+        return _resize(img.crop((0, 0, int(w * TILE_FRACTION), h)), target_size)
+    if name == 'right':
+        return _resize(img.crop((w - int(w * TILE_FRACTION), 0, w, h)), target_size)
+    if name == 'box':
+        # Area-averaged downscale instead of NEAREST sampling
+        return _resize(img, target_size, Image.BOX)
+    raise ValueError(f'Unknown TTA view: {name}')
+
+
+def make_views(path, target_size=(224, 224), views=None):
+    """Decodes the upload once and returns a (K, H, W, 3) float32 batch of views."""
+    views = views or TTA_VIEWS
+    img = Image.open(path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    batch = np.stack([np.asarray(_view(img, name, target_size), dtype=np.float32) for name in views])
+    return batch / 255.0
+
+
+def refine(path, single_score, model_version, target_size=(224, 224)):
+    """
+    Scores all TTA views in one batched forward pass and averages them with
+    the original view. Returns (score, details).
+    """
+    batch = make_views(path, target_size)
+    scores, _ = registry.predict(batch, version=model_version, record=False)
+    return _combine(single_score, scores)
+
+
+def _combine(single_score, view_scores):
+    all_scores = np.concatenate([[single_score], np.asarray(view_scores).reshape(-1)])
+    score = float(np.mean(all_scores))
+    return score, {
+        'views': len(all_scores),
+        'single_score': float(single_score),
+        'spread': round(float(np.std(all_scores)), 4)
+    }
+
+
+# --- Evaluation ---
+
+def evaluate(split='test', limit=None, threshold=0.5, views=None):
+    """
+    Accuracy with and without TTA on a labelled split, overall and on the
+    borderline scans TTA would actually re-score, plus the added latency.
+    """
+    from model_loader import load_currency_model
+    from preprocess import preprocess_image
+    from embedding_cache import list_split
+
+    views = views or TTA_VIEWS
+    model = load_currency_model()
+    target_size = (model.input_shape[2], model.input_shape[1])
+    paths, labels = list_split(split)
+    if limit:
+        paths, labels = paths[:limit], labels[:limit]
+
+    single_correct, tta_correct = [], []
+    band_single, band_tta = [], []
+    flipped = 0
+    tta_ms = []
+    for path, label in zip(paths, labels):
+        single = float(model.predict(preprocess_image(path, target_size), verbose=0)[0][0])
+        score = single
+        if in_band(single, threshold):
+            start = time.perf_counter()
+            batch = make_views(path, target_size, views)
+            score, _ = _combine(single, model.predict(batch, verbose=0))
+            tta_ms.append((time.perf_counter() - start) * 1000)
+            band_single.append(int((single > threshold) == label))
+            band_tta.append(int((score > threshold) == label))
+            flipped += (single > threshold) != (score > threshold)
+        single_correct.append(int((single > threshold) == label))
+        tta_correct.append(int((score > threshold) == label))
+
+    def pct(rows):
+        return round(100 * sum(rows) / len(rows), 2) if rows else None
+
+    results = {
+        'split': split,
+        'images': len(paths),
+        'views': views,
+        'band': TTA_BAND,
+        'threshold': threshold,
+        'borderline_images': len(band_single),
+        'verdicts_flipped': int(flipped),
+        'accuracy': {'single': pct(single_correct), 'tta': pct(tta_correct)},
+        'borderline_accuracy': {'single': pct(band_single), 'tta': pct(band_tta)},
+        'tta_ms_mean': round(float(np.mean(tta_ms)), 2) if tta_ms else None
+    }
+    with open(EVALUATION_PATH, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{split}: {len(paths)} images, {len(band_single)} borderline, {flipped} verdict(s) flipped by TTA")
+    print(f"{'':>12}{'single':>10}{'tta':>10}")
+    for key in ('accuracy', 'borderline_accuracy'):
+        r = results[key]
+        print(f"{key.split('_')[0]:>12}{r['single'] if r['single'] is not None else '-':>10}"
+              f"{r['tta'] if r['tta'] is not None else '-':>10}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Test-time augmentation evaluation.')
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--views', nargs='+', default=None, help=f'Default: {" ".join(TTA_VIEWS)}')
+    args = parser.parse_args()
+    evaluate(args.split, args.limit, args.threshold, args.views)
@@ -0,0 +1,197 @@
+import os
+import io
+import time
+import fcntl
+import hashlib
+import threading
+from PIL import Image
+
+# Configuration
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_ROOT = os.path.join(BASE_DIR, 'uploads')
+MAX_STORE_BYTES = 2 * 1024 ** 3       # Oldest images are evicted beyond this
+MAX_AGE_DAYS = 30
+EVICTION_INTERVAL = 300               # Seconds between background eviction passes
+STORAGE_MAX_SIDE = None               # e.g. 1600 to keep downscaled storage copies (None = keep originals)
+STORAGE_JPEG_QUALITY = 90
+EVICTION_LOCK = '.evict.lock'         # In UPLOAD_ROOT; one worker process evicts at a time
+
+_eviction_thread = None
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def stored_name(digest, ext):
+    return f"{digest}.{ext}"
+
+
+def shard_dir(digest):
+    # Two levels of 256 directories keep every directory small at millions of images
+    return os.path.join(UPLOAD_ROOT, digest[:2], digest[2:4])
+
+
+def resolve(name):
+    """Absolute path for a stored name ('<sha256>.<ext>'), or None if it is not one."""
+    name = os.path.basename(name)
+    digest = name.split('.', 1)[0]
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    return os.path.join(shard_dir(digest), name)
+
+
+def _downscale(data, ext):
+    """
+    Returns (bytes, ext) of a storage copy whose longest side is
+    STORAGE_MAX_SIDE. Only the stored copy is reduced; callers score the
+    original upload bytes.
+    """
+    img = Image.open(io.BytesIO(data))
+    if max(img.size) <= STORAGE_MAX_SIDE:
+        return data, ext
+    img.draft('RGB', (STORAGE_MAX_SIDE, STORAGE_MAX_SIDE))
+    img = img.convert('RGB')
+    img.thumbnail((STORAGE_MAX_SIDE, STORAGE_MAX_SIDE), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=STORAGE_JPEG_QUALITY)
+    return out.getvalue(), 'jpg'
+
+
+def save_upload(data, ext):
+    """
+    Stores upload bytes under their content hash. Identical images are
+    stored once. Returns (digest, stored_name, absolute_path).
+    """
+    digest = content_hash(data)
+    ext = ext.lower()
+    if STORAGE_MAX_SIDE:
+        try:
+            data, ext = _downscale(data, ext)
+        except Exception as e:
+            print(f"Error downscaling upload, storing original: {e}")
+
+    name = stored_name(digest, ext)
+    directory = shard_dir(digest)
+    path = os.path.join(directory, name)
+
+    try:
+        os.utime(path)  # Already stored: refresh age so re-scanned notes are evicted last
+    except FileNotFoundError:
+        # New, or evicted since (also between an exists() check and utime, hence no check)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest, name, path
+
+
+def evict(max_bytes=MAX_STORE_BYTES, max_age_days=MAX_AGE_DAYS, cache_dirs=()):
+    """
+    Deletes images older than max_age_days, then the oldest until under
+    max_bytes. Images of confirmed counterfeits are kept (they are evidence
+    and feed the series index); scans whose image went are marked purged.
+    Files under cache_dirs (named '<digest>_...') follow the same age limit
+    and go with their image.
+    """
+    import history_store
+
+    cutoff = time.time() - max_age_days * 86400
+    protected = history_store.confirmed_fake_images()
+    files = []
+    total = 0
+    evicted = []
+
+    for root, _, names in os.walk(UPLOAD_ROOT):
+        for name in names:
+            if name in protected or name.endswith('.tmp') or name == EVICTION_LOCK:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Removed since the walk listed it
+            if stat.st_mtime < cutoff:
+                if _remove(path):
+                    evicted.append(name)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total > max_bytes:
+        files.sort()
+        for _, size, path in files:
+            if total <= max_bytes:
+                break
+            if _remove(path):
+                evicted.append(os.path.basename(path))
+            total -= size
+
+    if evicted:
+        history_store.mark_images_purged(evicted)
+        print(f"Upload store: evicted {len(evicted)} file(s), {total / 1024 ** 2:.1f} MB in use")
+
+    gone = {name.split('.', 1)[0] for name in evicted}
+    cached = 0
+    for cache_dir in cache_dirs:
+        for root, _, names in os.walk(cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if name.split('_', 1)[0] in gone or os.stat(path).st_mtime < cutoff:
+                        cached += _remove(path)
+                except FileNotFoundError:
+                    continue
+    if cached:
+        print(f"Upload store: removed {cached} cached file(s)")
+    return len(evicted)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def _eviction_leader():
+    """
+    Non-blocking exclusive lock on UPLOAD_ROOT/EVICTION_LOCK, held for the
+    life of the process, so only one worker walks the store. Returns the
+    open lock file, or None if another process holds it.
+    """
+    os.makedirs(UPLOAD_ROOT, exist_ok=True)
+    lock_file = open(os.path.join(UPLOAD_ROOT, EVICTION_LOCK), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_eviction(interval=EVICTION_INTERVAL, cache_dirs=()):
+    """
+    Runs evict() periodically on a daemon thread. Every worker starts one,
+    but only the lock holder evicts; the others retry the lock each interval
+    and take over if the holder exits.
+    """
+    global _eviction_thread
+
+    def _run():
+        lock_file = None
+        while True:
+            if lock_file is None:
+                lock_file = _eviction_leader()
+            if lock_file is not None:
+                try:
+                    evict(cache_dirs=cache_dirs)
+                except Exception as e:
+                    print(f"Upload eviction failed: {e}")
+            time.sleep(interval)
+
+    if _eviction_thread is None:
+        _eviction_thread = threading.Thread(target=_run, daemon=True)
+        _eviction_thread.start()
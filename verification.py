@@ -0,0 +1,50 @@
+from model_registry import registry
+import tta
+import tiled_inference
+import counterfeit_index
+
+
+def verdict(score, threshold):
+    """(result, confidence) for a score at a pipeline's decision threshold."""
+    if score > threshold:
+        return 'REAL', score * 100
+    return 'FAKE', (1 - score) * 100
+
+
+def finish(score, embedding, pipeline, model_version, image_source, tiles=None):
+    """
+    Everything after the model pass, shared by /predict and bulk_scan.py:
+    tile combination, TTA for borderline scores, the denomination threshold
+    and counterfeit-series matching. image_source (path or file object) is
+    only read when TTA runs; without one (pixel-only scans) TTA is skipped.
+    Returns the verdict fields of a scan record.
+    """
+    tile_details = None
+    if tiles is not None:
+        score, tile_details = tiled_inference.score_tiles(score, tiles, model_version)
+
+    # Borderline: re-score with augmented views in one batch
+    tta_details = None
+    if tta.TTA_ENABLED and image_source is not None and tta.in_band(score, pipeline.threshold):
+        try:
+            score, tta_details = tta.refine(image_source, score, model_version, registry.input_size(model_version))
+        except Exception as e:
+            print(f"TTA failed, using single-view score: {e}")
+
+    result, confidence = verdict(score, pipeline.threshold)
+    return {
+        'result': result,
+        'confidence': confidence,
+        'raw_score': float(score),
+        'denomination': pipeline.denomination,
+        'model_version': model_version,
+        'tiles': tile_details,
+        'tta': tta_details,
+        # Known counterfeit series: nearest admin-confirmed FAKE in embedding space
+        'counterfeit_match': counterfeit_index.match(embedding, model_version)
+    }
+
+
+def series_reason(match):
+    return (f"Closely matches a confirmed counterfeit from {match['timestamp']} "
+            f"(similarity {match['similarity']:.2f})")
@@ -0,0 +1,265 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from PIL import Image
+from model_registry import registry
+
+# Configuration
+WARMUP_ENABLED = True
+WARMUP_SIZE = (1600, 720)        # Synthetic note; larger than TILED_MIN_SIDE so the tiled path is traced too
+WARMUP_BATCH_SIZES = [1, 8, 16]  # /predict, TTA views and tiles (8), shadow batches (16)
+BENCHMARK_PATH = 'warmup_benchmark.json'  # First real /predict latency, warm-up off vs on (see benchmark())
+
+_state = {
+    'ready': False,
+    'warming': False,
+    'versions': {},              # version -> {'warmup_ms', 'batch_ms'}
+    'started_at': None,
+    'finished_at': None,
+    'error': None
+}
+_state_lock = threading.Lock()
+
+
+def _synthetic_note(path):
+    """Note-sized JPEG with enough structure (gradients, print-like texture) to exercise every stage."""
+    width, height = WARMUP_SIZE
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height))
+    base = np.stack([120 + 80 * x, 140 + 60 * y, 110 + 40 * x * y], axis=-1)
+    noise = rng.normal(0, 20, (height, width, 3))
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def _request_pass(path, version):
+    """The /predict work for one upload, with nothing recorded in history or statistics."""
+    from preprocess import preprocess_image
+    from explainability import analyze_image_quality
+    from denomination import route_denomination
+    import tta
+    import tiled_inference
+    import saliency
+    import counterfeit_index
+
+    target_size = registry.input_size(version)
+    tiles = None
+    if tiled_inference.TILED_ENABLED:
+        img_array, tiles = tiled_inference.preprocess_tiled(path, target_size)
+    else:
+        img_array = preprocess_image(path, target_size)
+    route_denomination(img_array, WARMUP_SIZE)
+
+    cam = None
+    if saliency.SALIENCY_ENABLED:
+        scores, cams, embeddings, _ = registry.predict_with_cam(img_array, version=version, record=False)
+        cam = cams[0]
+    else:
+        scores, embeddings, _ = registry.predict_with_embedding(img_array, version=version, record=False)
+    score = float(scores[0])
+    if tiles is not None:
+        score, _ = tiled_inference.score_tiles(score, tiles, version)
+    if tta.TTA_ENABLED:
+        tta.refine(path, score, version, target_size)
+    analyze_image_quality(path, saliency_reasons=saliency.describe(cam))
+    counterfeit_index.match(embeddings[0], version)
+    if cam is not None:
+        saliency.overlay(path, cam)
+
+
+def _trace_batches(version):
+    """Traces plain inference at every WARMUP_BATCH_SIZES batch size. Returns the warm time per size."""
+    width, height = registry.input_size(version)
+    batch_ms = {}
+    for batch_size in WARMUP_BATCH_SIZES:
+        batch = np.zeros((batch_size, height, width, 3), dtype=np.float32)
+        registry.predict(batch, version=version, record=False)   # Trace
+        batch_start = time.perf_counter()
+        registry.predict(batch, version=version, record=False)
+        batch_ms[batch_size] = round((time.perf_counter() - batch_start) * 1000, 1)
+    return batch_ms
+
+
+def warm_version(version):
+    """
+    Traces and initialises everything a request touches for `version`, so the
+    first real request does not pay for it. Returns the timings.
+    """
+    start = time.perf_counter()
+    fd, path = tempfile.mkstemp(suffix='.jpg')
+    os.close(fd)
+    try:
+        _synthetic_note(path)
+        _request_pass(path, version)
+        batch_ms = _trace_batches(version)
+    finally:
+        os.remove(path)
+
+    timings = {'warmup_ms': round((time.perf_counter() - start) * 1000, 1), 'batch_ms': batch_ms}
+    with _state_lock:
+        _state['versions'][version] = timings
+    print(f"Warmed up {version} in {timings['warmup_ms'] / 1000:.1f}s")
+    return timings
+
+
+def warm_model(version):
+    """
+    Hot-swap warm-up: the request path around the model (routing, decoders,
+    index, overlays) is already warm in this process. What is new is the
+    model's own inference (the /predict head and the batch sizes) and the
+    version's counterfeit index, read here before the version is activated.
+    """
+    import saliency
+    import counterfeit_index
+
+    start = time.perf_counter()
+    width, height = registry.input_size(version)
+    one = np.zeros((1, height, width, 3), dtype=np.float32)
+    if saliency.SALIENCY_ENABLED:
+        registry.predict_with_cam(one, version=version, record=False)
+    else:
+        registry.predict_with_embedding(one, version=version, record=False)
+    timings = {'batch_ms': _trace_batches(version), 'hot_swap': True}
+    index_start = time.perf_counter()
+    counterfeit_index.get_index(version).refresh()
+    timings['index_ms'] = round((time.perf_counter() - index_start) * 1000, 1)
+    with _state_lock:
+        _state['versions'][version] = timings
+    print(f"Warmed up {version} (hot swap) in {time.perf_counter() - start:.1f}s")
+    return timings
+
+
+def _run():
+    from denomination import DENOMINATION_CONFIG, get_pipeline
+    try:
+        # Per-denomination models load lazily; load them now so they are warmed too
+        versions = {registry.active_version}
+        for denomination in DENOMINATION_CONFIG:
+            versions.add(get_pipeline(denomination).model_version or registry.active_version)
+        for version in sorted(v for v in versions if v):
+            warm_version(version)
+    except Exception as e:
+        print(f"Warm-up failed, serving cold: {e}")
+        with _state_lock:
+            _state['error'] = str(e)
+    finally:
+        with _state_lock:
+            _state['warming'] = False
+            _state['ready'] = True
+            _state['finished_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def start():
+    """Warms every serving model in the background; readiness stays false until done."""
+    with _state_lock:
+        if _state['warming'] or _state['ready']:
+            return
+        if not WARMUP_ENABLED:
+            _state['ready'] = True
+            return
+        # Hot-swapped versions have their inference traced before they start serving
+        registry.warmup = warm_model
+        _state['warming'] = True
+        _state['started_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def status():
+    with _state_lock:
+        state = dict(_state, versions=dict(_state['versions']))
+    # A model that failed to load (or was never loaded) can't serve, warm or not
+    state['ready'] = state['ready'] and registry.active_version is not None
+    state['serving_version'] = registry.active_version
+    state['first_predict_ms'] = None
+    if os.path.exists(BENCHMARK_PATH):
+        with open(BENCHMARK_PATH, 'r') as f:
+            state['first_predict_ms'] = json.load(f)['first_predict_ms']
+    return state
+
+
+# --- Benchmark ---
+
+def _first_predict(image_path):
+    """
+    Child process of benchmark(): starts the app as a worker would (warm-up
+    per WARMUP_ENABLED), waits for /ready, then times the first real /predict.
+    Uploads, history and saliency maps go to a temp dir, not the live store.
+    """
+    import history_store
+    import upload_store
+    import saliency
+
+    tmp = tempfile.mkdtemp(prefix='warmup_benchmark_')
+    upload_store.UPLOAD_ROOT = os.path.join(tmp, 'uploads')
+    history_store.HISTORY_DB = os.path.join(tmp, 'scan_history.db')
+    saliency.SALIENCY_DIR = os.path.join(tmp, 'saliency')
+    import app as app_module
+
+    while not _state['ready']:
+        time.sleep(0.1)
+    if registry.active_version is None:
+        raise RuntimeError('No model loaded')
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    client = app_module.app.test_client()
+    start = time.perf_counter()
+    response = client.post('/predict', data={'file': (io.BytesIO(data), os.path.basename(image_path))},
+                           content_type='multipart/form-data')
+    elapsed = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        raise RuntimeError(f"/predict returned {response.status_code}: {response.get_json()}")
+    print(json.dumps({'ms': round(elapsed, 1)}))
+
+
+def benchmark(image_path=None):
+    """
+    First real /predict latency of a fresh worker with warm-up disabled and
+    enabled, each in its own process (the first request only happens once).
+    """
+    if image_path is None:
+        from template_index import FEATURES_ROOT
+        folder = os.path.join(FEATURES_ROOT, '500_dataset')
+        image_path = os.path.join(folder, sorted(os.listdir(folder))[0])
+
+    results = {}
+    for enabled in (False, True):
+        key = 'warmup_on' if enabled else 'warmup_off'
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--first-predict', image_path,
+             '--warmup', '1' if enabled else '0'],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            raise RuntimeError(f"{key} run failed:\n{out.stderr[-2000:]}")
+        results[key] = json.loads(out.stdout.strip().splitlines()[-1])['ms']
+        print(f"Warm-up {'on ' if enabled else 'off'}: first /predict {results[key]:.0f} ms")
+
+    report = {
+        'image': os.path.basename(image_path),
+        'first_predict_ms': results,
+        'measured_at': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    with open(BENCHMARK_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved to {BENCHMARK_PATH}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='First /predict latency of a fresh worker, warm-up off vs on.')
+    parser.add_argument('--image', help='Note image to scan (default: the first 500 reference note)')
+    parser.add_argument('--first-predict', metavar='IMAGE', help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', default='1', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_predict:
+        import warmup  # The module app imports, not this __main__ copy
+        warmup.WARMUP_ENABLED = args.warmup == '1'
+        warmup._first_predict(args.first_predict)
+    else:
+        benchmark(args.image)